@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:50
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Line changes were never tracked before, so existing carts start from their creation time
+BACKFILL_UPDATED_AT = "UPDATE cart_cart SET updated_at = created_at"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunSQL(BACKFILL_UPDATED_AT, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated_at'], name='cart_updated_at_idx'),
+        ),
+    ]
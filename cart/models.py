@@ -1,11 +1,44 @@
-from django.db import models
+from decimal import Decimal
+from django.db import connection, models
+from django.db.models import DecimalField, ExpressionWrapper, F, Prefetch, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from uuid import uuid4
 from django.conf import settings
 from catalogue.models import ProductVariant
 
+def line_total(prefix=''):
+    # quantity * (base price + variant adjustment), computed by the database
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * (
+            F(f'{prefix}product_variant__product__base_price') + F(f'{prefix}product_variant__price_adjustment')
+        ),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+class CartQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Everything CartSerializer renders: the grand total summed in SQL and
+        the lines (with their own totals) prefetched in a fixed number of
+        queries, however many lines the cart has.
+        """
+        return self.annotate(
+            grand_total=Coalesce(Sum(line_total('items__')), Value(Decimal('0.00')), output_field=DecimalField())
+        ).prefetch_related(Prefetch('items', queryset=CartItem.objects.with_details()))
+
+    def touch(self):
+        # Any change to a cart's lines counts as activity (see the abandoned-cart reaper)
+        # and gives the cart a new version (its ETag)
+        return self.update(updated_at=timezone.now(), version=F('version') + 1)
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last activity on the cart or its lines; the reaper range-scans the index on it
+    updated_at = models.DateTimeField(default=timezone.now)
+    # Bumped with every line change, in the same statement/transaction; the ETag of GET /cart/<id>/
+    version = models.PositiveIntegerField(default=1)
     
     # Optional: Link to a user if they are logged in
     user = models.ForeignKey(
@@ -15,18 +48,83 @@ class Cart(models.Model):
         blank=True
     )
 
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='cart_updated_at_idx'),
+        ]
+
     def __str__(self):
         return str(self.id)
 
     def get_total_price(self):
         return sum(item.get_total_price() for item in self.items.all())
 
+class CartItemQuerySet(models.QuerySet):
+    def with_details(self):
+        # The nested variant (product price, attribute names) plus the line total in SQL
+        return self.select_related('product_variant__product').prefetch_related(
+            'product_variant__attribute_values__attribute'
+        ).annotate(line_total=line_total()).order_by('id')
+
+class CartItemManager(models.Manager.from_queryset(CartItemQuerySet)):
+    def add(self, cart_id, product_variant_id, quantity=1):
+        """
+        Add `quantity` of a variant to a cart in one statement.
+        Returns (item id, new quantity, created), or None when the cart or
+        the variant doesn't exist.
+        """
+        rows = self.upsert(cart_id, {product_variant_id: quantity})
+        return rows[0] if rows else None
+
+    def upsert(self, cart_id, quantities, increment=True):
+        """
+        Write {variant id: quantity} into a cart with a single INSERT ... ON
+        CONFLICT DO UPDATE. With `increment` the quantities are added to the
+        existing lines inside the database, so concurrent adds of the same
+        variant can neither lose an update nor trip the (cart, product_variant)
+        unique constraint; without it they replace them.
+
+        The rows are SELECTed through a join on the cart and the variants, so
+        a missing cart or variant simply inserts nothing instead of relying on
+        the (deferred) foreign key checks. The same statement bumps the cart's
+        updated_at and version.
+        Returns [(item id, new quantity, created), ...] for the written lines.
+        """
+        if not quantities:
+            return []
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        carts = connection.ops.quote_name(Cart._meta.db_table)
+        variants = connection.ops.quote_name(ProductVariant._meta.db_table)
+        values = ', '.join(['(%s::bigint, %s::integer)'] * len(quantities))
+        new_quantity = f'{table}.quantity + EXCLUDED.quantity' if increment else 'EXCLUDED.quantity'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH c AS (UPDATE {carts} SET updated_at = %s, version = version + 1 WHERE id = %s RETURNING id)
+                INSERT INTO {table} (cart_id, product_variant_id, quantity)
+                SELECT c.id, v.id, q.quantity
+                FROM (VALUES {values}) AS q (variant_id, quantity)
+                JOIN {variants} v ON v.id = q.variant_id
+                CROSS JOIN c
+                ON CONFLICT (cart_id, product_variant_id)
+                DO UPDATE SET quantity = {new_quantity}
+                RETURNING id, quantity, (xmax = 0)
+                """,
+                [timezone.now(), cart_id] + [param for pair in quantities.items() for param in pair],
+            )
+            # xmax is 0 only on a freshly inserted row
+            return cursor.fetchall()
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
    
     product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField(default=1)
 
+    objects = CartItemManager()
+
     class Meta:
         unique_together = [['cart', 'product_variant']] # Prevent duplicate rows for same item
 
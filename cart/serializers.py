@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Cart, CartItem
+from catalogue.models import ProductVariant
 from catalogue.serializers import ProductVariantSerializer
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -13,6 +14,9 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product_variant', 'quantity', 'sub_total']
 
     def get_sub_total(self, obj):
+        # Annotated by CartItem.objects.with_details(); computed in Python otherwise
+        if hasattr(obj, 'line_total'):
+            return obj.line_total
         return obj.get_total_price()
 
 class CartSerializer(serializers.ModelSerializer):
@@ -25,18 +29,69 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'items', 'grand_total']
 
     def get_grand_total(self, obj):
+        # Annotated by Cart.objects.with_details(); computed in Python otherwise
+        if hasattr(obj, 'grand_total'):
+            return obj.grand_total
         return obj.get_total_price()
 
 # Special Serializer just for ADDING items (keeps the API simple)
+# (the variant's existence is checked by the foreign key during the upsert, see CartItemViewSet.create)
 class AddCartItemSerializer(serializers.ModelSerializer):
-    product_variant_id = serializers.IntegerField()
+    # Within bigint, so a DataError from the upsert can only be about the quantity
+    product_variant_id = serializers.IntegerField(max_value=2**63 - 1)
+    quantity = serializers.IntegerField(min_value=1, max_value=32767, default=1)
 
     class Meta:
         model = CartItem
         fields = ['product_variant_id', 'quantity']
 
-    def validate_product_variant_id(self, value):
-        from catalogue.models import ProductVariant
-        if not ProductVariant.objects.filter(id=value).exists():
-            raise serializers.ValidationError("This product variant does not exist.")
-        return value
\ No newline at end of file
+# Batch edits: [{"op": "set"|"increment"|"remove", "product_variant_id": 1, "quantity": 2}, ...]
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['set', 'increment', 'remove'])
+    product_variant_id = serializers.IntegerField(max_value=2**63 - 1)
+    quantity = serializers.IntegerField(min_value=0, max_value=32767, required=False)
+
+    def validate(self, data):
+        if data['op'] == 'set' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': "Required for 'set'."})
+        if data['op'] == 'increment' and not data.get('quantity', 1):
+            raise serializers.ValidationError({'quantity': "Must be at least 1 for 'increment'."})
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_operations(self, operations):
+        # Every variant id checked with one query
+        ids = {operation['product_variant_id'] for operation in operations}
+        found = set(ProductVariant.objects.filter(id__in=ids).values_list('id', flat=True))
+        if ids - found:
+            raise serializers.ValidationError(f"Unknown product variants: {sorted(ids - found)}")
+        return operations
+
+    def get_plan(self):
+        """
+        Fold the operations, in order, into one final change per variant:
+        {'set': {variant: qty}, 'increment': {variant: qty}, 'remove': {variant, ...}}
+        """
+        changes = {}
+        for operation in self.validated_data['operations']:
+            variant, op = operation['product_variant_id'], operation['op']
+            quantity = operation.get('quantity', 1)
+            previous = changes.get(variant)
+            if op == 'increment' and previous is not None:
+                # After a set/remove the final quantity is known outright
+                base = 0 if previous[0] == 'remove' else previous[1]
+                changes[variant] = ('increment' if previous[0] == 'increment' else 'set', base + quantity)
+            elif op == 'set' and quantity == 0:
+                changes[variant] = ('remove', 0)
+            else:
+                changes[variant] = (op, quantity)
+
+        plan = {'set': {}, 'increment': {}, 'remove': set()}
+        for variant, (op, quantity) in changes.items():
+            if op == 'remove':
+                plan['remove'].add(variant)
+            else:
+                plan[op][variant] = quantity
+        return plan
@@ -0,0 +1,390 @@
+"""
+Cart storage engines.
+
+CartViewSet, CartItemViewSet and the checkout only talk to get_cart_store(),
+which returns the engine named by settings.CART_STORE:
+
+    'cart.stores.DatabaseCartStore'   Cart / CartItem rows in Postgres (default)
+    'cart.stores.RedisCartStore'      Redis hashes, written behind to Postgres
+
+Both hand back the same objects: a Cart with `grand_total` and its `items`
+prefetched, each CartItem with `line_total` and its variant loaded. So the
+serializers, and the API, are the same whichever engine is configured.
+
+With Redis, every add/edit is a hash write. Carts reach Postgres only when
+flush_cart_store (a periodic Celery task) writes the dirty ones behind. A
+cart that is no longer in Redis (expired, Redis restarted) is read back from
+that copy. In this store an item's id is its variant id.
+
+Deleting a Redis cart (checkout) races the write-behind: a flush may have
+read the cart just before. So both sides take the same per-cart Postgres
+advisory lock, and a flush waits for a delete that is still in flight. The
+delete marks the cart as being deleted right away, and only once the
+caller's transaction commits leaves a tombstone and drops the hashes. A flush
+leaves tombstoned carts out, so a deleted cart never comes back. It puts back
+carts still marked as being deleted, whose outcome it can't know yet; if
+the checkout rolled back, the mark expires and the cart is written behind as
+usual.
+"""
+import uuid
+from decimal import Decimal
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.db import DataError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from catalogue.models import ProductVariant
+from .models import Cart, CartItem
+
+MAX_QUANTITY = 32767 # CartItem.quantity is a smallint
+
+
+class CartQuantityError(ValueError):
+    pass
+
+
+def get_cart_store():
+    return _load_store(getattr(settings, 'CART_STORE', 'cart.stores.DatabaseCartStore'))
+
+
+@lru_cache(maxsize=None)
+def _load_store(path):
+    return import_string(path)()
+
+
+# 1. Postgres (the original behaviour)
+class DatabaseCartStore:
+
+    def create(self, user=None):
+        cart = Cart.objects.create(user=user)
+        return self.get(cart.id)
+
+    def get(self, cart_id):
+        return Cart.objects.with_details().filter(id=cart_id).first()
+
+    def exists(self, cart_id):
+        return Cart.objects.filter(id=cart_id).exists()
+
+    def get_version(self, cart_id):
+        """(version, updated_at) without loading the lines, or None if there's no such cart."""
+        return Cart.objects.filter(id=cart_id).values_list('version', 'updated_at').first()
+
+    def delete(self, cart_id):
+        deleted, _ = Cart.objects.filter(id=cart_id).delete()
+        return deleted > 0
+
+    def get_items(self, cart_id):
+        return list(CartItem.objects.filter(cart_id=cart_id).with_details())
+
+    def get_item(self, cart_id, item_id):
+        return CartItem.objects.filter(cart_id=cart_id, id=item_id).with_details().first()
+
+    def add(self, cart_id, variant_id, quantity):
+        """Returns (item, created), or None if the cart or the variant doesn't exist."""
+        try:
+            with transaction.atomic():
+                row = CartItem.objects.add(cart_id, variant_id, quantity)
+        except DataError:
+            raise CartQuantityError("Quantity is too large.")
+        if row is None:
+            return None
+        item_id, _, created = row
+        return self.get_item(cart_id, item_id), created
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        with transaction.atomic():
+            if not CartItem.objects.filter(cart_id=cart_id, id=item_id).update(quantity=quantity):
+                return None
+            Cart.objects.filter(id=cart_id).touch()
+        return self.get_item(cart_id, item_id)
+
+    def remove(self, cart_id, item_id):
+        with transaction.atomic():
+            deleted, _ = CartItem.objects.filter(cart_id=cart_id, id=item_id).delete()
+            if deleted:
+                Cart.objects.filter(id=cart_id).touch()
+        return deleted > 0
+
+    def apply(self, cart_id, plan):
+        # One transaction, at most three statements whatever the number of lines
+        try:
+            with transaction.atomic():
+                if plan['remove']:
+                    CartItem.objects.filter(cart_id=cart_id, product_variant_id__in=plan['remove']).delete()
+                    if not (plan['set'] or plan['increment']):
+                        Cart.objects.filter(id=cart_id).touch() # otherwise the upserts do it
+                CartItem.objects.upsert(cart_id, plan['set'], increment=False)
+                CartItem.objects.upsert(cart_id, plan['increment'])
+        except DataError:
+            raise CartQuantityError("A quantity is too large.")
+
+    def flush(self, limit=None):
+        # Nothing is buffered
+        return 0
+
+
+# 2. Redis hashes with write-behind
+class RedisCartStore:
+    """
+    cart:<id>          hash  created_at, updated_at, version, user_id
+    cart:<id>:items    hash  variant id -> quantity
+    cart:<id>:deleted  str   tombstone: deleted, never write it behind again
+    cart:<id>:deleting str   a delete whose transaction hasn't committed yet (short-lived)
+    carts:dirty        set   carts changed since the last flush
+    """
+    DIRTY_KEY = 'carts:dirty'
+    DELETING_TTL = 60 # seconds a rolled-back delete holds its cart back from the write-behind
+
+    def __init__(self, url=None, ttl=None):
+        self.redis = redis.Redis.from_url(url or settings.CART_REDIS_URL)
+        self.ttl = ttl or getattr(settings, 'CART_REDIS_TTL', 60 * 60 * 24 * 30)
+
+    def meta_key(self, cart_id):
+        return f'cart:{cart_id}'
+
+    def items_key(self, cart_id):
+        return f'cart:{cart_id}:items'
+
+    def tombstone_key(self, cart_id):
+        return f'cart:{cart_id}:deleted'
+
+    def deleting_key(self, cart_id):
+        return f'cart:{cart_id}:deleting'
+
+    def create(self, user=None):
+        cart_id = uuid.uuid4()
+        pipe = self.redis.pipeline()
+        pipe.hset(self.meta_key(cart_id), mapping={
+            'created_at': timezone.now().isoformat(), 'user_id': user.pk if user else '',
+        })
+        self._touch(pipe, cart_id)
+        pipe.execute()
+        return self.get(cart_id)
+
+    def get(self, cart_id):
+        if not self.exists(cart_id):
+            return None
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self.meta_key(cart_id))
+        pipe.hgetall(self.items_key(cart_id))
+        meta, items = pipe.execute()
+        return self._render(cart_id, meta, {int(v): int(q) for v, q in items.items()})
+
+    def exists(self, cart_id):
+        return bool(self.redis.exists(self.meta_key(cart_id))) or self._load(cart_id)
+
+    def get_version(self, cart_id):
+        version, updated_at = self.redis.hmget(self.meta_key(cart_id), 'version', 'updated_at')
+        if updated_at is None:
+            if not self._load(cart_id):
+                return None
+            version, updated_at = self.redis.hmget(self.meta_key(cart_id), 'version', 'updated_at')
+        return int(version or 1), parse_datetime(updated_at.decode())
+
+    def delete(self, cart_id):
+        existed = self.exists(cart_id)
+        with transaction.atomic():
+            # Held until the caller ends: a flush of this cart waits for us
+            _lock_carts([cart_id])
+            self.redis.set(self.deleting_key(cart_id), 1, ex=self.DELETING_TTL)
+            # The persisted copy goes with the caller's transaction, the rest once it commits
+            Cart.objects.filter(id=cart_id).delete()
+
+        def deleted():
+            pipe = self.redis.pipeline()
+            pipe.set(self.tombstone_key(cart_id), 1, ex=self.ttl)
+            pipe.srem(self.DIRTY_KEY, str(cart_id))
+            pipe.delete(self.meta_key(cart_id), self.items_key(cart_id), self.deleting_key(cart_id))
+            pipe.execute()
+        transaction.on_commit(deleted)
+        return existed
+
+    def get_items(self, cart_id):
+        cart = self.get(cart_id)
+        return list(cart.items.all()) if cart else []
+
+    def get_item(self, cart_id, item_id):
+        return next((item for item in self.get_items(cart_id) if item.id == item_id), None)
+
+    def add(self, cart_id, variant_id, quantity):
+        if not self.exists(cart_id) or not ProductVariant.objects.filter(id=variant_id).exists():
+            return None
+        # HINCRBY is atomic, so concurrent adds never lose an update; the version moves in the same MULTI
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self.items_key(cart_id), variant_id, quantity)
+        self._touch(pipe, cart_id)
+        new_quantity = pipe.execute()[0]
+        if new_quantity > MAX_QUANTITY:
+            self.redis.hincrby(self.items_key(cart_id), variant_id, -quantity)
+            raise CartQuantityError("Quantity is too large.")
+        return self.get_item(cart_id, variant_id), new_quantity == quantity
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        if not self.exists(cart_id) or not self.redis.hexists(self.items_key(cart_id), item_id):
+            return None
+        pipe = self.redis.pipeline()
+        pipe.hset(self.items_key(cart_id), item_id, quantity)
+        self._touch(pipe, cart_id)
+        pipe.execute()
+        return self.get_item(cart_id, item_id)
+
+    def remove(self, cart_id, item_id):
+        if not self.exists(cart_id) or not self.redis.hexists(self.items_key(cart_id), item_id):
+            return False
+        # The line and the version change in the same MULTI
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.items_key(cart_id), item_id)
+        self._touch(pipe, cart_id)
+        return bool(pipe.execute()[0])
+
+    def apply(self, cart_id, plan):
+        # Optimistic: read the lines, check the final quantities, write them all in one MULTI
+        key = self.items_key(cart_id)
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    current = {int(v): int(q) for v, q in pipe.hgetall(key).items()}
+                    final = {**plan['set']}
+                    for variant, quantity in plan['increment'].items():
+                        final[variant] = current.get(variant, 0) + quantity
+                    if any(quantity > MAX_QUANTITY for quantity in final.values()):
+                        raise CartQuantityError("A quantity is too large.")
+                    pipe.multi()
+                    if plan['remove']:
+                        pipe.hdel(key, *plan['remove'])
+                    if final:
+                        pipe.hset(key, mapping=final)
+                    self._touch(pipe, cart_id)
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+
+    def flush(self, limit=500):
+        """Write up to `limit` dirty carts to Postgres. Returns how many were taken off the dirty set."""
+        cart_ids = [cart_id.decode() for cart_id in self.redis.spop(self.DIRTY_KEY, limit) or []]
+        if not cart_ids:
+            return 0
+        try:
+            self._persist(self._snapshot(cart_ids))
+        except Exception:
+            # Try these again on the next run
+            self.redis.sadd(self.DIRTY_KEY, *cart_ids)
+            raise
+        return len(cart_ids)
+
+    def _snapshot(self, cart_ids):
+        pipe = self.redis.pipeline()
+        for cart_id in cart_ids:
+            pipe.hgetall(self.meta_key(cart_id))
+            pipe.hgetall(self.items_key(cart_id))
+        results = pipe.execute()
+        return {
+            cart_id: (meta, {int(v): int(q) for v, q in items.items()})
+            for cart_id, meta, items in zip(cart_ids, results[::2], results[1::2])
+            if meta # deleted or expired since it was marked dirty
+        }
+
+    def _persist(self, snapshots):
+        variant_ids = {variant for _, items in snapshots.values() for variant in items}
+        live = set(ProductVariant.objects.filter(id__in=variant_ids).values_list('id', flat=True))
+        with transaction.atomic():
+            # Deletes in flight end first; then drop the carts deleted since the snapshot was taken
+            _lock_carts(snapshots)
+            pipe = self.redis.pipeline()
+            for cart_id in snapshots:
+                pipe.exists(self.meta_key(cart_id))
+                pipe.exists(self.tombstone_key(cart_id))
+                pipe.exists(self.deleting_key(cart_id))
+            results = pipe.execute()
+            states = dict(zip(snapshots, zip(results[::3], results[1::3], results[2::3])))
+            # Committed, but its on_commit hook hasn't run yet; or rolled back. The next flush will know
+            undecided = [cart_id for cart_id, (_, deleted, deleting) in states.items() if deleting and not deleted]
+            if undecided:
+                self.redis.sadd(self.DIRTY_KEY, *undecided)
+            snapshots = {
+                cart_id: snapshot for cart_id, snapshot in snapshots.items()
+                if states[cart_id][0] and not states[cart_id][1] and not states[cart_id][2]
+            }
+            if not snapshots:
+                return
+            Cart.objects.bulk_create(
+                [self._cart(cart_id, meta) for cart_id, (meta, _) in snapshots.items()],
+                update_conflicts=True, unique_fields=['id'], update_fields=['updated_at', 'version'],
+            )
+            CartItem.objects.filter(cart_id__in=snapshots).delete()
+            CartItem.objects.bulk_create([
+                CartItem(cart_id=cart_id, product_variant_id=variant, quantity=quantity)
+                for cart_id, (_, items) in snapshots.items()
+                for variant, quantity in items.items() if variant in live
+            ])
+
+    def _load(self, cart_id):
+        # Read-through: bring a persisted cart back into Redis
+        cart = Cart.objects.filter(id=cart_id).first()
+        if cart is None:
+            return False
+        items = dict(cart.items.values_list('product_variant_id', 'quantity'))
+        pipe = self.redis.pipeline()
+        pipe.hset(self.meta_key(cart_id), mapping={
+            'created_at': cart.created_at.isoformat(), 'updated_at': cart.updated_at.isoformat(),
+            'version': cart.version, 'user_id': cart.user_id or '',
+        })
+        if items:
+            pipe.hset(self.items_key(cart_id), mapping=items)
+        pipe.expire(self.meta_key(cart_id), self.ttl)
+        pipe.expire(self.items_key(cart_id), self.ttl)
+        pipe.execute()
+        return True
+
+    def _touch(self, pipe, cart_id):
+        pipe.hset(self.meta_key(cart_id), 'updated_at', timezone.now().isoformat())
+        pipe.hincrby(self.meta_key(cart_id), 'version', 1)
+        pipe.expire(self.meta_key(cart_id), self.ttl)
+        pipe.expire(self.items_key(cart_id), self.ttl)
+        pipe.sadd(self.DIRTY_KEY, str(cart_id))
+
+    def _cart(self, cart_id, meta):
+        user_id = meta.get(b'user_id', b'').decode()
+        created_at = parse_datetime(meta[b'created_at'].decode())
+        return Cart(
+            id=uuid.UUID(str(cart_id)),
+            created_at=created_at,
+            updated_at=parse_datetime(meta[b'updated_at'].decode()) if b'updated_at' in meta else created_at,
+            version=int(meta.get(b'version', 1)),
+            user_id=int(user_id) if user_id else None,
+        )
+
+    def _render(self, cart_id, meta, quantities):
+        """Build the same Cart/CartItem objects DatabaseCartStore returns, with one variant query."""
+        cart = self._cart(cart_id, meta)
+        variants = ProductVariant.objects.select_related('product').prefetch_related(
+            'attribute_values__attribute'
+        ).in_bulk(list(quantities)) if quantities else {}
+
+        items = []
+        for variant_id in sorted(quantities):
+            variant = variants.get(variant_id)
+            if variant is None:
+                continue # deleted from the catalogue since it was added
+            item = CartItem(id=variant_id, cart=cart, product_variant=variant, quantity=quantities[variant_id])
+            item.line_total = item.quantity * (variant.product.base_price + variant.price_adjustment)
+            items.append(item)
+
+        cart.grand_total = sum((item.line_total for item in items), Decimal('0.00'))
+        cart._prefetched_objects_cache = {'items': items}
+        return cart
+
+
+def _lock_carts(cart_ids):
+    # Per-cart advisory locks, held to the end of the transaction; taken in sorted order so flushes never deadlock
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(hashtextextended('cart:' || id, 0)) FROM unnest(%s::text[]) id",
+            [sorted(str(cart_id) for cart_id in cart_ids)],
+        )
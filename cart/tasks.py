@@ -0,0 +1,66 @@
+import logging
+import time
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart
+from .stores import get_cart_store
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def flush_cart_store(batch_size=500):
+    """
+    Write-behind for RedisCartStore: copies the carts changed since the last
+    run into Postgres. A no-op with the database store.
+    """
+    store = get_cart_store()
+    flushed = 0
+    while True:
+        batch = store.flush(batch_size)
+        flushed += batch
+        if batch < batch_size:
+            return f"Flushed {flushed} cart(s)"
+
+
+@shared_task
+def reap_abandoned_carts(max_age_days=None, batch_size=None, pause=None):
+    """
+    Deletes carts (and their lines) with no activity for CART_ABANDONED_AFTER_DAYS.
+
+    Works oldest-first in small batches, each its own short transaction, so
+    no lock is held for long; the candidates come from a range scan on the
+    updated_at index and rows someone else has locked (a cart being edited or
+    checked out right now) are skipped until the next run.
+    """
+    max_age_days = max_age_days or getattr(settings, 'CART_ABANDONED_AFTER_DAYS', 14)
+    batch_size = batch_size or getattr(settings, 'CART_REAPER_BATCH_SIZE', 500)
+    pause = getattr(settings, 'CART_REAPER_PAUSE', 0.1) if pause is None else pause
+
+    started = time.monotonic()
+    cutoff = timezone.now() - timedelta(days=max_age_days)
+    carts = items = 0
+    while True:
+        with transaction.atomic():
+            stale = Cart.objects.filter(updated_at__lt=cutoff)
+            ids = list(
+                stale.order_by('updated_at').select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            # Re-checks the age: a cart touched since the SELECT above keeps its lines
+            _, deleted = stale.filter(id__in=ids).delete()
+        carts += deleted.get('cart.Cart', 0)
+        items += deleted.get('cart.CartItem', 0)
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+
+    duration = time.monotonic() - started
+    logger.info("Reaped %d abandoned carts (%d lines) in %.2fs", carts, items, duration)
+    return {'carts': carts, 'items': items, 'seconds': round(duration, 3)}
@@ -1,3 +1,538 @@
-from django.test import TestCase
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from catalogue.inventory import InsufficientStock
+from catalogue.models import Attribute, AttributeValue, Product, ProductVariant
+from core.models import User
+from core.testing import QueryBudgetMixin
+from orders.models import Order
+from .models import Cart, CartItem
+from .stores import get_cart_store
+from .tasks import flush_cart_store, reap_abandoned_carts
+
+
+def quantities(cart):
+    # Read through the configured store, so the same assertions cover Postgres and Redis
+    return {item.product_variant_id: item.quantity for item in get_cart_store().get_items(cart.id)}
+
+
+class AddToCartTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-S", price_adjustment=5)
+        self.cart = Cart.objects.create()
+        self.url = f'/api/v1/cart/{self.cart.id}/items/'
+
+    def add(self, variant_id, quantity=None, url=None):
+        data = {'product_variant_id': variant_id}
+        if quantity is not None:
+            data['quantity'] = quantity
+        return self.client.post(url or self.url, data, format='json')
+
+    # --- TEST 1: First add creates the line, the next one increments it ---
+    def test_add_then_increment(self):
+        response = self.add(self.variant.id, 2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['quantity'], response.data['sub_total']), (2, 210))
+
+        response = self.add(self.variant.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['quantity'], 3)
+        self.assertEqual(quantities(self.cart), {self.variant.id: 3})
+
+    # --- TEST 2: The write is a single statement ---
+    def test_single_statement(self):
+        with CaptureQueriesContext(connection) as context:
+            self.add(self.variant.id)
+        writes = [q['sql'] for q in context.captured_queries if q['sql'].lstrip().upper().startswith(('WITH', 'INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('ON CONFLICT', writes[0])
+
+    # --- TEST 3: Unknown variants, unknown carts and bad quantities ---
+    def test_rejections(self):
+        self.assertEqual(self.add(999).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.add(self.variant.id, 0).status_code, status.HTTP_400_BAD_REQUEST)
+        # Out of bigint range is an unknown variant, not a "quantity too large"
+        response = self.add(2**70)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('product_variant_id', response.data)
+        missing = '/api/v1/cart/00000000-0000-0000-0000-000000000000/items/'
+        self.assertEqual(self.add(self.variant.id, url=missing).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.add(self.variant.id, 32000)
+        self.assertEqual(self.add(self.variant.id, 1000).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(quantities(self.cart), {self.variant.id: 32000})
+
+
+class CartBatchTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.small, self.medium, self.large = [
+            ProductVariant.objects.create(product=product, sku_variant=f"AIRMAX-{size}") for size in ("S", "M", "L")
+        ]
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product_variant=self.small, quantity=1)
+        CartItem.objects.create(cart=self.cart, product_variant=self.medium, quantity=4)
+        self.url = f'/api/v1/cart/{self.cart.id}/items/batch/'
+
+    def batch(self, *operations):
+        return self.client.post(self.url, {'operations': list(operations)}, format='json')
+
+    def quantities(self):
+        return quantities(self.cart)
+
+    # --- TEST 1: set, increment and remove in one request, applied in order ---
+    def test_mixed_operations(self):
+        response = self.batch(
+            {'op': 'increment', 'product_variant_id': self.small.id, 'quantity': 2},
+            {'op': 'remove', 'product_variant_id': self.medium.id},
+            {'op': 'set', 'product_variant_id': self.large.id, 'quantity': 5},
+            {'op': 'increment', 'product_variant_id': self.large.id},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.quantities(), {self.small.id: 3, self.large.id: 6})
+        self.assertEqual(len(response.data['items']), 2)
+        self.assertEqual(response.data['grand_total'], 900)
+
+    # --- TEST 2: A set to 0 removes the line; a later increment brings it back ---
+    def test_set_zero_then_increment(self):
+        self.batch(
+            {'op': 'set', 'product_variant_id': self.small.id, 'quantity': 0},
+            {'op': 'remove', 'product_variant_id': self.medium.id},
+            {'op': 'increment', 'product_variant_id': self.medium.id, 'quantity': 2},
+        )
+        self.assertEqual(self.quantities(), {self.medium.id: 2})
+
+    # --- TEST 3: One bad operation rejects the whole batch ---
+    def test_all_or_nothing(self):
+        response = self.batch(
+            {'op': 'set', 'product_variant_id': self.small.id, 'quantity': 9},
+            {'op': 'set', 'product_variant_id': 999, 'quantity': 1},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.batch(
+            {'op': 'set', 'product_variant_id': self.small.id, 'quantity': 9},
+            {'op': 'increment', 'product_variant_id': self.medium.id, 'quantity': 32767},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.quantities(), {self.small.id: 1, self.medium.id: 4})
+        self.assertEqual(self.batch({'op': 'set', 'product_variant_id': self.small.id}).status_code, 400)
+        response = self.batch({'op': 'set', 'product_variant_id': 2**70, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('product_variant_id', response.data['operations'][0])
+
+    # --- TEST 4: Writes don't grow with the number of operations ---
+    def test_statement_count(self):
+        def writes(*operations):
+            with CaptureQueriesContext(connection) as context:
+                self.batch(*operations)
+            return [q for q in context.captured_queries if q['sql'].lstrip().upper().startswith(('WITH', 'INSERT', 'UPDATE', 'DELETE'))]
+
+        few = writes({'op': 'set', 'product_variant_id': self.small.id, 'quantity': 2})
+        operations = [
+            {'op': op, 'product_variant_id': variant.id, 'quantity': 3}
+            for variant in (self.small, self.medium, self.large) for op in ('set', 'increment', 'remove')
+        ]
+        operations += [
+            {'op': 'set', 'product_variant_id': self.small.id, 'quantity': 1},
+            {'op': 'increment', 'product_variant_id': self.large.id},
+        ]
+        many = writes(*operations)
+        self.assertEqual(len(few), 1)
+        self.assertLessEqual(len(many), 3)
+
+
+class CartQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    """
+    Totals come from SQL and the nested variants are prefetched, so a cart
+    costs the same number of queries whatever its size.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.size = Attribute.objects.create(name="Size")
+        self.cart = Cart.objects.create()
+        self.lines = 0
+        self.add_lines(1)
+
+    def add_lines(self, count):
+        for _ in range(count):
+            self.lines += 1
+            product = Product.objects.create(name=f"Shoe {self.lines}", base_price=10 * self.lines, sku_base=f"SHOE-{self.lines}")
+            variant = ProductVariant.objects.create(product=product, sku_variant=f"SHOE-{self.lines}-S", price_adjustment=1)
+            variant.attribute_values.add(AttributeValue.objects.create(attribute=self.size, value=str(self.lines)))
+            CartItem.objects.create(cart=self.cart, product_variant=variant, quantity=2)
+
+    # --- TEST 1: Retrieving a cart (and its lines) doesn't grow with the number of lines ---
+    def test_constant_queries(self):
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/v1/cart/{self.cart.id}/'), lambda: self.add_lines(30)
+        )
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/v1/cart/{self.cart.id}/items/'), lambda: self.add_lines(5)
+        )
+
+    # --- TEST 2: SQL totals match the Python ones ---
+    def test_totals(self):
+        self.add_lines(2)
+        response = self.client.get(f'/api/v1/cart/{self.cart.id}/')
+        self.assertEqual([item['sub_total'] for item in response.data['items']], [22, 42, 62])
+        self.assertEqual(response.data['grand_total'], self.cart.get_total_price())
+        self.assertEqual(response.data['items'][0]['product_variant']['name'], "1")
+        empty = Cart.objects.create()
+        self.assertEqual(self.client.get(f'/api/v1/cart/{empty.id}/').data['grand_total'], 0)
+
+
+class AddToCartConcurrencyTests(TransactionTestCase):
+    """
+    Real concurrent transactions (hence TransactionTestCase): every add must count.
+    """
+    ADDS = 300
+    WORKERS = 16
+
+    def setUp(self):
+        cache.clear()
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variants = [
+            ProductVariant.objects.create(product=product, sku_variant=f"AIRMAX-{size}") for size in ("S", "M")
+        ]
+        self.cart = Cart.objects.create()
+
+    def add(self, i):
+        try:
+            response = APIClient().post(
+                f'/api/v1/cart/{self.cart.id}/items/',
+                {'product_variant_id': self.variants[i % 2].id, 'quantity': 1 + i % 3},
+                format='json',
+            )
+            return response.status_code
+        finally:
+            connection.close()  # each worker thread has its own connection
+
+    # --- TEST 1: Hundreds of parallel adds to one cart lose nothing ---
+    def test_parallel_adds(self):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            codes = list(pool.map(self.add, range(self.ADDS)))
+
+        self.assertEqual(set(codes) - {200, 201}, set())
+        self.assertEqual(codes.count(201), 2)  # exactly one insert per variant
+        expected = {variant.id: 0 for variant in self.variants}
+        for i in range(self.ADDS):
+            expected[self.variants[i % 2].id] += 1 + i % 3
+        self.assertEqual(quantities(self.cart), expected)
+
+
+class AbandonedCartReaperTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=product, sku_variant="AIRMAX-S")
+        self.old = []
+        for _ in range(5):
+            cart = Cart.objects.create()
+            CartItem.objects.create(cart=cart, product_variant=self.variant, quantity=1)
+            self.old.append(cart)
+        Cart.objects.filter(id__in=[cart.id for cart in self.old]).update(updated_at=timezone.now() - timedelta(days=30))
+        self.fresh = Cart.objects.create()
+
+    # --- TEST 1: Idle carts go in batches, with their lines; active ones stay ---
+    def test_reaps_idle_carts(self):
+        result = reap_abandoned_carts(max_age_days=14, batch_size=2, pause=0)
+        self.assertEqual((result['carts'], result['items']), (5, 5))
+        self.assertEqual(list(Cart.objects.values_list('id', flat=True)), [self.fresh.id])
+        self.assertFalse(CartItem.objects.exists())
+
+    # --- TEST 2: Any change to the lines counts as activity ---
+    def test_line_changes_touch_the_cart(self):
+        revived = self.old[0]
+        self.client.post(f'/api/v1/cart/{revived.id}/items/', {'product_variant_id': self.variant.id}, format='json')
+        patched = self.old[1]
+        item = patched.items.get()
+        self.client.patch(f'/api/v1/cart/{patched.id}/items/{item.id}/', {'quantity': 3}, format='json')
+
+        self.assertEqual(reap_abandoned_carts(max_age_days=14, pause=0)['carts'], 3)
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {self.fresh.id, revived.id, patched.id})
+
+
+class CartConditionalGetTests(APITestCase):
+    # SQL needed to answer a poll with 304: the version lookup
+    not_modified_queries = 1
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-S")
+        self.url = f"/api/v1/cart/{self.client.post('/api/v1/cart/').data['id']}/"
+
+    def add(self, quantity=1):
+        self.client.post(f'{self.url}items/', {'product_variant_id': self.variant.id, 'quantity': quantity}, format='json')
+
+    # --- TEST 1: An unchanged cart is a 304, answered before the cart is loaded ---
+    def test_not_modified(self):
+        self.add()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(self.not_modified_queries):
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(again.content, b'')
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+    # --- TEST 2: Line changes and price changes give a new ETag ---
+    def test_changes_give_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.add(2)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['grand_total'], 200)
+
+        etag = response['ETag']
+        self.product.base_price = 120
+        self.product.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['grand_total'], 240)
+
+    # --- TEST 3: Unknown carts are still a 404 ---
+    def test_missing_cart(self):
+        missing = '/api/v1/cart/00000000-0000-0000-0000-000000000000/'
+        self.assertEqual(self.client.get(missing, HTTP_IF_NONE_MATCH='*').status_code, status.HTTP_404_NOT_FOUND)
+
+    # --- TEST 4: Last-Modified follows the catalogue prices too, like the ETag ---
+    def test_last_modified_follows_prices(self):
+        self.add()
+        last_modified = self.client.get(self.url)['Last-Modified']
+        time.sleep(1) # Last-Modified counts whole seconds
+        self.product.base_price = 120
+        self.product.save()
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['grand_total'], 120)
+
+
+# --- The same API contract with carts kept in Redis ---
+class RedisStoreMixin:
+
+    def setUp(self):
+        redis_store = override_settings(CART_STORE='cart.stores.RedisCartStore')
+        redis_store.enable()
+        self.addCleanup(redis_store.disable)
+        get_cart_store().redis.flushdb()
+        super().setUp()
+
+    def sql_writes(self, request):
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        writes = [q for q in context.captured_queries if q['sql'].lstrip().upper().startswith(('WITH', 'INSERT', 'UPDATE', 'DELETE'))]
+        return response, writes
+
+class RedisAddToCartTests(RedisStoreMixin, AddToCartTests):
+
+    # --- TEST 2: Adds are Redis writes only ---
+    def test_single_statement(self):
+        response, writes = self.sql_writes(lambda: self.add(self.variant.id))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(writes, [])
+        self.assertEqual(response.data['id'], self.variant.id)  # item ids are variant ids in this store
+
+class RedisCartBatchTests(RedisStoreMixin, CartBatchTests):
+
+    # --- TEST 4: Batches are Redis writes only ---
+    def test_statement_count(self):
+        operations = [{'op': 'set', 'product_variant_id': self.large.id, 'quantity': 2}]
+        response, writes = self.sql_writes(lambda: self.batch(*operations))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(writes, [])
+
+class RedisAddToCartConcurrencyTests(RedisStoreMixin, AddToCartConcurrencyTests):
+    pass
+
+class RedisCartConditionalGetTests(RedisStoreMixin, CartConditionalGetTests):
+    # The version is in the cart's Redis hash
+    not_modified_queries = 0
+
+class RedisCartStoreTests(RedisStoreMixin, APITestCase):
+    """
+    Write-behind to Postgres, read-through after eviction, and checkout.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.store = get_cart_store()
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.small, self.large = [
+            ProductVariant.objects.create(product=product, sku_variant=f"AIRMAX-{size}", inventory_count=10)
+            for size in ("S", "L")
+        ]
+
+    def new_cart(self):
+        response = self.client.post('/api/v1/cart/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def add(self, cart_id, variant, quantity=1):
+        return self.client.post(f'/api/v1/cart/{cart_id}/items/', {'product_variant_id': variant.id, 'quantity': quantity}, format='json')
+
+    # --- TEST 1: Nothing reaches Postgres until the flush, which then mirrors Redis ---
+    def test_write_behind(self):
+        cart_id = self.new_cart()
+        self.add(cart_id, self.small, 2)
+        self.add(cart_id, self.large)
+        self.assertFalse(Cart.objects.exists())
+
+        flush_cart_store()
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_variant_id', 'quantity')),
+            {self.small.id: 2, self.large.id: 1},
+        )
+
+        self.client.delete(f'/api/v1/cart/{cart_id}/items/{self.large.id}/')
+        self.client.patch(f'/api/v1/cart/{cart_id}/items/{self.small.id}/', {'quantity': 5}, format='json')
+        flush_cart_store()
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_variant_id', 'quantity')),
+            {self.small.id: 5},
+        )
+
+    # --- TEST 2: A cart evicted from Redis is read back from its persisted copy ---
+    def test_read_through(self):
+        cart_id = self.new_cart()
+        self.add(cart_id, self.small, 3)
+        flush_cart_store()
+        self.store.redis.flushdb()
+
+        response = self.client.get(f'/api/v1/cart/{cart_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(i['id'], i['quantity'], i['sub_total']) for i in response.data['items']], [(self.small.id, 3, 300)])
+        self.assertEqual(response.data['grand_total'], 300)
+        self.assertEqual(self.client.get('/api/v1/cart/00000000-0000-0000-0000-000000000000/').status_code, 404)
+
+    # --- TEST 3: Checkout reads the Redis cart and removes it ---
+    def test_checkout(self):
+        cart_id = self.new_cart()
+        self.add(cart_id, self.small, 2)
+        user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.client.force_authenticate(user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/orders/', {'cart_id': cart_id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.small.refresh_from_db()
+        self.assertEqual(self.small.available_count, 8) # held for the order until it is paid
+        self.assertEqual(self.client.get(f'/api/v1/cart/{cart_id}/').status_code, status.HTTP_404_NOT_FOUND)
+
+    # --- TEST 4: A flush that read the cart before checkout deleted it doesn't bring it back ---
+    def test_flush_racing_checkout(self):
+        user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.client.force_authenticate(user)
+        fresh, persisted = self.new_cart(), self.new_cart()
+        self.add(persisted, self.large)
+        flush_cart_store() # this one already has a Postgres row
+        for cart_id in (fresh, persisted):
+            self.add(cart_id, self.small)
+
+        # The flush takes its snapshot, then both carts are checked out before it writes them
+        snapshots = self.store._snapshot([cart_id.decode() for cart_id in self.store.redis.spop(self.store.DIRTY_KEY, 10)])
+        self.assertEqual(len(snapshots), 2)
+        for cart_id in (fresh, persisted):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.post('/api/v1/orders/', {'cart_id': cart_id}, format='json').status_code, 201)
+        self.store._persist(snapshots)
+
+        self.assertFalse(Cart.objects.filter(id__in=[fresh, persisted]).exists())
+        for cart_id in (fresh, persisted):
+            self.assertEqual(self.client.get(f'/api/v1/cart/{cart_id}/').status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(self.client.post('/api/v1/orders/', {'cart_id': cart_id}, format='json').status_code, 404)
+        self.assertEqual(Order.objects.count(), 2)
+
+    # --- TEST 5: Removing a line bumps the version once, removing a missing one doesn't ---
+    def test_remove_bumps_version(self):
+        cart_id = self.new_cart()
+        self.add(cart_id, self.small)
+        version = self.store.get_version(cart_id)[0]
+
+        self.assertTrue(self.store.remove(cart_id, self.small.id))
+        self.assertEqual(self.store.get_version(cart_id)[0], version + 1)
+        self.assertFalse(self.store.remove(cart_id, self.small.id))
+        self.assertEqual(self.store.get_version(cart_id)[0], version + 1)
+
+
+class RedisCartDeleteRaceTests(RedisStoreMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = get_cart_store()
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=product, sku_variant="AIRMAX-S", inventory_count=10)
+
+    # --- TEST 1: A flush waits for a delete still in its transaction, then leaves the cart out ---
+    def test_flush_waits_for_delete(self):
+        cart_id = str(self.store.create().id)
+        self.store.add(cart_id, self.variant.id, 1)
+        snapshots = self.store._snapshot([cart_id])
+        deleting, flushed = threading.Event(), threading.Event()
+
+        def delete():
+            try:
+                with transaction.atomic():
+                    self.store.delete(cart_id)
+                    deleting.set()
+                    # The flush can't get past the cart's lock while we hold it
+                    self.assertFalse(flushed.wait(0.5))
+            finally:
+                connection.close()  # each worker thread has its own connection
+
+        def flush():
+            try:
+                deleting.wait(5)
+                self.store._persist(snapshots)
+                flushed.set()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for future in [pool.submit(delete), pool.submit(flush)]:
+                future.result()
+
+        self.assertTrue(flushed.is_set())
+        self.assertFalse(Cart.objects.filter(id=cart_id).exists())
+        self.assertIsNone(self.store.get(cart_id))
+
+    # --- TEST 2: A checkout that rolls back leaves the cart live, and its edits are still written behind ---
+    def test_rolled_back_delete(self):
+        cart_id = str(self.store.create().id)
+        self.store.add(cart_id, self.variant.id, 1)
+        with self.assertRaises(InsufficientStock):
+            with transaction.atomic():
+                self.store.delete(cart_id)
+                raise InsufficientStock([])
+
+        # Until the delete's mark expires the flush can't tell a rollback from a commit, so it waits
+        self.assertEqual(self.store.flush(), 1)
+        self.assertFalse(Cart.objects.filter(id=cart_id).exists())
+        self.store.redis.delete(self.store.deleting_key(cart_id)) # expired
+
+        self.assertEqual(self.store.flush(), 1)
+        self.assertEqual(list(CartItem.objects.filter(cart_id=cart_id).values_list('quantity', flat=True)), [1])
+        self.assertEqual([item.quantity for item in self.store.get_items(cart_id)], [1])
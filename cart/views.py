@@ -1,20 +1,64 @@
-from rest_framework import viewsets, status, mixins
+import uuid
+
+from django.http import Http404
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from .models import Cart, CartItem
-from .serializers import CartSerializer, AddCartItemSerializer, CartItemSerializer
-from catalogue.models import ProductVariant
-
-class CartViewSet(mixins.CreateModelMixin, 
-                  mixins.RetrieveModelMixin, 
-                  mixins.DestroyModelMixin, 
-                  viewsets.GenericViewSet):
+from catalogue.cache import bumped_at, get_versions
+from core.conditional import conditional_response
+from .serializers import CartSerializer, AddCartItemSerializer, CartBatchSerializer, CartItemSerializer
+from .stores import CartQuantityError, get_cart_store
+
+# Both viewsets go through the configured cart store (settings.CART_STORE),
+# so carts can live in Postgres or Redis behind the same API.
+
+def parse_id(value, kind=uuid.UUID):
+    # Malformed ids are simply "not found", as with get_object_or_404
+    try:
+        return kind(str(value))
+    except ValueError:
+        raise Http404
+
+class CartViewSet(viewsets.GenericViewSet):
     """
     Standard ViewSet for creating and retrieving the Cart.
     """
-    queryset = Cart.objects.all()
     serializer_class = CartSerializer
 
-class CartItemViewSet(viewsets.ModelViewSet):
+    def create(self, request, *args, **kwargs):
+        cart = get_cart_store().create()
+        return Response(CartSerializer(cart).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        store = get_cart_store()
+        cart_id = parse_id(pk)
+        current = store.get_version(cart_id)
+        if current is None:
+            raise Http404
+        version, updated_at = current
+
+        def build():
+            # Totals and lines come back with the cart: a constant number of queries per cart
+            cart = store.get(cart_id)
+            if cart is None:
+                raise Http404
+            return Response(CartSerializer(cart).data)
+
+        # Pollers get a 304 off the version alone. The prices shown come from the
+        # catalogue, so its 'products' version is part of the ETag, and of Last-Modified
+        products = get_versions(['products'])
+        etag = f'{cart_id}-{version}-{updated_at.timestamp()}-{products[0]}'
+        bumped = bumped_at(products)
+        last_modified = max(updated_at, bumped) if bumped else None
+        return conditional_response(request, build, etag=etag, last_modified=last_modified)
+
+    def destroy(self, request, pk=None):
+        if not get_cart_store().delete(parse_id(pk)):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class CartItemViewSet(viewsets.GenericViewSet):
     """
     Handles adding/removing items from a specific cart.
     """
@@ -25,29 +69,72 @@ class CartItemViewSet(viewsets.ModelViewSet):
             return AddCartItemSerializer
         return CartItemSerializer
 
-    def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk'])
-
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
 
-    def create(self, request, *args, **kwargs):
+    def list(self, request, cart_pk=None):
+        return Response(CartItemSerializer(get_cart_store().get_items(cart_pk), many=True).data)
+
+    def retrieve(self, request, cart_pk=None, pk=None):
+        item = get_cart_store().get_item(cart_pk, parse_id(pk, int))
+        if item is None:
+            raise Http404
+        return Response(CartItemSerializer(item).data)
+
+    def partial_update(self, request, cart_pk=None, pk=None):
+        store = get_cart_store()
+        serializer = CartItemSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        item_id = parse_id(pk, int)
+        if 'quantity' in serializer.validated_data:
+            item = store.set_quantity(cart_pk, item_id, serializer.validated_data['quantity'])
+        else:
+            item = store.get_item(cart_pk, item_id)
+        if item is None:
+            raise Http404
+        return Response(CartItemSerializer(item).data)
+
+    def destroy(self, request, cart_pk=None, pk=None):
+        if not get_cart_store().remove(cart_pk, parse_id(pk, int)):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def create(self, request, cart_pk=None):
         # Custom logic to handle "Add to Cart"
-        cart_id = self.kwargs['cart_pk']
-        variant_id = request.data.get('product_variant_id')
-        quantity = int(request.data.get('quantity', 1))
+        store = get_cart_store()
+        serializer = AddCartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        # 1. Get or Create the Item
+        # 1. Insert the line or increment it, atomically in the store
         try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_variant_id=variant_id)
-            # If item exists, just add to quantity
-            cart_item.quantity += quantity
-            cart_item.save()
-            serializer = CartItemSerializer(cart_item)
-            return Response(serializer.data)
-        except CartItem.DoesNotExist:
-            # If item does not exist, create it manually
-            variant = ProductVariant.objects.get(id=variant_id)
-            cart_item = CartItem.objects.create(cart_id=cart_id, product_variant=variant, quantity=quantity)
-            serializer = CartItemSerializer(cart_item)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            result = store.add(cart_pk, serializer.validated_data['product_variant_id'], serializer.validated_data['quantity'])
+        except CartQuantityError as error:
+            raise ValidationError({'quantity': [str(error)]})
+        if result is None:
+            # Nothing was written; only now is it worth finding out what was missing
+            if not store.exists(cart_pk):
+                raise Http404("Cart not found.")
+            raise ValidationError({'product_variant_id': ["This product variant does not exist."]})
+
+        # 2. Return the line with its nested variant
+        cart_item, created = result
+        return Response(
+            CartItemSerializer(cart_item).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    # --- Sync a whole edited basket in one request: POST {"operations": [...]} ---
+    @action(detail=False, methods=['post'])
+    def batch(self, request, cart_pk=None):
+        store = get_cart_store()
+        if not store.exists(cart_pk):
+            raise Http404
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            store.apply(cart_pk, serializer.get_plan())
+        except CartQuantityError as error:
+            raise ValidationError({'operations': [str(error)]})
+
+        return Response(CartSerializer(store.get(cart_pk)).data)
@@ -1,5 +1,12 @@
-from django.contrib import admin
-from .models import Brand, Category, Attribute, AttributeValue, Product, ProductVariant, ProductImage
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.widgets import FilteredSelectMultiple
+from django.db import transaction
+from django.template.response import TemplateResponse
+from .matrix import DEFAULT_SKU_PATTERN, MatrixError, generate_variants
+from .models import Brand, Category, Attribute, AttributeValue, CatalogueImport, Product, ProductVariant, ProductImage
+from .tasks import run_catalogue_import
 
 # 1. Brand Admin
 @admin.register(Brand)
@@ -11,6 +18,8 @@ class BrandAdmin(admin.ModelAdmin):
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'parent', 'slug')
+    list_select_related = ('parent__parent',) # str(parent) shows "Grandparent > Parent"
+    ordering = ('path',) # Tree order: every parent right above its children
     prepopulated_fields = {'slug': ('name',)} # Automatically fills slug when typing name
     search_fields = ('name',)
 
@@ -28,16 +37,42 @@ class AttributeAdmin(admin.ModelAdmin):
 class AttributeValueAdmin(admin.ModelAdmin):
     list_display = ('value', 'attribute')
     list_filter = ('attribute',)
+    list_select_related = ('attribute',)
+    search_fields = ('value', 'attribute__name') # Powers the variant autocomplete below
+
+    def get_queryset(self, request):
+        # str() shows "Color: Red", also in the autocomplete results
+        return super().get_queryset(request).select_related('attribute')
 
 # 4. Product Admin
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1
 
+class ProductVariantInlineForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Per row: a sharded variant's stock lives in its slots (manage.py shard_inventory restocks it)
+        if self.instance.inventory_shards:
+            self.fields['inventory_count'].disabled = True
+
 class ProductVariantInline(admin.TabularInline):
     model = ProductVariant
+    form = ProductVariantInlineForm
     extra = 1
     show_change_link = True
+    # A search box instead of a <select> listing every AttributeValue on every row
+    autocomplete_fields = ('attribute_values',)
+    readonly_fields = ('reserved_count', 'inventory_shards') # Moved by checkouts and shard_inventory only
+
+class VariantMatrixForm(forms.Form):
+    attribute_values = forms.ModelMultipleChoiceField(
+        queryset=AttributeValue.objects.select_related('attribute').order_by('attribute__name', 'value'),
+        widget=FilteredSelectMultiple("attribute values", is_stacked=False),
+    )
+    sku_pattern = forms.CharField(initial=DEFAULT_SKU_PATTERN, help_text="Use {sku_base}, {values} or an attribute name like {Color}.")
+    price_adjustment = forms.DecimalField(max_digits=10, decimal_places=2, initial=0)
+    inventory_count = forms.IntegerField(min_value=0, initial=0)
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -45,7 +80,67 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('is_active', 'brand', 'created_at')
     search_fields = ('name', 'sku_base')
     inlines = [ProductImageInline, ProductVariantInline] # Add images and variants directly on Product page
+    actions = ['generate_variant_matrix']
+
+    @admin.action(description="Generate variant matrix (every colour x size ...)")
+    def generate_variant_matrix(self, request, queryset):
+        form = VariantMatrixForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            created = 0
+            for product in queryset:
+                try:
+                    variants, _ = generate_variants(product, **form.cleaned_data)
+                except MatrixError as error:
+                    self.message_user(request, f"{product}: {error}", messages.ERROR)
+                    continue
+                created += len(variants)
+            self.message_user(request, f"Created {created} variant(s) for {queryset.count()} product(s).")
+            return None
+
+        # First click (or invalid input): show the matrix form
+        return TemplateResponse(request, 'admin/catalogue/product/generate_variants.html', {
+            **self.admin_site.each_context(request),
+            'title': "Generate variant matrix",
+            'opts': self.model._meta,
+            'form': form,
+            'media': self.media + form.media,
+            'products': queryset,
+            'action_checkbox_name': ACTION_CHECKBOX_NAME,
+        })
 
 # 5. Register the rest normally
-admin.site.register(ProductVariant)
-admin.site.register(ProductImage)
\ No newline at end of file
+@admin.register(ProductVariant)
+class ProductVariantAdmin(admin.ModelAdmin):
+    list_display = ('sku_variant', 'product', 'price_adjustment', 'inventory_count', 'inventory_shards')
+    list_select_related = ('product',)
+    search_fields = ('sku_variant', 'product__name')
+    autocomplete_fields = ('product', 'attribute_values')
+    readonly_fields = ('reserved_count', 'inventory_shards')
+
+    def get_readonly_fields(self, request, obj=None):
+        # A sharded variant's stock lives in its slots (manage.py shard_inventory restocks it)
+        if obj and obj.inventory_shards:
+            return self.readonly_fields + ('inventory_count',)
+        return self.readonly_fields
+
+admin.site.register(ProductImage)
+
+# 6. Bulk imports: upload a feed, a Celery worker loads it in batches
+@admin.register(CatalogueImport)
+class CatalogueImportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'file', 'format', 'status', 'records_done', 'rows_written', 'rows_per_second', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'records_done', 'rows_written', 'rows_per_second', 'error', 'finished_at')
+    actions = ['resume']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            transaction.on_commit(lambda: run_catalogue_import.delay(obj.pk))
+
+    @admin.action(description="Resume selected failed imports")
+    def resume(self, request, queryset):
+        failed = list(queryset.filter(status='F').values_list('pk', flat=True))
+        for pk in failed:
+            transaction.on_commit(lambda pk=pk: run_catalogue_import.delay(pk))
+        self.message_user(request, f"Resuming {len(failed)} import(s).")
@@ -0,0 +1,148 @@
+"""
+Versioned response cache for the catalogue endpoints.
+
+Every cached response key embeds the current value of one or more version
+tokens:
+
+    products        -> bumped by any product, variant, image or stock change
+    product:<id>    -> bumped when that one product changes
+    taxonomy        -> bumped by brand, category and attribute changes
+
+Bumping a version makes every key built from the old value unreachable, so
+entries can live for a day and still never serve a stale price. The
+versions are bumped from catalogue/signals.py and from the checkout.
+
+A token starts with the time it was made ("<unix time>:<random>"), so
+bumped_at() can tell a Last-Modified header when the versions an ETag is
+built from last moved.
+
+Entries are read through core.cache (single-flight + stale-while-revalidate),
+so a popular URL is rebuilt by one worker at a time.
+"""
+import time
+from datetime import datetime, timezone
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+from rest_framework.response import Response
+
+from core.cache import fetch
+
+CACHE_TTL = getattr(settings, 'CATALOGUE_CACHE_TTL', 60 * 60 * 24)
+CACHE_STALE_TTL = getattr(settings, 'CATALOGUE_CACHE_STALE_TTL', 60 * 5)
+VERSION_PREFIX = 'catalogue:version:'
+STATS_KEY = 'catalogue:cache-stats'
+
+
+# 1. Versions
+def get_versions(names):
+    keys = [VERSION_PREFIX + name for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # First use or evicted: start a fresh token (a random one, so an
+            # evicted version can never bring old entries back to life)
+            cache.add(key, _new_token(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(names):
+    names = list(names)
+
+    def bump():
+        cache.set_many({VERSION_PREFIX + name: _new_token() for name in names}, timeout=None)
+
+    # Bump now so this process never reads its own stale entry, and again after
+    # commit so anything cached from the pre-commit rows in between is dropped.
+    bump()
+    transaction.on_commit(bump)
+
+
+def bumped_at(versions):
+    """When the newest of these tokens was made; None if one predates the timestamps."""
+    stamps = [version.partition(':')[0] for version in versions]
+    if not all(stamp.replace('.', '', 1).isdigit() for stamp in stamps):
+        return None
+    return datetime.fromtimestamp(max(map(float, stamps)), tz=timezone.utc)
+
+
+def _new_token():
+    return f'{time.time():.6f}:{uuid4().hex}'
+
+
+def bump_products(product_ids):
+    bump_versions(['products', *(f'product:{pk}' for pk in product_ids)])
+
+
+def bump_taxonomy():
+    bump_versions(['taxonomy'])
+
+
+# 2. Hit / stale / miss counters (a Redis hash: "<endpoint>:hit" -> count)
+def record(endpoint, outcome):
+    get_redis_connection('default').hincrby(STATS_KEY, f'{endpoint}:{outcome}', 1)
+
+
+def get_stats():
+    raw = get_redis_connection('default').hgetall(STATS_KEY)
+    stats = {}
+    for field, count in raw.items():
+        endpoint, outcome = field.decode().rsplit(':', 1)
+        stats.setdefault(endpoint, {'hit': 0, 'stale': 0, 'miss': 0})[outcome] = int(count)
+    return stats
+
+
+def reset_stats():
+    get_redis_connection('default').delete(STATS_KEY)
+
+
+# 3. ViewSet mixin
+class Uncacheable(Exception):
+    # Raised from inside the computation so error responses are returned, not stored
+    def __init__(self, response):
+        self.response = response
+
+
+class VersionedCacheMixin:
+    """
+    Serves `list` and `retrieve` from the cache under versioned keys.
+    Responses carry an `X-Cache: HIT|STALE|MISS` header.
+    """
+    cache_versions = ('taxonomy',)
+
+    def get_cache_versions(self):
+        return self.cache_versions
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        endpoint = f'{self.basename}.{self.action}'
+        versions = get_versions(self.get_cache_versions())
+        fingerprint = md5(f'{request.get_full_path()}|{"|".join(versions)}'.encode()).hexdigest()
+        key = f'catalogue:response:{endpoint}:{fingerprint}'
+
+        def compute():
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                raise Uncacheable(response)
+            return response.data
+
+        try:
+            data, outcome = fetch(key, compute, CACHE_TTL, stale_timeout=CACHE_STALE_TTL)
+        except Uncacheable as error:
+            record(endpoint, 'miss')
+            return error.response
+
+        record(endpoint, outcome)
+        response = Response(data)
+        response['X-Cache'] = outcome.upper()
+        return response
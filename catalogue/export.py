@@ -0,0 +1,114 @@
+"""
+Full catalogue export for feed partners and search indexers.
+
+    for line in export_lines(Product.objects.filter(is_active=True), 'ndjson'):
+        out.write(line)
+
+Products are read with QuerySet.iterator(), which on Postgres is a
+server-side cursor: rows come over in `chunk_size` batches and nothing is
+cached on the queryset. The prefetches below run once per batch (so a
+batch of 500 products is a fixed handful of queries), and every batch is
+dropped before the next one is fetched, so memory stays flat however big
+the catalogue is.
+
+Rows are built as plain dicts rather than through the DRF serializers,
+which are far too slow for a million variants.
+"""
+import csv
+import json
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .models import AttributeValue, ProductVariant
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CHUNK_SIZE = 500
+
+# CSV has one row per variant (what shopping feeds expect), or per product without any; NDJSON one line per product
+CSV_COLUMNS = [
+    'product_id', 'product_name', 'brand', 'categories', 'variant_id', 'sku',
+    'attributes', 'price', 'inventory_count', 'main_image', 'image_urls',
+]
+
+
+def export_queryset(products):
+    return products.order_by('pk').select_related('brand').prefetch_related(
+        'categories',
+        'images',
+        Prefetch('variants', queryset=ProductVariant.objects.order_by('pk').prefetch_related(
+            Prefetch('attribute_values', queryset=AttributeValue.objects.select_related('attribute')),
+        )),
+    )
+
+
+def export_lines(products, fmt='ndjson', chunk_size=CHUNK_SIZE):
+    """Yield the export of `products` as text lines, one batch of rows at a time."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+    records = (product_record(product) for product in export_queryset(products).iterator(chunk_size=chunk_size))
+    if fmt == 'ndjson':
+        for record in records:
+            yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+        return
+
+    # csv.writer needs something with .write(); hand each line straight back instead of buffering
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for record in records:
+        for row in csv_rows(record):
+            yield writer.writerow(row)
+
+
+def product_record(product):
+    images = [default_storage.url(image.image.name) for image in product.images.all()]
+    return {
+        'id': product.pk,
+        'name': product.name,
+        'description': product.description,
+        'brand': product.brand.name if product.brand else None,
+        'categories': [category.name for category in product.categories.all()],
+        'base_price': product.base_price,
+        'images': images,
+        'variants': [
+            {
+                'id': variant.pk,
+                'sku': variant.sku_variant,
+                'attributes': {value.attribute.name: value.value for value in variant.attribute_values.all()},
+                'price': product.base_price + variant.price_adjustment,
+                # What can still be sold, as the API serves it (unpaid holds left out)
+                'inventory_count': variant.available_count,
+            }
+            for variant in product.variants.all()
+        ],
+    }
+
+
+def csv_rows(record):
+    images = record['images']
+    # A product without variants still gets its row, as it gets its NDJSON line: variant columns empty, base price
+    variants = record['variants'] or [{'id': '', 'sku': '', 'attributes': {}, 'price': record['base_price'], 'inventory_count': ''}]
+    for variant in variants:
+        yield [
+            record['id'],
+            record['name'],
+            record['brand'] or '',
+            '|'.join(record['categories']),
+            variant['id'],
+            variant['sku'],
+            '|'.join(f'{name}:{value}' for name, value in variant['attributes'].items()),
+            variant['price'],
+            variant['inventory_count'],
+            images[0] if images else '',
+            '|'.join(images),
+        ]
+
+
+class _Echo:
+    def write(self, value):
+        return value
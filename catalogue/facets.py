@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.db.models import Count, Func, OuterRef, Q, Subquery
+
+from .models import AttributeValue, Category, Product, ProductSummary
+
+# Lower bounds of the price buckets; the last bucket is open-ended ("1000+")
+PRICE_BUCKETS = getattr(settings, 'CATALOGUE_PRICE_BUCKETS', [0, 50, 100, 250, 500, 1000])
+
+
+def get_facets(products):
+    """
+    Count the matching products per brand, category, attribute value and
+    price bucket. `products` is the already filtered/searched queryset; it is
+    used as a subquery, so this is four grouped queries however many
+    products match.
+    """
+    matched = products.order_by().values('pk')
+    return {
+        'brands': brand_facets(matched),
+        'categories': category_facets(matched),
+        'attributes': attribute_facets(matched),
+        'price': price_facets(matched),
+    }
+
+
+def brand_facets(matched):
+    rows = (
+        Product.objects.filter(pk__in=matched, brand__isnull=False)
+        .values('brand_id', 'brand__name')
+        .annotate(count=Count('pk'))
+        .order_by('-count', 'brand__name')
+    )
+    return [{'id': row['brand_id'], 'name': row['brand__name'], 'count': row['count']} for row in rows]
+
+
+def category_facets(matched):
+    # Counted through the subtree, as ?categories= filters: Electronics counts what is filed
+    # under Laptops too. One correlated prefix match on the path index per category
+    in_subtree = (
+        Product.categories.through.objects
+        .filter(product__in=matched, category__path__startswith=OuterRef('path'))
+        .order_by()
+        .values(count=Func('product', function='COUNT', template='COUNT(DISTINCT %(expressions)s)'))
+    )
+    rows = (
+        Category.objects.annotate(count=Subquery(in_subtree))
+        .filter(count__gt=0)
+        .values('id', 'name', 'slug', 'count')
+        .order_by('-count', 'name')
+    )
+    return list(rows)
+
+
+def attribute_facets(matched):
+    # Counts products (not variants) that have at least one variant with the value
+    rows = (
+        AttributeValue.objects.filter(variants__product__in=matched)
+        .values('id', 'value', 'attribute_id', 'attribute__name')
+        .annotate(count=Count('variants__product', distinct=True))
+        .order_by('attribute__name', '-count', 'value')
+    )
+    attributes = {}
+    for row in rows:
+        attribute = attributes.setdefault(row['attribute_id'], {
+            'id': row['attribute_id'], 'name': row['attribute__name'], 'values': [],
+        })
+        attribute['values'].append({'id': row['id'], 'value': row['value'], 'count': row['count']})
+    return list(attributes.values())
+
+
+def price_facets(matched):
+    # Bucketed on the effective (cheapest variant) price from ProductSummary, in one pass
+    bounds = list(zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + [None]))
+    counts = ProductSummary.objects.filter(product__in=matched).aggregate(**{
+        f'bucket_{i}': Count('pk', filter=Q(min_price__gte=low) & (Q(min_price__lt=high) if high is not None else Q()))
+        for i, (low, high) in enumerate(bounds)
+    })
+    return [
+        {'min': low, 'max': high, 'count': counts[f'bucket_{i}']}
+        for i, (low, high) in enumerate(bounds)
+    ]
@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+from django import forms
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import DecimalField, Exists, F, OuterRef, Q
+from django.db.models.functions import Cast
+from django_filters import rest_framework as django_filters
+from rest_framework import filters
+
+from .models import AttributeValue, Category, Product, ProductVariant
+
+
+class AttributePairsField(forms.Field):
+    # ?attr=color:red&attr=size:m  ->  [('color', 'red'), ('size', 'm')]
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        pairs = []
+        for raw in value or []:
+            name, separator, attribute_value = raw.partition(':')
+            if not separator or not name.strip() or not attribute_value.strip():
+                raise forms.ValidationError(f'"{raw}" is not in attribute:value form, e.g. color:red.')
+            pairs.append((name.strip(), attribute_value.strip()))
+        return pairs
+
+
+class AttributeFilter(django_filters.Filter):
+    field_class = AttributePairsField
+
+
+class ProductFilter(django_filters.FilterSet):
+    """
+    Price and stock filters read the denormalized ProductSummary row,
+    so they are plain indexed lookups instead of variant aggregates.
+    """
+    min_price = django_filters.NumberFilter(field_name='summary__min_price', lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name='summary__min_price', lookup_expr='lte')
+    in_stock = django_filters.BooleanFilter(field_name='summary__is_available')
+
+    # ?categories=<Electronics> also matches products filed under Laptops, Phones, ...
+    categories = django_filters.ModelMultipleChoiceFilter(queryset=Category.objects.all(), method='filter_category_tree')
+
+    # ?attr=color:red&attr=size:m : some variant has all of them (and is in stock with ?in_stock=1)
+    attr = AttributeFilter(method='filter_attributes')
+
+    class Meta:
+        model = Product
+        fields = ['brand', 'categories']
+
+    def filter_category_tree(self, queryset, name, value):
+        if not value:
+            return queryset
+        # One indexed prefix match on Category.path per requested category
+        in_tree = Q()
+        for category in value:
+            in_tree |= Q(category__path__startswith=category.path)
+        links = Product.categories.through.objects.filter(in_tree, product=OuterRef('pk'))
+        return queryset.filter(Exists(links))
+
+    def filter_attributes(self, queryset, name, pairs):
+        # 1. Resolve the "attribute:value" pairs to AttributeValue ids in one query
+        lookup = Q()
+        for attribute, value in pairs:
+            lookup |= Q(attribute__name__iexact=attribute, value__iexact=value)
+        found = defaultdict(list)
+        for pk, attribute, value in AttributeValue.objects.filter(lookup).values_list('pk', 'attribute__name', 'value'):
+            found[(attribute.lower(), value.lower())].append(pk)
+
+        # 2. Values of the same attribute are alternatives (red OR blue), attributes must all match
+        groups = defaultdict(set)
+        for attribute, value in pairs:
+            groups[attribute.lower()].update(found[(attribute.lower(), value.lower())])
+        if not all(groups.values()):
+            return queryset.none()
+
+        # 3. One containment test on the GIN-indexed signature per variant
+        variants = ProductVariant.objects.filter(product=OuterRef('pk'))
+        required = [next(iter(ids)) for ids in groups.values() if len(ids) == 1]
+        if required:
+            variants = variants.filter(attribute_value_ids__contains=required)
+        for ids in groups.values():
+            if len(ids) > 1:
+                variants = variants.filter(attribute_value_ids__overlap=list(ids))
+        if self.form.cleaned_data.get('in_stock'):
+            variants = variants.filter(inventory_count__gt=F('reserved_count')) # stock that isn't held
+        return queryset.filter(Exists(variants))
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    ?search= backed by Postgres instead of icontains over joins.
+
+    A product matches when its weighted search_document matches the query
+    (full-text, GIN index) or when the query is a close trigram match for a
+    word in the name (typos like "jordn", GIN trigram index). Results come
+    back best match first unless the client asks for another ?ordering=.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = request.query_params.get(self.search_param, '').replace('\x00', '').strip()
+        if not terms:
+            return queryset
+
+        query = SearchQuery(terms, search_type='websearch', config='english')
+        rank = SearchRank(F('search_document'), query) + TrigramWordSimilarity(terms, 'name')
+        return queryset.filter(
+            Q(search_document=query) | Q(name__trigram_word_similar=terms)
+        ).annotate(
+            # Fixed-precision rank so it can be used as a keyset pagination cursor
+            search_rank=Cast(rank, DecimalField(max_digits=12, decimal_places=6))
+        ).order_by('-search_rank')
@@ -0,0 +1,347 @@
+"""
+Bulk catalogue import for supplier feeds.
+
+    importer = CatalogueImporter(batch_size=500)
+    for done, rows in importer.run(read_records(handle, 'csv')):
+        print(f"{done} products committed")
+
+Products are upserted on `sku_base` and variants on `sku_variant` with
+INSERT ... ON CONFLICT DO UPDATE, so running the same feed twice is safe.
+Each batch of products is one transaction: a failed batch rolls back on its
+own, and `run(records, skip=done)` resumes right after the last committed
+one.
+
+Category and attribute links are written straight into the m2m through
+tables, and only the listed relations are replaced: a record without a
+`categories` (or `images`, `attributes`) key leaves the existing ones alone.
+The optional product columns work the same way: without a `description`,
+`brand` or `is_active` key (or CSV column) the stored value is kept, while
+an empty one clears it.
+Variants that are missing from the feed are kept, since orders point at them.
+Sharded (flash-sale) variants keep their stock in slots, so their
+inventory_count is restocked through shard_inventory(), which keeps the holds
+of unpaid orders. For any variant, a count below what those orders hold is
+left out and listed in `importer.refused` for the caller to report.
+
+None of this goes through model signals, so every batch refreshes the
+summaries, search documents, variant signatures and cache versions itself.
+
+Feed formats (same list separator and attribute syntax as export.py):
+
+    CSV     one row per variant, rows of a product next to each other:
+            sku_base,name,description,brand,categories,base_price,is_active,images,
+            sku_variant,price_adjustment,inventory_count,attributes
+            categories/images are "A|B", attributes are "Color:Red|Size:M"
+    NDJSON  one product per line:
+            {"sku_base": ..., "name": ..., "categories": [...], "images": [...],
+             "variants": [{"sku": ..., "price_adjustment": ..., "inventory_count": ...,
+                           "attributes": {"Color": "Red"}}]}
+"""
+import csv
+import json
+from collections import defaultdict
+from decimal import Decimal
+from itertools import groupby, islice
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from .cache import bump_products, bump_taxonomy
+from .inventory import StockHeld, shard_inventory
+from .models import (
+    Attribute, AttributeValue, Brand, Category, Product, ProductImage, ProductSummary, ProductVariant
+)
+
+FORMATS = ('csv', 'ndjson')
+BATCH_SIZE = 500
+LIST_SEPARATOR = '|'
+# Product columns a record may leave out (None counts as left out)
+OPTIONAL_FIELDS = ('description', 'brand', 'is_active')
+
+
+# 1. Reading feeds into product records
+def read_records(handle, fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown import format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if fmt == 'ndjson':
+        return (json.loads(line) for line in handle if line.strip())
+    return _csv_records(handle)
+
+
+def _csv_records(handle):
+    for sku_base, rows in groupby(csv.DictReader(handle), key=lambda row: row['sku_base']):
+        rows = list(rows)
+        first = rows[0]
+        yield {
+            'sku_base': sku_base,
+            'name': first['name'],
+            'description': first.get('description'),
+            'brand': first.get('brand'),
+            'categories': _split(first.get('categories')),
+            'base_price': first['base_price'],
+            'is_active': _flag(first.get('is_active')),
+            'images': _split(first.get('images')),
+            'variants': [
+                {
+                    'sku': row['sku_variant'],
+                    'price_adjustment': row.get('price_adjustment'),
+                    'inventory_count': row.get('inventory_count'),
+                    'attributes': _pairs(row.get('attributes')),
+                }
+                for row in rows if row.get('sku_variant')
+            ],
+        }
+
+
+def _split(value):
+    # A missing column means "leave as is", an empty cell means "none"
+    if value is None:
+        return None
+    return [part.strip() for part in value.split(LIST_SEPARATOR) if part.strip()]
+
+
+def _pairs(value):
+    parts = _split(value)
+    if parts is None:
+        return None
+    pairs = {}
+    for part in parts:
+        name, sep, attribute_value = part.partition(':')
+        if not sep:
+            raise ValueError(f"Attribute {part!r} is not in name:value form")
+        pairs[name.strip()] = attribute_value.strip()
+    return pairs
+
+
+def _flag(value):
+    if value is None:
+        return None # no column: leave as is
+    if value.strip() == '':
+        return True
+    return value.strip().lower() not in ('0', 'false', 'no')
+
+
+# 2. Writing batches
+class CatalogueImporter:
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        # name -> row, kept across batches so each brand/category/value is looked up once per run
+        self.brands = {}
+        self.categories = {}
+        self.attributes = {}
+        self.values = {}
+        # (sku_variant, reason) for stock the run could not apply
+        self.refused = []
+
+    def run(self, records, skip=0):
+        """
+        Import `records` batch by batch, skipping the first `skip` products.
+        Yields (products_done, rows_written) after every committed batch.
+        """
+        records = islice(iter(records), skip, None)
+        done = skip
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                return
+            with transaction.atomic():
+                rows = self.import_batch(batch)
+            done += len(batch)
+            yield done, rows
+
+    def import_batch(self, records):
+        # The same SKU twice in one INSERT ... ON CONFLICT is an error, last one wins
+        records = list({record['sku_base']: record for record in records}.values())
+        self.load_taxonomy(records)
+
+        # One upsert per set of optional columns present, so a record only overwrites what it lists
+        groups = defaultdict(list)
+        for record in records:
+            groups[tuple(field for field in OPTIONAL_FIELDS if record.get(field) is not None)].append(record)
+        upserted = {}
+        for fields, group in groups.items():
+            for product in Product.objects.bulk_create(
+                [self.build_product(record, fields) for record in group],
+                update_conflicts=True,
+                unique_fields=['sku_base'],
+                update_fields=['name', 'base_price', 'updated_at', *fields],
+            ):
+                upserted[product.sku_base] = product
+        products = [upserted[record['sku_base']] for record in records]
+        product_ids = [product.pk for product in products]
+
+        self.write_categories(records, products)
+        variants, variant_records = self.write_variants(records, products)
+        self.write_variant_attributes(variants, variant_records)
+        self.write_images(records, products)
+
+        # Everything the signals would normally maintain
+        ProductSummary.objects.create_for(product_ids)
+        Product.objects.filter(pk__in=product_ids).update_search_document()
+        ProductVariant.objects.filter(pk__in=[variant.pk for variant in variants]).update_attribute_signature()
+        bump_products(product_ids)
+        return len(products) + len(variants)
+
+    def build_product(self, record, fields):
+        # Left-out columns get the model defaults, which only matter for new products
+        product = Product(sku_base=record['sku_base'], name=record['name'], base_price=Decimal(str(record['base_price'])))
+        if 'description' in fields:
+            product.description = record['description']
+        if 'brand' in fields:
+            product.brand = self.brands.get(record['brand']) # '' -> no brand
+        if 'is_active' in fields:
+            product.is_active = record['is_active']
+        return product
+
+    def write_categories(self, records, products):
+        Link = Product.categories.through
+        pairs = [
+            (product, record['categories']) for product, record in zip(products, records)
+            if record.get('categories') is not None
+        ]
+        Link.objects.filter(product__in=[product for product, _ in pairs]).delete()
+        Link.objects.bulk_create([
+            Link(product_id=product.pk, category_id=self.categories[name].pk)
+            for product, names in pairs for name in names
+        ], ignore_conflicts=True)
+
+    def write_variants(self, records, products):
+        variant_records = {}
+        for product, record in zip(products, records):
+            for variant in record.get('variants') or []:
+                variant_records[variant['sku']] = (product, variant)
+
+        # Lock the existing rows: their holds decide what the feed's stock can do to them
+        existing = {
+            sku: (shards, held) for sku, shards, held in
+            ProductVariant.objects.select_for_update().order_by('pk')
+            .filter(sku_variant__in=list(variant_records))
+            .values_list('sku_variant', 'inventory_shards', 'reserved_count')
+        }
+        # Sharded variants' stock lives in their slots, which the upsert can't reach (roll_up_slots would undo it)
+        sharded = {sku: shards for sku, (shards, _) in existing.items() if shards}
+        keep_stock = set(sharded)
+        for sku, (shards, held) in existing.items():
+            count = int(variant_records[sku][1].get('inventory_count') or 0)
+            if not shards and count < held:
+                keep_stock.add(sku)
+                self.refused.append((sku, f"{held} units of {sku} are held by unpaid orders, the stock can't go below that."))
+
+        upserted = {}
+        for skus, update_fields in (
+            ([sku for sku in variant_records if sku not in keep_stock], ['product', 'price_adjustment', 'inventory_count']),
+            ([sku for sku in variant_records if sku in keep_stock], ['product', 'price_adjustment']),
+        ):
+            for variant in ProductVariant.objects.bulk_create(
+                [self.build_variant(sku, *variant_records[sku]) for sku in skus],
+                update_conflicts=True,
+                unique_fields=['sku_variant'],
+                update_fields=update_fields,
+            ):
+                upserted[variant.sku_variant] = variant
+
+        for sku, shards in sharded.items():
+            try:
+                shard_inventory(upserted[sku].pk, shards, stock=upserted[sku].inventory_count)
+            except StockHeld as error:
+                self.refused.append((sku, str(error)))
+        return [upserted[sku] for sku in variant_records], [variant for _, variant in variant_records.values()]
+
+    def build_variant(self, sku, product, variant):
+        return ProductVariant(
+            product=product,
+            sku_variant=sku,
+            price_adjustment=Decimal(str(variant.get('price_adjustment') or 0)),
+            inventory_count=int(variant.get('inventory_count') or 0),
+        )
+
+    def write_variant_attributes(self, variants, variant_records):
+        Link = ProductVariant.attribute_values.through
+        pairs = [
+            (variant, record['attributes']) for variant, record in zip(variants, variant_records)
+            if record.get('attributes') is not None
+        ]
+        Link.objects.filter(productvariant__in=[variant for variant, _ in pairs]).delete()
+        Link.objects.bulk_create([
+            Link(productvariant_id=variant.pk, attributevalue_id=self.values[(name, value)].pk)
+            for variant, attributes in pairs for name, value in attributes.items()
+        ], ignore_conflicts=True)
+
+    def write_images(self, records, products):
+        # Images are references to files already in storage; keep the ones still listed
+        wanted = {
+            product.pk: record['images'] for product, record in zip(products, records)
+            if record.get('images') is not None
+        }
+        existing = ProductImage.objects.filter(product_id__in=wanted)
+        stale, reordered, present = [], [], set()
+        for image in existing:
+            paths = wanted[image.product_id]
+            if image.image.name not in paths:
+                stale.append(image.pk)
+                continue
+            present.add((image.product_id, image.image.name))
+            order = paths.index(image.image.name)
+            if image.display_order != order:
+                image.display_order = order
+                reordered.append(image)
+
+        if stale:
+            ProductImage.objects.filter(pk__in=stale).delete()
+        ProductImage.objects.bulk_update(reordered, ['display_order'])
+        ProductImage.objects.bulk_create([
+            ProductImage(product_id=product_id, image=path, display_order=order)
+            for product_id, paths in wanted.items()
+            for order, path in enumerate(paths) if (product_id, path) not in present
+        ])
+
+    def load_taxonomy(self, records):
+        """Resolve (creating when missing) every brand, category and attribute value the batch names."""
+        created = False
+
+        brands = {record['brand'] for record in records if record.get('brand')} - self.brands.keys()
+        for brand in Brand.objects.filter(name__in=brands).order_by('pk'):
+            self.brands.setdefault(brand.name, brand)
+        missing = [Brand(name=name) for name in brands - self.brands.keys()]
+        for brand in Brand.objects.bulk_create(missing):
+            self.brands[brand.name] = brand
+            created = True
+
+        categories = {name for record in records for name in record.get('categories') or []} - self.categories.keys()
+        by_slug = {category.slug: category for category in Category.objects.filter(slug__in=[slugify(n) for n in categories])}
+        for name in categories:
+            category = by_slug.get(slugify(name))
+            if category is None:
+                # save() (not bulk_create) so the materialized path is set; new ones are rare
+                category = by_slug[slugify(name)] = Category.objects.create(name=name, slug=slugify(name))
+            self.categories[name] = category
+
+        pairs = {
+            pair for record in records for variant in record.get('variants') or []
+            for pair in (variant.get('attributes') or {}).items()
+        } - self.values.keys()
+        names = {name for name, _ in pairs} - self.attributes.keys()
+        for attribute in Attribute.objects.filter(name__in=names).order_by('pk'):
+            self.attributes.setdefault(attribute.name, attribute)
+        missing = [Attribute(name=name) for name in names - self.attributes.keys()]
+        for attribute in Attribute.objects.bulk_create(missing):
+            self.attributes[attribute.name] = attribute
+            created = True
+
+        attribute_names = {attribute.pk: name for name, attribute in self.attributes.items()}
+        existing = AttributeValue.objects.filter(
+            attribute__in=[self.attributes[name] for name, _ in pairs], value__in=[value for _, value in pairs]
+        ).order_by('pk')
+        for value in existing:
+            self.values.setdefault((attribute_names[value.attribute_id], value.value), value)
+        missing = [
+            AttributeValue(attribute=self.attributes[name], value=value)
+            for name, value in pairs - self.values.keys()
+        ]
+        for value in AttributeValue.objects.bulk_create(missing):
+            self.values[(attribute_names[value.attribute_id], value.value)] = value
+            created = True
+
+        if created:
+            # bulk_create skips the taxonomy signals
+            bump_taxonomy()
@@ -0,0 +1,268 @@
+"""
+Stock for the checkout: held while the order is being paid for, then taken.
+
+    with transaction.atomic():
+        holds = reserve_stock({variant_id: quantity, ...})   # raises InsufficientStock (409)
+    ...
+    commit_holds(holds)    # payment verified: the held units leave inventory_count
+    release_holds(holds)   # payment failed or timed out: they can be sold again
+
+inventory_count is the stock on hand and reserved_count the part of it held
+by unpaid orders, so what can still be sold (available_count) is one
+subtraction on the variant's own row. orders/reservations.py keeps track of
+which order holds what, and until when.
+
+A single statement locks the variant rows in id order, so two checkouts that
+share variants always queue up instead of deadlocking, and then reserves
+only on the rows that still have enough available:
+`inventory_count - reserved_count >= quantity` is checked by Postgres on the
+locked, current row, so parallel checkouts can never oversell. If any line
+falls short the caller's transaction rolls back and nothing is held.
+
+Flash-sale SKUs can be sharded: shard_inventory(variant_id, 8) splits the
+stock across 8 InventorySlot rows, each with its own count and reserved.
+Checkouts then hold on one random slot with enough available, skipping
+slots another checkout has locked, so they no longer queue on a single row.
+The variant's inventory_count and reserved_count, which the serializers,
+filters and ProductSummary read, become the slots' totals: roll_up_slots()
+(a Celery beat task) copies them over every few seconds, summed in one
+statement so they are always a real total, never a half-updated one.
+
+Holds are tuples (variant id, slot id or None, quantity).
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import InventorySlot, ProductVariant
+from .signals import refresh_products
+
+
+class InsufficientStock(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Not enough stock for some items."
+    default_code = 'insufficient_stock'
+
+    def __init__(self, lines):
+        # lines: [{'product_variant_id', 'requested', 'available'}, ...]
+        self.lines = lines
+        super().__init__()
+        # Set after __init__, which would turn the numbers into strings
+        self.detail = {'detail': self.detail, 'lines': lines}
+
+
+class StockHeld(ValueError):
+    pass
+
+
+def reserve_stock(quantities):
+    """
+    Hold {variant id: quantity} for an order. Must run inside a transaction.
+    Returns the holds; raises InsufficientStock listing every line that is short.
+
+    Lock order is the same for every checkout: plain variant rows (by id),
+    then the slots of sharded variants (by variant id, then slot).
+    """
+    quantities = {int(pk): int(quantity) for pk, quantity in quantities.items() if quantity}
+    if not quantities:
+        return []
+
+    table = connection.ops.quote_name(ProductVariant._meta.db_table)
+    values = ', '.join(['(%s::bigint, %s::integer)'] * len(quantities))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH q (variant_id, quantity) AS (VALUES {values}),
+            locked AS MATERIALIZED (
+                SELECT v.id FROM {table} v JOIN q ON q.variant_id = v.id
+                WHERE v.inventory_shards = 0
+                ORDER BY v.id
+                FOR UPDATE OF v
+            )
+            UPDATE {table} v
+            SET reserved_count = v.reserved_count + q.quantity
+            FROM q JOIN locked ON locked.id = q.variant_id
+            WHERE v.id = q.variant_id AND v.inventory_count - v.reserved_count >= q.quantity
+            RETURNING v.id, v.product_id
+            """,
+            [param for pair in sorted(quantities.items()) for param in pair],
+        )
+        rows = cursor.fetchall()
+    holds = [(pk, None, quantities[pk]) for pk, _ in rows]
+
+    if len(rows) < len(quantities):
+        # Short plain variants, or sharded ones (which the statement above leaves alone)
+        reserved = {pk for pk, _ in rows}
+        available = {pk: 0 for pk in quantities if pk not in reserved} # variants gone from the catalogue stay at 0
+        rest = ProductVariant.objects.filter(pk__in=list(available)).order_by('pk')
+        for pk, shards, count, held in rest.values_list('pk', 'inventory_shards', 'inventory_count', 'reserved_count'):
+            if not shards:
+                # The row is still locked by us, so this is what refused
+                available[pk] = count - held
+                continue
+            slot_holds, left = _reserve_on_slots(pk, quantities[pk])
+            if slot_holds:
+                holds.extend(slot_holds)
+                del available[pk]
+            else:
+                available[pk] = left
+        if available:
+            raise InsufficientStock([
+                {'product_variant_id': pk, 'requested': quantities[pk], 'available': available[pk]}
+                for pk in sorted(available)
+            ])
+
+    # update() skips the signals: availability and the cache versions.
+    # Sharded variants are refreshed by roll_up_slots() instead, off the hot path.
+    refresh_products({product_id for _, product_id in rows})
+    return holds
+
+
+def _reserve_on_slots(variant_id, quantity):
+    """Returns (holds, None), or ([], what is available) if it falls short."""
+    slots = connection.ops.quote_name(InventorySlot._meta.db_table)
+    with connection.cursor() as cursor:
+        # One random slot that covers the whole line; slots other checkouts hold are skipped, not waited on
+        cursor.execute(
+            f"""
+            UPDATE {slots} SET reserved = reserved + %s
+            WHERE id = (
+                SELECT id FROM {slots}
+                WHERE variant_id = %s AND count - reserved >= %s
+                ORDER BY random()
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+            """,
+            [quantity, variant_id, quantity],
+        )
+        row = cursor.fetchone()
+    if row:
+        return [(variant_id, row[0], quantity)], None
+
+    # No free slot could cover it alone (busy, or the stock is spread thin): wait for all of them
+    locked = list(InventorySlot.objects.select_for_update().filter(variant_id=variant_id).order_by('slot'))
+    total = sum(slot.count - slot.reserved for slot in locked)
+    if total < quantity:
+        return [], total
+    holds, left = [], quantity
+    for slot in locked:
+        taken = min(slot.count - slot.reserved, left)
+        if taken:
+            slot.reserved += taken
+            left -= taken
+            holds.append((variant_id, slot.pk, taken))
+    InventorySlot.objects.bulk_update(locked, ['reserved'])
+    return holds, None
+
+
+def commit_holds(holds):
+    """Payment went through: the held units leave the stock on hand."""
+    _settle(holds, variant_columns=['inventory_count', 'reserved_count'], slot_columns=['count', 'reserved'])
+
+
+def release_holds(holds):
+    """Payment failed or timed out: the held units can be sold again."""
+    _settle(holds, variant_columns=['reserved_count'], slot_columns=['reserved'])
+
+
+def _settle(holds, variant_columns, slot_columns):
+    # Same lock order as reserve_stock: variant rows, then slots
+    by_variant, by_slot = defaultdict(int), defaultdict(int)
+    for variant_id, slot_id, quantity in holds:
+        if slot_id is None:
+            by_variant[variant_id] += quantity
+        else:
+            by_slot[slot_id] += quantity
+    with transaction.atomic():
+        product_ids = _subtract(ProductVariant, by_variant, variant_columns, returning='product_id')
+        _subtract(InventorySlot, by_slot, slot_columns)
+        refresh_products(product_ids)
+
+
+def _subtract(model, quantities, columns, returning='id'):
+    if not quantities:
+        return set()
+    table = connection.ops.quote_name(model._meta.db_table)
+    values = ', '.join(['(%s::bigint, %s::integer)'] * len(quantities))
+    assignments = ', '.join(f'{column} = t.{column} - d.quantity' for column in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH d (id, quantity) AS (VALUES {values}),
+            locked AS MATERIALIZED (
+                SELECT t.id FROM {table} t JOIN d ON d.id = t.id ORDER BY t.id FOR UPDATE OF t
+            )
+            UPDATE {table} t SET {assignments}
+            FROM d JOIN locked ON locked.id = d.id
+            WHERE t.id = d.id
+            RETURNING t.{returning}
+            """,
+            [param for pair in sorted(quantities.items()) for param in pair],
+        )
+        return {value for value, in cursor.fetchall()}
+
+
+def shard_inventory(variant_id, shards, stock=None):
+    """
+    Split a variant's stock evenly across `shards` slots (0 folds it back into
+    inventory_count). Pass `stock` to restock at the same time; while a variant
+    is sharded this is the way to change its stock.
+
+    Restocking with the same number of shards keeps the slots, and the holds
+    of unpaid orders on them: only what is left to sell is spread again.
+    Changing the number of shards while orders hold stock, or restocking
+    below what they hold, raises StockHeld.
+    """
+    with transaction.atomic():
+        variant = ProductVariant.objects.select_for_update().get(pk=variant_id)
+        slots = list(InventorySlot.objects.select_for_update().filter(variant=variant).order_by('slot'))
+        held = sum(slot.reserved for slot in slots) if variant.inventory_shards else variant.reserved_count
+        if held and shards != variant.inventory_shards:
+            raise StockHeld(f"{held} units of {variant.sku_variant} are held by unpaid orders, try again once they clear.")
+        if stock is None:
+            stock = sum(slot.count for slot in slots) if variant.inventory_shards else variant.inventory_count
+        if stock < held:
+            raise StockHeld(f"{held} units of {variant.sku_variant} are held by unpaid orders, the stock can't go below that.")
+
+        share, extra = divmod(stock - held, shards) if shards else (0, 0)
+        if shards and shards == variant.inventory_shards:
+            # Same slots: each keeps what it holds, plus its share of the rest
+            for slot in slots:
+                slot.count = slot.reserved + share + (1 if slot.slot < extra else 0)
+            InventorySlot.objects.bulk_update(slots, ['count'])
+        else:
+            # Nothing is held on the slots here (or there are none, and none to make)
+            InventorySlot.objects.filter(variant=variant).delete()
+            InventorySlot.objects.bulk_create([
+                InventorySlot(variant=variant, slot=slot, count=share + (1 if slot < extra else 0))
+                for slot in range(shards)
+            ])
+        ProductVariant.objects.filter(pk=variant.pk).update(
+            inventory_shards=shards, inventory_count=stock, reserved_count=held,
+        )
+        refresh_products([variant.product_id])
+
+
+def roll_up_slots():
+    """Copy each sharded variant's slot totals into inventory_count / reserved_count. Returns how many changed."""
+    variants = connection.ops.quote_name(ProductVariant._meta.db_table)
+    slots = connection.ops.quote_name(InventorySlot._meta.db_table)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE {variants} v SET inventory_count = s.total, reserved_count = s.reserved
+                FROM (
+                    SELECT variant_id, SUM(count) AS total, SUM(reserved) AS reserved
+                    FROM {slots} GROUP BY variant_id
+                ) s
+                WHERE v.id = s.variant_id AND v.inventory_shards > 0
+                  AND (v.inventory_count <> s.total OR v.reserved_count <> s.reserved)
+                RETURNING v.product_id
+            """)
+            rows = cursor.fetchall()
+        refresh_products({product_id for product_id, in rows})
+    return len(rows)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from catalogue.cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/stale/miss counts of the catalogue response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the counters after printing them.")
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        if not stats:
+            self.stdout.write("No catalogue cache traffic recorded yet.")
+
+        for endpoint, counts in sorted(stats.items()):
+            served = counts['hit'] + counts['stale']
+            total = served + counts['miss']
+            ratio = served / total * 100 if total else 0
+            self.stdout.write(
+                f"{endpoint:<24} hits={counts['hit']:<8} stale={counts['stale']:<8} "
+                f"misses={counts['miss']:<8} hit rate={ratio:.1f}%"
+            )
+
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset."))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from catalogue.export import CHUNK_SIZE, FORMATS, export_lines
+from catalogue.models import Product
+
+
+class Command(BaseCommand):
+    help = "Stream the active catalogue (products, variants, prices, stock, images) as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--output', '-o', help="File to write to (default: stdout).")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Products fetched per batch.")
+        parser.add_argument('--include-inactive', action='store_true')
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if not options['include_inactive']:
+            products = products.filter(is_active=True)
+
+        lines = export_lines(products, options['format'], chunk_size=options['chunk_size'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        count = 0
+        with open(options['output'], 'w', newline='', encoding='utf-8') as handle:
+            for line in lines:
+                handle.write(line)
+                count += 1
+        self.stderr.write(self.style.SUCCESS(f"Wrote {count} lines to {options['output']}"))
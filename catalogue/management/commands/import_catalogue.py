@@ -0,0 +1,59 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalogue.importer import BATCH_SIZE, FORMATS, CatalogueImporter, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk upsert products, variants, attribute values, category links and image references "
+        "from a CSV or NDJSON feed. Re-running after a failure resumes from the last committed batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Products per transaction.")
+        parser.add_argument('--checkpoint', help="Progress file (default: <path>.checkpoint).")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start over.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f"Can't tell the format of {path}, pass --format {'|'.join(FORMATS)}")
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+
+        skip = 0
+        if os.path.exists(checkpoint) and not options['restart']:
+            with open(checkpoint) as handle:
+                skip = int(handle.read().strip() or 0)
+            self.stdout.write(f"Resuming after {skip} products (from {checkpoint})")
+
+        started = time.monotonic()
+        done, written = skip, 0
+        importer = CatalogueImporter(options['batch_size'])
+        with open(path, newline='', encoding='utf-8') as handle:
+            try:
+                for done, rows in importer.run(read_records(handle, fmt), skip=skip):
+                    written += rows
+                    with open(checkpoint, 'w') as progress:
+                        progress.write(str(done))
+                    self.stdout.write(f"{done} products committed, {self.rate(written, started)}")
+            except Exception as error:
+                raise CommandError(
+                    f"Batch after product {done} failed: {error!r}. Run the command again to resume from there."
+                ) from error
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        for sku, reason in importer.refused:
+            self.stdout.write(self.style.WARNING(f"Stock of {sku} not changed: {reason}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {done - skip} products ({written} rows), {self.rate(written, started)}"
+        ))
+
+    def rate(self, rows, started):
+        return f"{rows / max(time.monotonic() - started, 1e-6):.0f} rows/s"
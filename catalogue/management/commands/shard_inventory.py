@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalogue.inventory import StockHeld, shard_inventory
+from catalogue.models import ProductVariant
+
+
+class Command(BaseCommand):
+    help = (
+        "Split a hot variant's stock across N counter slots so parallel checkouts stop queueing "
+        "on one row (--slots 0 folds it back). --stock restocks it at the same time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sku_variant')
+        parser.add_argument('--slots', type=int, required=True)
+        parser.add_argument('--stock', type=int, help="New total stock (default: keep the current one).")
+
+    def handle(self, *args, **options):
+        if options['slots'] < 0 or (options['stock'] is not None and options['stock'] < 0):
+            raise CommandError("--slots and --stock can't be negative.")
+        variant = ProductVariant.objects.filter(sku_variant=options['sku_variant']).first()
+        if variant is None:
+            raise CommandError(f"No variant with SKU {options['sku_variant']}")
+
+        try:
+            shard_inventory(variant.pk, options['slots'], stock=options['stock'])
+        except StockHeld as error:
+            raise CommandError(str(error))
+        variant.refresh_from_db()
+        slots = list(variant.inventory_slots.order_by('slot').values_list('count', flat=True))
+        self.stdout.write(self.style.SUCCESS(
+            f"{variant.sku_variant}: {variant.inventory_count} in stock"
+            + (f" across {len(slots)} slots {slots}" if slots else " (single row)")
+        ))
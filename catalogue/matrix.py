@@ -0,0 +1,103 @@
+"""
+Variant matrix generation: 6 colours x 8 sizes -> 48 variants in one go.
+
+    generate_variants(shirt, [red, blue, small, medium], price_adjustment=0,
+                      value_adjustments={xl.pk: Decimal('5.00')})
+
+The chosen values are grouped by attribute and every combination (one value
+per attribute) becomes a ProductVariant. Combinations the product already
+has are skipped, so the same matrix can be re-applied after adding a colour.
+The variants and their attribute links are two bulk INSERTs; the variants'
+attribute_value_ids signature is written with them.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from itertools import product as combinations
+
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+
+from .models import ProductVariant
+from .signals import refresh_products
+
+DEFAULT_SKU_PATTERN = '{sku_base}-{values}'
+MAX_VARIANTS = 500
+
+
+class MatrixError(ValueError):
+    pass
+
+
+def generate_variants(product, attribute_values, sku_pattern=DEFAULT_SKU_PATTERN,
+                      price_adjustment=0, value_adjustments=None, inventory_count=0):
+    """
+    Create the missing variants of `product` for every combination of
+    `attribute_values`. SKUs come from `sku_pattern`, which may use
+    {sku_base}, {values} ("RED-M") and the attribute names ({Color}).
+    A variant's price adjustment is `price_adjustment` plus the
+    `value_adjustments` ({attribute_value_id: amount}) of its values.
+    Returns (created variants, number of combinations skipped).
+    """
+    value_adjustments = value_adjustments or {}
+
+    # Keep the attributes in the order they were given: Color then Size -> "RED-M"
+    groups = defaultdict(list)
+    for value in attribute_values:
+        if value not in groups[value.attribute.name]:
+            groups[value.attribute.name].append(value)
+    if not groups:
+        raise MatrixError("Pick at least one attribute value.")
+
+    total = 1
+    for values in groups.values():
+        total *= len(values)
+    if total > MAX_VARIANTS:
+        raise MatrixError(f"{total} combinations is more than the limit of {MAX_VARIANTS}.")
+
+    existing = {tuple(ids) for ids in product.variants.values_list('attribute_value_ids', flat=True)}
+    planned = []
+    for combo in combinations(*groups.values()):
+        signature = tuple(sorted(value.pk for value in combo))
+        if signature in existing:
+            continue
+        planned.append((combo, signature, _sku(product, sku_pattern, groups, combo)))
+
+    skus = [sku for _, _, sku in planned]
+    taken = set(ProductVariant.objects.filter(sku_variant__in=skus).values_list('sku_variant', flat=True))
+    if taken or len(set(skus)) != len(skus):
+        duplicates = sorted(taken or {sku for sku in skus if skus.count(sku) > 1})
+        raise MatrixError(f"SKU pattern gives duplicate SKUs: {', '.join(duplicates[:5])}")
+
+    try:
+        with transaction.atomic():
+            variants = ProductVariant.objects.bulk_create([
+                ProductVariant(
+                    product=product,
+                    sku_variant=sku,
+                    price_adjustment=Decimal(price_adjustment) + sum(
+                        (Decimal(value_adjustments.get(value.pk, 0)) for value in combo), Decimal(0)
+                    ),
+                    inventory_count=inventory_count,
+                    attribute_value_ids=list(signature),
+                )
+                for combo, signature, sku in planned
+            ])
+            Link = ProductVariant.attribute_values.through
+            Link.objects.bulk_create([
+                Link(productvariant_id=variant.pk, attributevalue_id=value_id)
+                for variant, (_, signature, _) in zip(variants, planned) for value_id in signature
+            ])
+            # bulk_create skips the signals: price range, stock and cache versions
+            refresh_products([product.pk])
+    except IntegrityError:
+        # Another request took one of the SKUs between the check above and the insert
+        raise MatrixError(f"SKU pattern gives SKUs that are already taken: {', '.join(skus[:5])}")
+    return variants, total - len(planned)
+
+
+def _sku(product, pattern, groups, combo):
+    codes = {name: slugify(value.value).upper() for name, value in zip(groups, combo)}
+    try:
+        return pattern.format(sku_base=product.sku_base, values='-'.join(codes.values()), **codes)
+    except (KeyError, IndexError, ValueError) as error:
+        raise MatrixError(f"Bad SKU pattern {pattern!r}: {error}") from error
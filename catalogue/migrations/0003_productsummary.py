@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:26
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Build a summary row for every existing product in one statement
+BACKFILL_SUMMARIES = """
+INSERT INTO catalogue_productsummary
+    (product_id, brand_name, category_names, min_price, max_price, is_available, main_image, updated_at)
+SELECT
+    p.id,
+    COALESCE(b.name, ''),
+    COALESCE((
+        SELECT array_agg(c.name ORDER BY c.id)
+        FROM catalogue_product_categories pc
+        JOIN catalogue_category c ON c.id = pc.category_id
+        WHERE pc.product_id = p.id
+    ), '{}'),
+    p.base_price + COALESCE((SELECT min(v.price_adjustment) FROM catalogue_productvariant v WHERE v.product_id = p.id), 0),
+    p.base_price + COALESCE((SELECT max(v.price_adjustment) FROM catalogue_productvariant v WHERE v.product_id = p.id), 0),
+    NOT EXISTS (SELECT 1 FROM catalogue_productvariant v WHERE v.product_id = p.id)
+        OR EXISTS (SELECT 1 FROM catalogue_productvariant v WHERE v.product_id = p.id AND v.inventory_count > 0),
+    COALESCE((
+        SELECT i.image FROM catalogue_productimage i
+        WHERE i.product_id = p.id
+        ORDER BY i.display_order, i.id
+        LIMIT 1
+    ), ''),
+    now()
+FROM catalogue_product p
+LEFT JOIN catalogue_brand b ON b.id = p.brand_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogue', '0002_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='catalogue.product')),
+                ('brand_name', models.CharField(blank=True, max_length=100)),
+                ('category_names', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), blank=True, default=list, size=None)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('is_available', models.BooleanField(default=True)),
+                ('main_image', models.CharField(blank=True, max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Product summaries',
+                'indexes': [models.Index(fields=['min_price', 'product'], name='summary_min_price_idx'), models.Index(fields=['is_available', 'min_price'], name='summary_available_idx')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SUMMARIES, reverse_sql=migrations.RunSQL.noop),
+    ]
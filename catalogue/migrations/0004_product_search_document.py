@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:28
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# Same weights as ProductQuerySet.update_search_document
+BACKFILL_SEARCH_DOCUMENTS = """
+UPDATE catalogue_product p SET search_document =
+    setweight(to_tsvector('english'::regconfig, COALESCE(p.name, '')), 'A')
+    || setweight(to_tsvector('english'::regconfig, COALESCE(
+        (SELECT b.name FROM catalogue_brand b WHERE b.id = p.brand_id), '')), 'B')
+    || setweight(to_tsvector('english'::regconfig, COALESCE(
+        (SELECT string_agg(c.name, ' ')
+         FROM catalogue_product_categories pc
+         JOIN catalogue_category c ON c.id = pc.category_id
+         WHERE pc.product_id = p.id), '')), 'C')
+    || setweight(to_tsvector('english'::regconfig, COALESCE(p.description, '')), 'D')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogue', '0003_productsummary'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(BACKFILL_SEARCH_DOCUMENTS, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='product_search_document_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('name', name='gin_trgm_ops'), name='product_name_trgm_idx'),
+        ),
+    ]
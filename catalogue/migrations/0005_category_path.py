@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+# Walk the existing adjacency list from the roots down and store each path
+BACKFILL_PATHS = """
+WITH RECURSIVE tree (id, path, depth) AS (
+    SELECT id, lpad(id::text, 10, '0') || '/', 0
+    FROM catalogue_category
+    WHERE parent_id IS NULL
+  UNION ALL
+    SELECT c.id, tree.path || lpad(c.id::text, 10, '0') || '/', tree.depth + 1
+    FROM catalogue_category c
+    JOIN tree ON c.parent_id = tree.id
+)
+UPDATE catalogue_category c
+SET path = tree.path, depth = tree.depth
+FROM tree
+WHERE c.id = tree.id
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogue', '0004_product_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunSQL(BACKFILL_PATHS, reverse_sql=migrations.RunSQL.noop),
+    ]
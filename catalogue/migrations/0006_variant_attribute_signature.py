@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:34
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+BACKFILL_SIGNATURES = """
+UPDATE catalogue_productvariant v
+SET attribute_value_ids = COALESCE((
+    SELECT array_agg(t.attributevalue_id ORDER BY t.attributevalue_id)
+    FROM catalogue_productvariant_attribute_values t
+    WHERE t.productvariant_id = v.id
+), '{}')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogue', '0005_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='attribute_value_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.RunSQL(BACKFILL_SIGNATURES, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['attribute_value_ids'], name='variant_attribute_ids_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogue', '0008_inventory_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventoryslot',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='productvariant',
+            name='reserved_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,5 +1,13 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Exists, F, Max, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg, StringAgg
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.utils import timezone
 
 # 1. BRAND (e.g., Nike, Apple)
 class Brand(models.Model):
@@ -12,11 +20,18 @@ class Brand(models.Model):
 
 # 2. CATEGORY (Recursive: Electronics -> Laptops)
 class Category(models.Model):
+    PATH_STEP = 10 # Each ancestor id is zero-padded so paths sort in tree order
+
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='subcategories')
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
 
+    # Materialized path of ancestor ids, root first: "0000000001/0000000007/".
+    # "Everything under Electronics" is then a single indexed path LIKE 'prefix%'.
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
     class Meta:
         verbose_name_plural = "Categories"
 
@@ -25,6 +40,40 @@ class Category(models.Model):
             return f"{self.parent.name} > {self.name}"
         return self.name
 
+    def clean(self):
+        if self.pk and self.parent_id and self._is_own_descendant(self.parent):
+            raise ValidationError({'parent': "A category cannot be moved under itself or one of its subcategories."})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.pk is None:
+                # The path ends with our own id, so insert first
+                super().save(*args, **kwargs)
+                self._build_path()
+                Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                return
+
+            old_path, old_depth = self.path, self.depth
+            if self.parent_id and self._is_own_descendant(self.parent):
+                raise ValueError("A category cannot be moved under itself or one of its subcategories.")
+            self._build_path()
+            super().save(*args, **kwargs)
+
+            if old_path and old_path != self.path:
+                # Moved: re-root the whole subtree in one UPDATE
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - old_depth),
+                )
+
+    def _build_path(self):
+        parent_path = self.parent.path if self.parent_id else ''
+        self.path = f"{parent_path}{self.pk:0{self.PATH_STEP}d}/"
+        self.depth = self.parent.depth + 1 if self.parent_id else 0
+
+    def _is_own_descendant(self, category):
+        return category.pk == self.pk or (bool(self.path) and category.path.startswith(self.path))
+
 # 3. ATTRIBUTES (e.g., The concept of "Color" or "Size")
 class Attribute(models.Model):
     name = models.CharField(max_length=50) # e.g. "Color"
@@ -41,6 +90,26 @@ class AttributeValue(models.Model):
         return f"{self.attribute.name}: {self.value}"
 
 # 5. PRODUCT (The main item)
+class ProductQuerySet(models.QuerySet):
+    def update_search_document(self):
+        """
+        Rebuild the weighted full-text document in a single UPDATE:
+        name (A) > brand (B) > category names (C) > description (D).
+        """
+        brand_name = Subquery(Brand.objects.filter(pk=OuterRef('brand_id')).values('name'))
+        category_names = Subquery(
+            Product.categories.through.objects.filter(product=OuterRef('pk'))
+            .values('product')
+            .annotate(names=StringAgg('category__name', ' '))
+            .values('names')
+        )
+        return self.update(search_document=(
+            SearchVector('name', weight='A', config='english')
+            + SearchVector(Coalesce(brand_name, Value(''), output_field=models.TextField()), weight='B', config='english')
+            + SearchVector(Coalesce(category_names, Value(''), output_field=models.TextField()), weight='C', config='english')
+            + SearchVector('description', weight='D', config='english')
+        ))
+
 class Product(models.Model):
     brand = models.ForeignKey(Brand, on_delete=models.SET_NULL, null=True, related_name='products')
     categories = models.ManyToManyField(Category, related_name='products')
@@ -54,21 +123,108 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Maintained by ProductQuerySet.update_search_document (see signals.py)
+    search_document = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (ordering field, id) over active products
+            models.Index(fields=['base_price', 'id'], name='product_price_keyset_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['created_at', 'id'], name='product_created_keyset_idx', condition=models.Q(is_active=True)),
+            # ?search= : full-text match on the document, typo-tolerant match on the name
+            GinIndex(fields=['search_document'], name='product_search_document_idx'),
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='product_name_trgm_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 # 6. PRODUCT VARIANTS (e.g., The specific Red Small Shirt)
+class ProductVariantQuerySet(models.QuerySet):
+    def update_attribute_signature(self):
+        # Copy the M2M links into attribute_value_ids with a single UPDATE
+        linked_ids = Subquery(
+            ProductVariant.attribute_values.through.objects.filter(productvariant=OuterRef('pk'))
+            .values('productvariant')
+            .annotate(ids=ArrayAgg('attributevalue_id', ordering='attributevalue_id'))
+            .values('ids')
+        )
+        empty = Value([], output_field=ArrayField(models.BigIntegerField()))
+        return self.update(attribute_value_ids=Coalesce(linked_ids, empty))
+
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants')
     attribute_values = models.ManyToManyField(AttributeValue, related_name='variants')
     
     sku_variant = models.CharField(max_length=100, unique=True)
     price_adjustment = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
-    inventory_count = models.PositiveIntegerField(default=0)
+    inventory_count = models.PositiveIntegerField(default=0) # On hand
+    # Held by orders that are still being paid for (see inventory.py)
+    reserved_count = models.PositiveIntegerField(default=0)
+    # 0: the stock is inventory_count itself. N > 0: a hot SKU whose stock is split
+    # across N InventorySlot rows that checkouts reserve on independently; inventory_count
+    # and reserved_count are then their totals, rolled up in the background.
+    inventory_shards = models.PositiveSmallIntegerField(default=0)
+
+    # Sorted ids of attribute_values, so "Red AND M" is one GIN probe
+    # (attribute_value_ids @> '{red, m}') instead of a self-join per attribute.
+    # Maintained from the attribute_values m2m_changed signal.
+    attribute_value_ids = ArrayField(models.BigIntegerField(), default=list, blank=True, editable=False)
+
+    objects = ProductVariantQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['attribute_value_ids'], name='variant_attribute_ids_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} (Variant: {self.sku_variant})"
 
+    def clean(self):
+        held = ProductVariant.objects.filter(pk=self.pk).values_list('reserved_count', flat=True).first() or 0
+        if self.inventory_count < held:
+            raise ValidationError({'inventory_count': f"{held} units are held by unpaid orders, the stock can't go below that."})
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('update_fields') is not None:
+            return super().save(*args, **kwargs)
+        # reserved_count and inventory_shards only move through inventory.py:
+        # a full-row save would write back whatever this instance loaded
+        kwargs['update_fields'] = [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in ('reserved_count', 'inventory_shards')
+        ]
+        with transaction.atomic():
+            held = ProductVariant.objects.select_for_update().filter(pk=self.pk).values_list('reserved_count', flat=True).first()
+            if held is not None:
+                if self.inventory_count < held:
+                    raise ValueError(f"{held} units of {self.sku_variant} are held by unpaid orders, the stock can't go below that.")
+                self.reserved_count = held
+            super().save(*args, **kwargs)
+
+    @property
+    def available_count(self):
+        # What can still be sold: on hand minus active holds
+        return self.inventory_count - self.reserved_count
+
+class InventorySlot(models.Model):
+    # One share of a sharded variant's stock
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='inventory_slots')
+    slot = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['variant', 'slot'], name='inventory_slot_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.variant.sku_variant} slot {self.slot}: {self.count}"
+
 # 7. IMAGES
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
@@ -78,3 +234,114 @@ class ProductImage(models.Model):
 
     class Meta:
         ordering = ["display_order"]
+
+# 8. LISTING SUMMARY (One denormalized row per product for the list endpoint)
+class ProductSummaryManager(models.Manager):
+    def create_for(self, product_ids):
+        # Insert placeholder rows, then fill them in from the live tables
+        product_ids = list(product_ids)
+        self.bulk_create(
+            [self.model(product_id=pk, min_price=0, max_price=0) for pk in product_ids],
+            ignore_conflicts=True,
+        )
+        self.refresh(product_ids)
+
+    def refresh(self, product_ids, chunk_size=500):
+        """
+        Recompute the summaries of the given products.
+
+        Only existing rows are updated, so a refresh fired while a product is
+        being deleted (e.g. by its variants' post_delete) never re-creates it.
+        """
+        product_ids = list(product_ids)
+        for start in range(0, len(product_ids), chunk_size):
+            self._refresh_chunk(product_ids[start:start + chunk_size])
+
+    def _refresh_chunk(self, product_ids):
+        categories = Product.categories.through.objects.filter(product=OuterRef('pk'))
+        rows = Product.objects.filter(pk__in=product_ids).annotate(
+            min_adjustment=Min('variants__price_adjustment'),
+            max_adjustment=Max('variants__price_adjustment'),
+            in_stock=Exists(ProductVariant.objects.filter(product=OuterRef('pk'), inventory_count__gt=F('reserved_count'))),
+            first_image=Subquery(
+                ProductImage.objects.filter(product=OuterRef('pk')).order_by('display_order', 'id').values('image')[:1]
+            ),
+            names=Subquery(
+                categories.values('product').annotate(names=ArrayAgg('category__name', ordering='category_id')).values('names')
+            ),
+        ).values_list(
+            'pk', 'base_price', 'brand__name', 'min_adjustment', 'max_adjustment', 'in_stock', 'first_image', 'names'
+        )
+
+        now = timezone.now()
+        summaries = []
+        for pk, base_price, brand_name, min_adjustment, max_adjustment, in_stock, first_image, names in rows:
+            has_variants = min_adjustment is not None
+            summaries.append(self.model(
+                product_id=pk,
+                brand_name=brand_name or '',
+                category_names=names or [],
+                min_price=base_price + (min_adjustment or 0),
+                max_price=base_price + (max_adjustment or 0),
+                # Products without variants are "simple products" and always available
+                is_available=in_stock or not has_variants,
+                main_image=first_image or '',
+                updated_at=now,
+            ))
+        self.bulk_update(summaries, [
+            'brand_name', 'category_names', 'min_price', 'max_price', 'is_available', 'main_image', 'updated_at'
+        ])
+
+
+class ProductSummary(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    brand_name = models.CharField(max_length=100, blank=True)
+    category_names = ArrayField(models.CharField(max_length=100), default=list, blank=True)
+
+    # Effective prices: base_price + cheapest / most expensive variant adjustment
+    min_price = models.DecimalField(max_digits=10, decimal_places=2)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2)
+    is_available = models.BooleanField(default=True)
+    main_image = models.CharField(max_length=255, blank=True) # Storage path of the first image
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductSummaryManager()
+
+    class Meta:
+        verbose_name_plural = "Product summaries"
+        indexes = [
+            models.Index(fields=['min_price', 'product'], name='summary_min_price_idx'),
+            models.Index(fields=['is_available', 'min_price'], name='summary_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"Summary of product {self.product_id}"
+
+# 9. BULK IMPORTS (Supplier feeds uploaded through the admin, run by Celery)
+class CatalogueImport(models.Model):
+    STATUS_CHOICES = [
+        ('P', 'Pending'),
+        ('R', 'Running'),
+        ('D', 'Done'),
+        ('F', 'Failed'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+
+    file = models.FileField(upload_to="imports/%Y/%m/%d/")
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default='P')
+
+    # Products committed so far; a resumed run skips this many records
+    records_done = models.PositiveIntegerField(default=0, editable=False)
+    rows_written = models.PositiveIntegerField(default=0, editable=False)
+    rows_per_second = models.FloatField(null=True, blank=True, editable=False)
+    error = models.TextField(blank=True, editable=False)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.get_status_display()})"
@@ -0,0 +1,10 @@
+from core.pagination import KeysetPagination
+
+
+class ProductCursorPagination(KeysetPagination):
+    """
+    Newest products first unless the client asks for ?ordering=base_price etc.
+    Backed by the (base_price, id) and (created_at, id) indexes on Product.
+    """
+    ordering = '-created_at'
+    page_size = 20
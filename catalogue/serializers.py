@@ -1,4 +1,8 @@
+from decimal import Decimal
+
+from django.core.files.storage import default_storage
 from rest_framework import serializers
+from .matrix import DEFAULT_SKU_PATTERN
 from .models import Product, Brand, Category, ProductVariant, ProductImage, AttributeValue
 
 # -----------------------------
@@ -31,6 +35,8 @@ class ProductVariantSerializer(serializers.ModelSerializer):
     attribute_values = AttributeValueSerializer(many=True, read_only=True)
     final_price = serializers.SerializerMethodField()
     name = serializers.SerializerMethodField()
+    # What the storefront can still sell: stock held by unpaid orders doesn't count
+    inventory_count = serializers.IntegerField(source='available_count', read_only=True)
 
     class Meta:
         model = ProductVariant
@@ -50,11 +56,13 @@ class ProductVariantSerializer(serializers.ModelSerializer):
 # -----------------------------
 
 class ProductListSerializer(serializers.ModelSerializer):
-    brand_name = serializers.CharField(source='brand.name', read_only=True)
-    category_names = serializers.SerializerMethodField()
+    # Everything below comes from the denormalized ProductSummary row (see models.py),
+    # so a list page is one row per product instead of walking variants and images.
+    brand_name = serializers.CharField(source='summary.brand_name', read_only=True)
+    category_names = serializers.ListField(source='summary.category_names', child=serializers.CharField(), read_only=True)
     price_range = serializers.SerializerMethodField()
     main_image = serializers.SerializerMethodField()
-    is_available = serializers.SerializerMethodField()
+    is_available = serializers.BooleanField(source='summary.is_available', read_only=True)
 
     class Meta:
         model = Product
@@ -64,37 +72,18 @@ class ProductListSerializer(serializers.ModelSerializer):
             'is_available', 'created_at'
         ]
 
-    def get_category_names(self, obj):
-        # Returns ["Electronics", "Laptops"] instead of IDs
-        return [cat.name for cat in obj.categories.all()]
-
     def get_price_range(self, obj):
-        # Advanced: Checks all variants to show "$100 - $120"
-        variants = obj.variants.all()
-        if not variants:
-            return f"{obj.base_price}"
-        
-        prices = [obj.base_price + v.price_adjustment for v in variants]
-        min_price = min(prices)
-        max_price = max(prices)
-        
-        if min_price == max_price:
-            return f"{min_price}"
-        return f"{min_price} - {max_price}"
+        # Shows "$100 - $120" when variants are priced differently
+        summary = obj.summary
+        if summary.min_price == summary.max_price:
+            return f"{summary.min_price}"
+        return f"{summary.min_price} - {summary.max_price}"
 
     def get_main_image(self, obj):
-        # Grabs the first image efficiently
-        image = obj.images.first()
-        if image:
-            return image.image.url
+        if obj.summary.main_image:
+            return default_storage.url(obj.summary.main_image)
         return None
 
-    def get_is_available(self, obj):
-        # Returns True if ANY variant has stock
-        if obj.variants.exists():
-            return any(v.inventory_count > 0 for v in obj.variants.all())
-        return True # Fallback for simple products
-
 # -----------------------------
 # 3. DETAIL SERIALIZER (Heavy for Product Page)
 # -----------------------------
@@ -107,4 +96,32 @@ class ProductDetailSerializer(ProductListSerializer):
     variants = ProductVariantSerializer(many=True, read_only=True)
 
     class Meta(ProductListSerializer.Meta):
-        fields = ProductListSerializer.Meta.fields + ['description', 'brand', 'categories', 'images', 'variants']
\ No newline at end of file
+        fields = ProductListSerializer.Meta.fields + ['description', 'brand', 'categories', 'images', 'variants']
+
+# -----------------------------
+# 4. VARIANT MATRIX (Input for bulk variant generation)
+# -----------------------------
+
+class VariantMatrixSerializer(serializers.Serializer):
+    attribute_values = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    sku_pattern = serializers.CharField(default=DEFAULT_SKU_PATTERN)
+    price_adjustment = serializers.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    # Extra per value, e.g. {"<id of XL>": "5.00"}; added on top of price_adjustment
+    value_adjustments = serializers.DictField(
+        child=serializers.DecimalField(max_digits=10, decimal_places=2), default=dict
+    )
+    inventory_count = serializers.IntegerField(min_value=0, default=0)
+
+    def validate_attribute_values(self, ids):
+        # One query for the whole list instead of a lookup per id
+        values = {value.pk: value for value in AttributeValue.objects.select_related('attribute').filter(pk__in=ids)}
+        missing = sorted(set(ids) - values.keys())
+        if missing:
+            raise serializers.ValidationError(f"Unknown attribute values: {missing}")
+        return [values[pk] for pk in dict.fromkeys(ids)]
+
+    def validate_value_adjustments(self, adjustments):
+        try:
+            return {int(pk): amount for pk, amount in adjustments.items()}
+        except ValueError:
+            raise serializers.ValidationError("Keys must be attribute value ids.")
@@ -0,0 +1,142 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_products, bump_taxonomy
+from .models import (
+    Attribute, AttributeValue, Brand, Category, Product, ProductImage, ProductSummary, ProductVariant
+)
+
+# Keeps ProductSummary, Product.search_document and the response cache
+# versions in step with the tables they are built from.
+# Note: queryset.update() / bulk_create() skip these signals, so code that
+# writes in bulk (checkout, imports) calls refresh_products() itself.
+
+
+def refresh_products(product_ids, search=False):
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    ProductSummary.objects.refresh(product_ids)
+    if search:
+        # Only names, brands and categories feed the search document, stock changes don't
+        Product.objects.filter(pk__in=product_ids).update_search_document()
+    bump_products(product_ids)
+
+
+# 1. Product (base price, brand, name, description)
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    if created:
+        ProductSummary.objects.create_for([instance.pk])
+    else:
+        ProductSummary.objects.refresh([instance.pk])
+    Product.objects.filter(pk=instance.pk).update_search_document()
+    bump_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    bump_products([instance.pk])
+
+
+# 2. Variants (price range, stock) and images (main image)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_child_changed(sender, instance, **kwargs):
+    refresh_products([instance.product_id])
+
+
+# 3. Product <-> Category links, from either side of the relation
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # category.products.clear(): remember who was linked before the rows go
+        instance._linked_product_ids = list(instance.products.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            refresh_products([instance.pk], search=True)
+        elif action == 'post_clear':
+            refresh_products(getattr(instance, '_linked_product_ids', []), search=True)
+        else:
+            refresh_products(pk_set, search=True)
+
+
+# 4. Category renames and deletes (category names)
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    bump_taxonomy()
+    if not created:
+        refresh_products(instance.products.values_list('pk', flat=True), search=True)
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Brand)
+def taxonomy_deleting(sender, instance, **kwargs):
+    # The links are gone by post_delete, so remember the products now
+    instance._linked_product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    bump_taxonomy()
+    refresh_products(getattr(instance, '_linked_product_ids', []), search=True)
+
+
+# 5. Brands: the summary only needs a single UPDATE of the name
+@receiver(post_save, sender=Brand)
+def brand_saved(sender, instance, created, **kwargs):
+    bump_taxonomy()
+    if not created:
+        ProductSummary.objects.filter(product__brand=instance).update(brand_name=instance.name)
+        instance.products.all().update_search_document()
+
+
+@receiver(post_delete, sender=Brand)
+def brand_deleted(sender, instance, **kwargs):
+    # Products keep existing (brand is SET_NULL), they just lose the name
+    bump_taxonomy()
+    product_ids = getattr(instance, '_linked_product_ids', [])
+    ProductSummary.objects.filter(product_id__in=product_ids).update(brand_name='')
+    Product.objects.filter(pk__in=product_ids).update_search_document()
+
+
+# 6. Attributes only show up in product detail ("Color: Red")
+@receiver(post_save, sender=Attribute)
+@receiver(post_delete, sender=Attribute)
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_delete, sender=AttributeValue)
+def attribute_changed(sender, instance, **kwargs):
+    bump_taxonomy()
+
+
+# 7. Variant <-> AttributeValue links feed ProductVariant.attribute_value_ids
+def refresh_variant_signatures(variant_ids):
+    variants = ProductVariant.objects.filter(pk__in=list(variant_ids))
+    variants.update_attribute_signature()
+    # The detail page and the facets show attribute values
+    bump_products(set(variants.values_list('product_id', flat=True)))
+
+
+@receiver(m2m_changed, sender=ProductVariant.attribute_values.through)
+def variant_attributes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._linked_variant_ids = list(instance.variants.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            refresh_variant_signatures([instance.pk])
+        elif action == 'post_clear':
+            refresh_variant_signatures(getattr(instance, '_linked_variant_ids', []))
+        else:
+            refresh_variant_signatures(pk_set)
+
+
+@receiver(pre_delete, sender=AttributeValue)
+def attribute_value_deleting(sender, instance, **kwargs):
+    instance._linked_variant_ids = list(instance.variants.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=AttributeValue)
+def attribute_value_deleted(sender, instance, **kwargs):
+    refresh_variant_signatures(getattr(instance, '_linked_variant_ids', []))
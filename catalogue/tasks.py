@@ -0,0 +1,58 @@
+import io
+import time
+
+from celery import shared_task
+from django.utils import timezone
+
+from .importer import CatalogueImporter, read_records
+from .inventory import roll_up_slots
+from .models import CatalogueImport
+
+
+@shared_task
+def run_catalogue_import(import_id):
+    """
+    Runs an uploaded supplier feed. Progress is saved after every committed
+    batch, so running the task again on a failed import resumes it.
+    """
+    job = CatalogueImport.objects.get(pk=import_id)
+    if job.status == 'D':
+        return f"Import {import_id} already done"
+
+    job.status = 'R'
+    job.error = ''
+    job.save(update_fields=['status', 'error'])
+
+    started = time.monotonic()
+    written = 0
+    importer = CatalogueImporter()
+    try:
+        with job.file.open('rb') as raw:
+            handle = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+            for done, rows in importer.run(read_records(handle, job.format), skip=job.records_done):
+                written += rows
+                job.records_done = done
+                job.rows_written += rows
+                job.rows_per_second = written / max(time.monotonic() - started, 1e-6)
+                job.save(update_fields=['records_done', 'rows_written', 'rows_per_second'])
+    except Exception as error:
+        job.status = 'F'
+        job.error = f"Failed after {job.records_done} products: {error!r}"
+        job.save(update_fields=['status', 'error'])
+        return job.error
+
+    job.status = 'D'
+    job.finished_at = timezone.now()
+    # Done, but some stock was left as it was: say which
+    job.error = '\n'.join(f"Stock of {sku} not changed: {reason}" for sku, reason in importer.refused)
+    job.save(update_fields=['status', 'finished_at', 'error'])
+    return f"Imported {job.records_done} products ({job.rows_written} rows)"
+
+
+@shared_task
+def rollup_inventory_slots():
+    """
+    Copies the stock of sharded (flash-sale) variants from their slots into
+    inventory_count, which the API and the listing summary read.
+    """
+    return f"{roll_up_slots()} variants updated"
@@ -1,7 +1,35 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from rest_framework.test import APITestCase
 from rest_framework import status
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import Product, Brand, Category
+from django.utils import timezone
+from cart.models import Cart, CartItem
+from core.models import User
+from core.testing import QueryBudgetMixin
+from django.db import transaction
+from .cache import get_stats
+from .inventory import InsufficientStock, StockHeld, commit_holds, release_holds, reserve_stock, shard_inventory
+from .matrix import MatrixError, generate_variants
+from .models import (
+    Product, Brand, Category, Attribute, AttributeValue, CatalogueImport, InventorySlot, ProductVariant, ProductImage,
+    ProductSummary
+)
+from .tasks import rollup_inventory_slots, run_catalogue_import
 
 class ProductAPITests(APITestCase):
     
@@ -9,6 +37,9 @@ class ProductAPITests(APITestCase):
         """
         Setup runs BEFORE every single test.
         """
+        # The list endpoint is cached in Redis, start every test from scratch
+        cache.clear()
+
         # Create Brands
         self.nike = Brand.objects.create(name="Nike")
         self.adidas = Brand.objects.create(name="Adidas")
@@ -43,7 +74,7 @@ class ProductAPITests(APITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     # --- TEST 2: Can we see a specific product? ---
     def test_get_product_detail(self):
@@ -59,8 +90,8 @@ class ProductAPITests(APITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertNotEqual(response.data[0]['name'], "Yeezy Boost")
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotEqual(response.data['results'][0]['name'], "Yeezy Boost")
 
     # --- TEST 4: Does Filtering work? ---
     def test_filter_by_category(self):
@@ -68,8 +99,8 @@ class ProductAPITests(APITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], "Yeezy Boost")
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], "Yeezy Boost")
 
     # --- TEST 5: Error Handling ---
     def test_get_invalid_product(self):
@@ -77,3 +108,1117 @@ class ProductAPITests(APITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    """
+    The list and detail endpoints must cost the same number of queries
+    whether they render 1 product or 50.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.brand = Brand.objects.create(name="Nike")
+        self.category = Category.objects.create(name="Sneakers", slug="sneakers")
+        color = Attribute.objects.create(name="Color")
+        self.red = AttributeValue.objects.create(attribute=color, value="Red")
+        self.blue = AttributeValue.objects.create(attribute=color, value="Blue")
+        self.product = self.make_product(0)
+
+    def make_product(self, n):
+        product = Product.objects.create(
+            name=f"Shoe {n}", brand=self.brand, base_price=100, sku_base=f"SHOE-{n}"
+        )
+        product.categories.add(self.category)
+        for i, value in enumerate([self.red, self.blue]):
+            variant = ProductVariant.objects.create(
+                product=product, sku_variant=f"SHOE-{n}-{i}", price_adjustment=i * 10, inventory_count=i
+            )
+            variant.attribute_values.add(value)
+        ProductImage.objects.create(product=product, image=f"products/shoe-{n}.jpg")
+        return product
+
+    def add_products(self, count=50):
+        for n in range(1, count + 1):
+            self.make_product(n)
+
+    # --- TEST 1: List cost does not grow with the number of products ---
+    def test_list_queries_are_constant(self):
+        self.assertConstantQueries(
+            lambda: self.client.get('/api/v1/catalogue/products/'),
+            self.add_products,
+        )
+
+    # --- TEST 2: Detail cost does not grow with the number of variants ---
+    def test_detail_queries_are_constant(self):
+        def add_variants():
+            for i in range(2, 30):
+                variant = ProductVariant.objects.create(
+                    product=self.product, sku_variant=f"SHOE-0-{i}", inventory_count=1
+                )
+                variant.attribute_values.add(self.red, self.blue)
+
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/v1/catalogue/products/{self.product.id}/'),
+            add_variants,
+        )
+
+    # --- TEST 3: Prefetching keeps the list output intact ---
+    def test_list_uses_first_image_and_variant_prices(self):
+        response = self.client.get('/api/v1/catalogue/products/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        product = response.data['results'][0]
+        self.assertEqual(product['price_range'], "100.00 - 110.00")
+        self.assertTrue(product['is_available'])
+        self.assertTrue(product['main_image'].endswith("products/shoe-0.jpg"))
+
+
+class ProductPaginationTests(APITestCase):
+    """
+    Keyset pagination over the catalogue (?cursor=...).
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.brand = Brand.objects.create(name="Nike")
+        # 7 products, with duplicate prices so the id tiebreak matters
+        self.products = [
+            Product.objects.create(name=f"Shoe {n}", brand=self.brand, base_price=100 + (n // 3) * 10, sku_base=f"SHOE-{n}")
+            for n in range(7)
+        ]
+
+    def walk(self, url):
+        names, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names += [p['name'] for p in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return names, pages
+
+    # --- TEST 1: Walking every page by price returns each product exactly once ---
+    def test_walk_pages_by_price(self):
+        names, pages = self.walk('/api/v1/catalogue/products/?ordering=base_price&page_size=2')
+
+        expected = [p.name for p in sorted(self.products, key=lambda p: (p.base_price, p.id))]
+        self.assertEqual(names, expected)
+        self.assertEqual(pages, 4)
+
+    # --- TEST 2: Descending order works the same way ---
+    def test_walk_pages_by_price_descending(self):
+        names, _ = self.walk('/api/v1/catalogue/products/?ordering=-base_price&page_size=3')
+
+        expected = [p.name for p in sorted(self.products, key=lambda p: (-p.base_price, -p.id))]
+        self.assertEqual(names, expected)
+
+    # --- TEST 3: The previous link returns the page we came from ---
+    def test_previous_link(self):
+        first = self.client.get('/api/v1/catalogue/products/?ordering=base_price&page_size=2')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+
+        self.assertIsNone(first.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    # --- TEST 4: Deep pages seek instead of using OFFSET ---
+    def test_deep_page_has_no_offset(self):
+        first = self.client.get('/api/v1/catalogue/products/?ordering=created_at&page_size=2')
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(first.data['next'])
+
+        product_queries = [q['sql'] for q in context.captured_queries if 'catalogue_product"."id' in q['sql']]
+        self.assertTrue(product_queries)
+        self.assertNotIn('OFFSET', product_queries[0])
+
+    # --- TEST 5: Cursors combine with filters and search ---
+    def test_cursor_with_filters(self):
+        other = Brand.objects.create(name="Adidas")
+        Product.objects.create(name="Shoe X", brand=other, base_price=1, sku_base="SHOE-X")
+
+        names, _ = self.walk(f'/api/v1/catalogue/products/?brand={self.brand.id}&search=Shoe&ordering=base_price&page_size=2')
+
+        self.assertEqual(len(names), 7)
+        self.assertNotIn("Shoe X", names)
+
+    # --- TEST 6: A cursor issued for another ordering is rejected ---
+    def test_cursor_for_other_ordering_is_rejected(self):
+        first = self.client.get('/api/v1/catalogue/products/?ordering=base_price&page_size=2')
+        cursor = first.data['next'].split('cursor=')[1].split('&')[0]
+
+        response = self.client.get(f'/api/v1/catalogue/products/?ordering=created_at&cursor={cursor}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # --- TEST 7: Timestamps within one millisecond: the cursor keeps the microseconds ---
+    def test_walk_created_at_within_a_millisecond(self):
+        moment = timezone.now().replace(microsecond=123000)
+        for n, product in enumerate(self.products):
+            product.created_at = moment + timezone.timedelta(microseconds=(n * 3) % 7 * 100)
+            Product.objects.filter(pk=product.pk).update(created_at=product.created_at)
+
+        names, _ = self.walk('/api/v1/catalogue/products/?ordering=-created_at&page_size=2')
+
+        expected = [p.name for p in sorted(self.products, key=lambda p: (p.created_at, p.id), reverse=True)]
+        self.assertEqual(names, expected)
+
+
+class ProductSummaryTests(APITestCase):
+    """
+    ProductSummary must follow every change to the rows it is built from.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.brand = Brand.objects.create(name="Nike")
+        self.sneakers = Category.objects.create(name="Sneakers", slug="sneakers")
+        self.product = Product.objects.create(name="Air Max", brand=self.brand, base_price=100, sku_base="AIRMAX")
+        self.product.categories.add(self.sneakers)
+        self.small = ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-S", inventory_count=2)
+        self.large = ProductVariant.objects.create(
+            product=self.product, sku_variant="AIRMAX-L", price_adjustment=20, inventory_count=0
+        )
+
+    def summary(self):
+        return ProductSummary.objects.get(product=self.product)
+
+    # --- TEST 1: Variants drive the price range and stock ---
+    def test_variant_changes(self):
+        summary = self.summary()
+        self.assertEqual((summary.min_price, summary.max_price), (100, 120))
+        self.assertTrue(summary.is_available)
+
+        self.small.inventory_count = 0
+        self.small.save()
+        self.assertFalse(self.summary().is_available)
+
+        self.large.delete()
+        self.assertEqual(self.summary().max_price, 100)
+
+    # --- TEST 2: Base price, categories, brand and images ---
+    def test_related_changes(self):
+        self.product.base_price = 50
+        self.product.save()
+        boots = Category.objects.create(name="Boots", slug="boots")
+        boots.products.add(self.product)
+        self.sneakers.name = "Trainers"
+        self.sneakers.save()
+        self.brand.name = "Nike Inc"
+        self.brand.save()
+        ProductImage.objects.create(product=self.product, image="products/second.jpg", display_order=2)
+        ProductImage.objects.create(product=self.product, image="products/first.jpg", display_order=1)
+
+        summary = self.summary()
+        self.assertEqual(summary.min_price, 50)
+        self.assertEqual(summary.category_names, ["Trainers", "Boots"])
+        self.assertEqual(summary.brand_name, "Nike Inc")
+        self.assertEqual(summary.main_image, "products/first.jpg")
+
+        boots.delete()
+        self.assertEqual(self.summary().category_names, ["Trainers"])
+
+    # --- TEST 3: Checkout decrements stock through the summary too ---
+    def test_checkout_updates_summary(self):
+        user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product_variant=self.small, quantity=2)
+        self.client.force_authenticate(user)
+
+        response = self.client.post('/api/v1/orders/', {'cart_id': str(cart.id)}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(self.summary().is_available)
+
+    # --- TEST 4: Filtering and ordering by price and stock ---
+    def test_filter_and_order_by_summary(self):
+        cheap = Product.objects.create(name="Flip Flop", brand=self.brand, base_price=10, sku_base="FLIP")
+        ProductVariant.objects.create(product=cheap, sku_variant="FLIP-1", inventory_count=0)
+
+        response = self.client.get('/api/v1/catalogue/products/?ordering=min_price')
+        self.assertEqual([p['name'] for p in response.data['results']], ["Flip Flop", "Air Max"])
+
+        response = self.client.get('/api/v1/catalogue/products/?in_stock=true&min_price=50')
+        self.assertEqual([p['name'] for p in response.data['results']], ["Air Max"])
+        self.assertEqual(response.data['results'][0]['price_range'], "100.00 - 120.00")
+
+
+class ProductSearchTests(APITestCase):
+    """
+    ?search= uses the Postgres full-text document and trigram name index.
+    """
+
+    def setUp(self):
+        cache.clear()
+        nike = Brand.objects.create(name="Nike")
+        running = Category.objects.create(name="Running", slug="running")
+        trail = Category.objects.create(name="Trail", slug="trail")
+
+        self.pegasus = Product.objects.create(name="Pegasus Runner", brand=nike, base_price=120, sku_base="PEG")
+        self.pegasus.categories.add(running, trail)
+        self.sandal = Product.objects.create(
+            name="Beach Sandal", base_price=20, sku_base="SANDAL",
+            description="Light enough for a runner's rest day",
+        )
+        self.boot = Product.objects.create(name="Hiking Boot", base_price=90, sku_base="BOOT")
+
+    def search(self, terms, extra=''):
+        response = self.client.get(f'/api/v1/catalogue/products/?search={terms}{extra}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [p['name'] for p in response.data['results']]
+
+    # --- TEST 1: Brand and category names are searchable, without duplicate rows ---
+    def test_search_brand_and_category(self):
+        self.assertEqual(self.search("nike"), ["Pegasus Runner"])
+        self.assertEqual(self.search("trail running"), ["Pegasus Runner"])
+
+    # --- TEST 2: Name matches outrank description matches ---
+    def test_results_ranked_by_relevance(self):
+        self.assertEqual(self.search("runner"), ["Pegasus Runner", "Beach Sandal"])
+
+    # --- TEST 3: Typos still find the product ---
+    def test_typo_tolerant_name_match(self):
+        self.assertEqual(self.search("pegasos"), ["Pegasus Runner"])
+
+    # --- TEST 4: The document follows renames ---
+    def test_document_follows_changes(self):
+        Brand.objects.filter(pk=self.pegasus.brand_id).get().delete()
+        self.assertEqual(self.search("nike"), [])
+
+        self.boot.categories.add(Category.objects.create(name="Mountain", slug="mountain"))
+        self.assertEqual(self.search("mountain"), ["Hiking Boot"])
+
+    # --- TEST 5: Ranked results can be paged with cursors ---
+    def test_ranked_results_paginate(self):
+        first = self.client.get('/api/v1/catalogue/products/?search=runner&page_size=1')
+        second = self.client.get(first.data['next'])
+
+        self.assertEqual(first.data['results'][0]['name'], "Pegasus Runner")
+        self.assertEqual(second.data['results'][0]['name'], "Beach Sandal")
+        self.assertIsNone(second.data['next'])
+
+
+class CatalogueCacheTests(APITestCase):
+    """
+    Catalogue responses are cached until a change bumps their version.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.brand = Brand.objects.create(name="Nike")
+        self.product = Product.objects.create(name="Air Max", brand=self.brand, base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-S", inventory_count=3)
+        self.list_url = '/api/v1/catalogue/products/'
+        self.detail_url = f'/api/v1/catalogue/products/{self.product.id}/'
+
+    # --- TEST 1: The second read is served from the cache ---
+    def test_second_read_is_a_hit(self):
+        for url in [self.list_url, self.detail_url, '/api/v1/catalogue/brands/', '/api/v1/catalogue/categories/']:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    # --- TEST 2: Price changes are visible immediately ---
+    def test_price_change_invalidates(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+
+        self.variant.price_adjustment = 15
+        self.variant.save()
+
+        self.assertEqual(self.client.get(self.list_url).data['results'][0]['price_range'], "115.00")
+        self.assertEqual(self.client.get(self.detail_url).data['variants'][0]['final_price'], 115)
+
+    # --- TEST 3: Checkout stock decrements are visible immediately ---
+    def test_checkout_invalidates(self):
+        self.client.get(self.detail_url)
+        user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product_variant=self.variant, quantity=3)
+        self.client.force_authenticate(user)
+        self.client.post('/api/v1/orders/', {'cart_id': str(cart.id)}, format='json')
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['variants'][0]['inventory_count'], 0)
+
+    # --- TEST 4: Brand renames reach brands and products, other products stay cached ---
+    def test_taxonomy_change_invalidates(self):
+        other = Product.objects.create(name="Cortez", base_price=80, sku_base="CORTEZ")
+        other_url = f'/api/v1/catalogue/products/{other.id}/'
+        self.client.get('/api/v1/catalogue/brands/')
+        self.client.get(self.list_url)
+        self.client.get(other_url)
+
+        self.variant.inventory_count = 1
+        self.variant.save()
+        self.assertEqual(self.client.get(other_url)['X-Cache'], 'HIT')
+
+        self.brand.name = "Nike Inc"
+        self.brand.save()
+        self.assertEqual(self.client.get('/api/v1/catalogue/brands/').data[0]['name'], "Nike Inc")
+        self.assertEqual(self.client.get(self.list_url).data['results'][-1]['brand_name'], "Nike Inc")
+
+    # --- TEST 5: Hits and misses are counted per endpoint ---
+    def test_hit_and_miss_counts(self):
+        before = get_stats().get('product.retrieve', {'hit': 0, 'stale': 0, 'miss': 0})
+        self.client.get(self.detail_url)
+        self.client.get(self.detail_url)
+        self.client.get(self.detail_url)
+
+        after = get_stats()['product.retrieve']
+        self.assertEqual(after['miss'] - before['miss'], 1)
+        self.assertEqual(after['hit'] - before['hit'], 2)
+
+
+class ProductConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-S", inventory_count=3)
+        self.url = f'/api/v1/catalogue/products/{self.product.id}/'
+
+    # --- TEST 1: A matching ETag is a 304 without touching the database ---
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+    # --- TEST 2: Variant and brand changes give a new ETag ---
+    def test_changes_give_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.variant.inventory_count = 1
+        self.variant.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['variants'][0]['inventory_count'], 1)
+
+        etag = response['ETag']
+        Brand.objects.create(name="Nike")
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    # --- TEST 3: Last-Modified follows attribute renames too, like the ETag ---
+    def test_last_modified_follows_renames(self):
+        color = Attribute.objects.create(name="Color")
+        self.variant.attribute_values.add(AttributeValue.objects.create(attribute=color, value="Red"))
+        last_modified = self.client.get(self.url)['Last-Modified']
+        time.sleep(1) # Last-Modified counts whole seconds
+        color.name = "Colour"
+        color.save()
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Colour", response.content.decode())
+
+    # --- TEST 4: Unknown and malformed ids are still 404s ---
+    def test_missing_product(self):
+        for url in ['/api/v1/catalogue/products/999999/', '/api/v1/catalogue/products/abc/']:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CategoryTreeTests(APITestCase):
+    """
+    Materialized category paths: descendant filtering, moves and the tree endpoint.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.electronics = Category.objects.create(name="Electronics", slug="electronics")
+        self.computers = Category.objects.create(name="Computers", slug="computers", parent=self.electronics)
+        self.laptops = Category.objects.create(name="Laptops", slug="laptops", parent=self.computers)
+        self.garden = Category.objects.create(name="Garden", slug="garden")
+
+        self.macbook = Product.objects.create(name="MacBook", base_price=1000, sku_base="MACBOOK")
+        self.macbook.categories.add(self.laptops)
+        self.mower = Product.objects.create(name="Mower", base_price=300, sku_base="MOWER")
+        self.mower.categories.add(self.garden)
+
+    def names(self, query):
+        response = self.client.get(f'/api/v1/catalogue/products/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(p['name'] for p in response.data['results'])
+
+    # --- TEST 1: Paths are built on save ---
+    def test_paths(self):
+        self.laptops.refresh_from_db()
+        self.assertEqual(self.laptops.path, f"{self.electronics.id:010d}/{self.computers.id:010d}/{self.laptops.id:010d}/")
+        self.assertEqual(self.laptops.depth, 2)
+
+    # --- TEST 2: Filtering by a category includes its descendants ---
+    def test_filter_includes_descendants(self):
+        self.assertEqual(self.names(f'categories={self.electronics.id}'), ["MacBook"])
+        self.assertEqual(self.names(f'categories={self.laptops.id}'), ["MacBook"])
+        self.assertEqual(self.names(f'categories={self.computers.id}&categories={self.garden.id}'), ["MacBook", "Mower"])
+
+    # --- TEST 3: Moving a category moves its whole subtree ---
+    def test_move_subtree(self):
+        self.computers.refresh_from_db()
+        self.computers.parent = self.garden
+        self.computers.save()
+
+        self.laptops.refresh_from_db()
+        self.assertTrue(self.laptops.path.startswith(f"{self.garden.id:010d}/{self.computers.id:010d}/"))
+        self.assertEqual(self.laptops.depth, 2)
+        self.assertEqual(self.names(f'categories={self.electronics.id}'), [])
+        self.assertEqual(self.names(f'categories={self.garden.id}'), ["MacBook", "Mower"])
+
+    # --- TEST 4: A category cannot become its own descendant ---
+    def test_cycle_rejected(self):
+        self.electronics.refresh_from_db()
+        self.electronics.parent = self.laptops
+        with self.assertRaises(ValidationError):
+            self.electronics.clean()
+        with self.assertRaises(ValueError):
+            self.electronics.save()
+
+    # --- TEST 5: The nested tree comes from one query ---
+    def test_tree_endpoint(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/catalogue/categories/tree/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([node['name'] for node in response.data], ["Electronics", "Garden"])
+        computers = response.data[0]['children'][0]
+        self.assertEqual(computers['name'], "Computers")
+        self.assertEqual(computers['children'][0]['name'], "Laptops")
+        self.assertEqual(computers['children'][0]['children'], [])
+
+
+class ProductFacetTests(APITestCase):
+    """
+    /products/facets/ counts for the current filter set.
+    """
+
+    def setUp(self):
+        cache.clear()
+        nike = Brand.objects.create(name="Nike")
+        adidas = Brand.objects.create(name="Adidas")
+        shoes = Category.objects.create(name="Shoes", slug="shoes")
+        color = Attribute.objects.create(name="Color")
+        red = AttributeValue.objects.create(attribute=color, value="Red")
+        blue = AttributeValue.objects.create(attribute=color, value="Blue")
+
+        def make(name, brand, price, values):
+            product = Product.objects.create(name=name, brand=brand, base_price=price, sku_base=name)
+            product.categories.add(shoes)
+            for i, value in enumerate(values):
+                variant = ProductVariant.objects.create(product=product, sku_variant=f"{name}-{i}", inventory_count=1)
+                variant.attribute_values.add(value)
+
+        make("Runner", nike, 40, [red, blue])
+        make("Trainer", nike, 120, [red])
+        make("Samba", adidas, 90, [blue])
+
+    # --- TEST 1: Every facet for the whole catalogue in a fixed number of queries ---
+    def test_facets(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/v1/catalogue/products/facets/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+        self.assertEqual([(b['name'], b['count']) for b in data['brands']], [("Nike", 2), ("Adidas", 1)])
+        self.assertEqual([(c['name'], c['count']) for c in data['categories']], [("Shoes", 3)])
+        self.assertEqual(
+            [(v['value'], v['count']) for v in data['attributes'][0]['values']], [("Blue", 2), ("Red", 2)]
+        )
+        self.assertEqual([b['count'] for b in data['price']], [1, 1, 1, 0, 0, 0])
+
+    # --- TEST 2: Facets follow the list filters and invalidate like the list ---
+    def test_facets_follow_filters(self):
+        url = '/api/v1/catalogue/products/facets/?search=runner or trainer&max_price=100'
+        response = self.client.get(url)
+        self.assertEqual([(b['name'], b['count']) for b in response.data['brands']], [("Nike", 1)])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        Product.objects.get(name="Trainer").variants.update(price_adjustment=-50)
+        Product.objects.get(name="Trainer").save()
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([(b['name'], b['count']) for b in response.data['brands']], [("Nike", 2)])
+
+    # --- TEST 3: A parent category counts its subcategories' products, like the filter ---
+    def test_category_counts_follow_the_tree(self):
+        shoes = Category.objects.get(slug="shoes")
+        footwear = Category.objects.create(name="Footwear", slug="footwear")
+        shoes.parent = footwear
+        shoes.save()
+        sandals = Category.objects.create(name="Sandals", slug="sandals", parent=footwear)
+        Product.objects.get(name="Samba").categories.add(sandals)
+        Product.objects.create(name="Flip", base_price=10, sku_base="FLIP").categories.add(sandals)
+
+        facets = {c['name']: c['count'] for c in self.client.get('/api/v1/catalogue/products/facets/').data['categories']}
+        self.assertEqual(facets, {"Footwear": 4, "Shoes": 3, "Sandals": 2})
+        listed = self.client.get(f'/api/v1/catalogue/products/?categories={footwear.id}&page_size=100').data['results']
+        self.assertEqual(len(listed), facets["Footwear"])
+
+
+class VariantAttributeFilterTests(APITestCase):
+    """
+    ?attr=name:value filters on ProductVariant.attribute_value_ids.
+    """
+
+    def setUp(self):
+        cache.clear()
+        color = Attribute.objects.create(name="Color")
+        size = Attribute.objects.create(name="Size")
+        self.red = AttributeValue.objects.create(attribute=color, value="Red")
+        self.blue = AttributeValue.objects.create(attribute=color, value="Blue")
+        self.medium = AttributeValue.objects.create(attribute=size, value="M")
+
+        # Tee: a red M variant that is sold out, and a blue M in stock
+        self.tee = Product.objects.create(name="Tee", base_price=20, sku_base="TEE")
+        self.red_m = ProductVariant.objects.create(product=self.tee, sku_variant="TEE-RED-M", inventory_count=0)
+        self.red_m.attribute_values.add(self.red, self.medium)
+        blue_m = ProductVariant.objects.create(product=self.tee, sku_variant="TEE-BLUE-M", inventory_count=4)
+        blue_m.attribute_values.add(self.blue, self.medium)
+
+        # Hoodie: red (no size) and M (no colour) exist, but never on the same variant
+        self.hoodie = Product.objects.create(name="Hoodie", base_price=50, sku_base="HOODIE")
+        ProductVariant.objects.create(product=self.hoodie, sku_variant="HOODIE-RED", inventory_count=1).attribute_values.add(self.red)
+        ProductVariant.objects.create(product=self.hoodie, sku_variant="HOODIE-M", inventory_count=1).attribute_values.add(self.medium)
+
+    def names(self, query):
+        response = self.client.get(f'/api/v1/catalogue/products/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(p['name'] for p in response.data['results'])
+
+    # --- TEST 1: The signature follows the m2m links from both sides ---
+    def test_signature_is_maintained(self):
+        self.red_m.refresh_from_db()
+        self.assertEqual(self.red_m.attribute_value_ids, sorted([self.red.id, self.medium.id]))
+
+        self.blue.variants.add(self.red_m)
+        self.red_m.refresh_from_db()
+        self.assertIn(self.blue.id, self.red_m.attribute_value_ids)
+
+        self.medium.delete()
+        self.red_m.refresh_from_db()
+        self.assertNotIn(self.medium.id, self.red_m.attribute_value_ids)
+
+    # --- TEST 2: All attributes must be on the same variant ---
+    def test_combination_on_one_variant(self):
+        self.assertEqual(self.names('attr=color:red&attr=size:m'), ["Tee"])
+        self.assertEqual(self.names('attr=Color:Red'), ["Hoodie", "Tee"])
+
+    # --- TEST 3: in_stock applies to the matching variant ---
+    def test_in_stock_variant(self):
+        self.assertEqual(self.names('attr=color:red&attr=size:m&in_stock=1'), [])
+        self.assertEqual(self.names('attr=color:blue&attr=size:m&in_stock=1'), ["Tee"])
+
+    # --- TEST 4: Several values of one attribute are alternatives ---
+    def test_values_of_one_attribute_are_alternatives(self):
+        self.assertEqual(self.names('attr=color:red&attr=color:blue&attr=size:m&in_stock=1'), ["Tee"])
+
+    # --- TEST 5: Unknown values match nothing, malformed ones are rejected ---
+    def test_unknown_and_malformed(self):
+        self.assertEqual(self.names('attr=color:purple'), [])
+        response = self.client.get('/api/v1/catalogue/products/?attr=red')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CatalogueExportTests(QueryBudgetMixin, APITestCase):
+    """
+    The export streams every product with its variants, one batch at a time.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client.force_authenticate(self.admin)
+        nike = Brand.objects.create(name="Nike")
+        sneakers = Category.objects.create(name="Sneakers", slug="sneakers")
+        size = Attribute.objects.create(name="Size")
+        self.small = AttributeValue.objects.create(attribute=size, value="S")
+        self.product = Product.objects.create(name="Air Max", brand=nike, base_price=100, sku_base="AIRMAX")
+        self.product.categories.add(sneakers)
+        ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-S", inventory_count=3).attribute_values.add(self.small)
+        ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-L", price_adjustment=20)
+        Product.objects.create(name="Hidden", base_price=10, sku_base="HIDDEN", is_active=False)
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/v1/catalogue/products/export/?{query}')
+        if response.status_code == status.HTTP_200_OK:
+            response.body = b''.join(response.streaming_content).decode()
+        return response
+
+    # --- TEST 1: NDJSON has one product per line with nested variants ---
+    def test_ndjson(self):
+        response = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.body.splitlines()]
+        self.assertEqual([line['name'] for line in lines], ["Air Max"])
+        self.assertEqual(lines[0]['brand'], "Nike")
+        self.assertEqual(lines[0]['categories'], ["Sneakers"])
+        self.assertEqual(
+            [(v['sku'], v['price'], v['inventory_count'], v['attributes']) for v in lines[0]['variants']],
+            [("AIRMAX-S", "100.00", 3, {"Size": "S"}), ("AIRMAX-L", "120.00", 0, {})],
+        )
+
+    # --- TEST 2: CSV has one row per variant and honours the list filters ---
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('output=csv').body)))
+        self.assertEqual([(row['sku'], row['price'], row['attributes']) for row in rows], [
+            ("AIRMAX-S", "100.00", "Size:S"), ("AIRMAX-L", "120.00", ""),
+        ])
+        self.assertEqual(self.export('output=csv&brand=999').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.export('output=xml').status_code, status.HTTP_400_BAD_REQUEST)
+
+    # --- TEST 3: Staff only ---
+    def test_requires_admin(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.export().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # --- TEST 4: Related rows are loaded per batch, not per product ---
+    def test_query_count_is_constant(self):
+        def grow():
+            for i in range(5):
+                product = Product.objects.create(name=f"Extra {i}", base_price=10, sku_base=f"EXTRA-{i}")
+                ProductVariant.objects.create(product=product, sku_variant=f"EXTRA-{i}-S").attribute_values.add(self.small)
+
+        self.assertConstantQueries(self.export, grow)
+
+    # --- TEST 5: The management command writes the same stream ---
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_catalogue', '--format', 'csv', '--chunk-size', '1', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)  # header + 2 variants
+
+    # --- TEST 6: A product without variants is in the CSV too, as in the NDJSON ---
+    def test_product_without_variants(self):
+        Product.objects.create(name="Gift Card", base_price=50, sku_base="GIFT")
+        rows = list(csv.DictReader(io.StringIO(self.export('output=csv').body)))
+        self.assertEqual([(row['product_name'], row['sku'], row['price'], row['inventory_count']) for row in rows], [
+            ("Air Max", "AIRMAX-S", "100.00", "3"), ("Air Max", "AIRMAX-L", "120.00", "0"), ("Gift Card", "", "50.00", ""),
+        ])
+        self.assertEqual([json.loads(line)['name'] for line in self.export().body.splitlines()], ["Air Max", "Gift Card"])
+
+    # --- TEST 7: The feed's stock is what the storefront can still sell ---
+    def test_stock_leaves_out_holds(self):
+        small = ProductVariant.objects.get(sku_variant="AIRMAX-S")
+        with transaction.atomic():
+            reserve_stock({small.pk: 2})
+        rows = list(csv.DictReader(io.StringIO(self.export('output=csv').body)))
+        self.assertEqual(rows[0]['inventory_count'], "1")
+        self.assertEqual(json.loads(self.export().body.splitlines()[0])['variants'][0]['inventory_count'], 1)
+        variants = self.client.get(f'/api/v1/catalogue/products/{self.product.id}/').data['variants']
+        self.assertEqual({v['sku_variant']: v['inventory_count'] for v in variants}['AIRMAX-S'], 1)
+
+
+class CatalogueImportTests(APITestCase):
+    """
+    Supplier feeds are upserted in batches and keep every derived column in step.
+    """
+    HEADER = "sku_base,name,brand,categories,base_price,images,sku_variant,price_adjustment,inventory_count,attributes\n"
+
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_feed(self, body, name='feed.csv'):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w') as handle:
+            handle.write(body)
+        return path
+
+    def run_import(self, body, *args):
+        call_command('import_catalogue', self.write_feed(body), *args, stdout=io.StringIO())
+
+    # --- TEST 1: Products, variants, taxonomy, links and derived columns ---
+    def test_csv_import(self):
+        self.run_import(self.HEADER + (
+            "TEE,Tee,Acme,Shirts|Summer,20,products/tee.jpg,TEE-RED-M,0,3,Color:Red|Size:M\n"
+            "TEE,Tee,Acme,Shirts|Summer,20,products/tee.jpg,TEE-BLUE-M,5,0,Color:Blue|Size:M\n"
+            "CAP,Cap,,,10,,,,,\n"
+        ))
+        tee = Product.objects.get(sku_base="TEE")
+        self.assertEqual(tee.brand.name, "Acme")
+        self.assertEqual(sorted(tee.categories.values_list('slug', flat=True)), ["shirts", "summer"])
+        self.assertEqual(list(tee.images.values_list('image', flat=True)), ["products/tee.jpg"])
+        self.assertEqual((tee.summary.min_price, tee.summary.max_price, tee.summary.is_available), (20, 25, True))
+        self.assertIsNotNone(tee.search_document)
+        self.assertEqual(Product.objects.get(sku_base="CAP").variants.count(), 0)
+
+        response = self.client.get('/api/v1/catalogue/products/?attr=color:blue&in_stock=1')
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get('/api/v1/catalogue/products/?attr=color:red&attr=size:m&search=tee')
+        self.assertEqual([p['name'] for p in response.data['results']], ["Tee"])
+
+    # --- TEST 2: Running a feed again updates rows instead of duplicating them ---
+    def test_upsert(self):
+        self.run_import(self.HEADER + "TEE,Tee,Acme,Shirts,20,a.jpg|b.jpg,TEE-M,0,3,Size:M\n")
+        self.run_import(self.HEADER + "TEE,Tee v2,Acme,Summer,30,b.jpg,TEE-M,2,0,Size:L\n")
+
+        self.assertEqual(Product.objects.count(), 1)
+        self.assertEqual((Brand.objects.count(), ProductVariant.objects.count()), (1, 1))
+        tee = Product.objects.get()
+        self.assertEqual((tee.name, tee.base_price), ("Tee v2", 30))
+        self.assertEqual([c.name for c in tee.categories.all()], ["Summer"])
+        self.assertEqual([(i.image.name, i.display_order) for i in tee.images.all()], [("b.jpg", 0)])
+        variant = tee.variants.get()
+        self.assertEqual([v.value for v in variant.attribute_values.all()], ["L"])
+        self.assertEqual((tee.summary.min_price, tee.summary.is_available), (32, False))
+
+    # --- TEST 3: A failed batch rolls back alone and the next run resumes after the last good one ---
+    def test_resume_after_failed_batch(self):
+        good = "A,First,,,10,,A-1,0,1,\n"
+        path = self.write_feed(self.HEADER + good + "B,Broken,,,not-a-price,,B-1,0,1,\n")
+        with self.assertRaises(CommandError):
+            call_command('import_catalogue', path, '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(list(Product.objects.values_list('sku_base', flat=True)), ["A"])
+        with open(f'{path}.checkpoint') as handle:
+            self.assertEqual(handle.read(), "1")
+
+        Product.objects.filter(sku_base="A").update(name="Edited")
+        with open(path, 'w') as handle:
+            handle.write(self.HEADER + good + "B,Second,,,12,,B-1,0,1,\n")
+        call_command('import_catalogue', path, '--batch-size', '1', stdout=io.StringIO())
+
+        self.assertEqual(Product.objects.get(sku_base="A").name, "Edited")  # not re-imported
+        self.assertEqual(Product.objects.get(sku_base="B").name, "Second")
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    # --- TEST 4: A batch costs the same number of queries however many products it holds ---
+    def test_batch_query_count(self):
+        def feed(count, start):
+            return "\n".join(
+                json.dumps({
+                    'sku_base': f'P{i}', 'name': f'P{i}', 'brand': 'Acme', 'categories': ['Shirts'],
+                    'base_price': 10, 'images': [f'p{i}.jpg'],
+                    'variants': [{'sku': f'P{i}-{s}', 'attributes': {'Size': s}} for s in ('S', 'M')],
+                })
+                for i in range(start, start + count)
+            )
+
+        self.run_import(feed(1, 0), '--format', 'ndjson')  # create the taxonomy first
+        counts = []
+        for count, start in ((2, 100), (6, 200)):
+            path = self.write_feed(feed(count, start), f'feed{start}.ndjson')
+            with CaptureQueriesContext(connection) as context:
+                call_command('import_catalogue', path, stdout=io.StringIO())
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    # --- TEST 5: Admin uploads run through the Celery task and record progress ---
+    def test_uploaded_import_task(self):
+        with self.settings(MEDIA_ROOT=self.tmp.name):
+            job = CatalogueImport.objects.create(
+                format='ndjson',
+                file=ContentFile(b'{"sku_base": "MUG", "name": "Mug", "base_price": "8.50"}\n', name='mug.ndjson'),
+            )
+            run_catalogue_import(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.records_done, job.rows_written), ('D', 1, 1))
+        self.assertTrue(Product.objects.filter(sku_base="MUG", base_price="8.50").exists())
+
+
+    # --- TEST 6: Optional columns a record leaves out keep their stored values ---
+    def test_missing_keys_leave_columns_alone(self):
+        self.run_import('{"sku_base": "TEE", "name": "Tee", "brand": "Nike", "description": "Great", '
+                        '"is_active": false, "base_price": 20}\n', '--format', 'ndjson')
+        self.run_import('{"sku_base": "TEE", "name": "Tee v2", "base_price": 25}\n', '--format', 'ndjson')
+        tee = Product.objects.get()
+        self.assertEqual((tee.name, tee.brand.name, tee.description, tee.is_active), ("Tee v2", "Nike", "Great", False))
+
+        # The CSV header has no description or is_active column; an empty brand cell clears the brand
+        self.run_import(self.HEADER + "TEE,Tee v3,,,30,,,,,\n")
+        tee.refresh_from_db()
+        self.assertEqual((tee.name, tee.brand, tee.description, tee.is_active), ("Tee v3", None, "Great", False))
+
+    # --- TEST 7: Sharded variants are restocked through their slots, keeping holds; below the holds is reported ---
+    def test_sharded_variant_stock(self):
+        self.run_import(self.HEADER + "TEE,Tee,,,20,,TEE-S,0,10,\n")
+        variant = ProductVariant.objects.get(sku_variant="TEE-S")
+        shard_inventory(variant.pk, 4)
+        with transaction.atomic():
+            reserve_stock({variant.pk: 2})
+
+        self.run_import(self.HEADER + "TEE,Tee,,,20,,TEE-S,5,50,\n")
+        rollup_inventory_slots()
+        variant.refresh_from_db()
+        self.assertEqual((variant.price_adjustment, variant.inventory_count, variant.reserved_count), (5, 50, 2))
+
+        out = io.StringIO()
+        call_command('import_catalogue', self.write_feed(self.HEADER + "TEE,Tee,,,20,,TEE-S,0,1,\n"), stdout=out)
+        self.assertIn("Stock of TEE-S not changed", out.getvalue())
+        rollup_inventory_slots()
+        variant.refresh_from_db()
+        self.assertEqual((variant.price_adjustment, variant.inventory_count), (0, 50))
+
+    # --- TEST 8: A plain variant's stock can't drop below its holds either ---
+    def test_plain_variant_stock_below_holds(self):
+        self.run_import(self.HEADER + "CAP,Cap,,,10,,CAP-S,0,10,\n")
+        variant = ProductVariant.objects.get(sku_variant="CAP-S")
+        with transaction.atomic():
+            holds = reserve_stock({variant.pk: 4})
+
+        out = io.StringIO()
+        call_command('import_catalogue', self.write_feed(self.HEADER + "CAP,Cap,,,10,,CAP-S,1,3,\n"), stdout=out)
+        self.assertIn("Stock of CAP-S not changed", out.getvalue())
+        variant.refresh_from_db()
+        self.assertEqual((variant.price_adjustment, variant.inventory_count, variant.reserved_count), (1, 10, 4))
+        commit_holds(holds)
+
+
+class VariantMatrixTests(APITestCase):
+    """
+    Every combination of the chosen values becomes a variant, in a fixed number of queries.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client.force_authenticate(self.admin)
+        self.shirt = Product.objects.create(name="Shirt", base_price=20, sku_base="SHIRT")
+        color = Attribute.objects.create(name="Color")
+        size = Attribute.objects.create(name="Size")
+        self.colors = [AttributeValue.objects.create(attribute=color, value=v) for v in ("Red", "Navy Blue")]
+        self.sizes = [AttributeValue.objects.create(attribute=size, value=v) for v in ("S", "M", "XL")]
+
+    def generate(self, product, **data):
+        return self.client.post(f'/api/v1/catalogue/products/{product.id}/generate-variants/', data, format='json')
+
+    # --- TEST 1: The full cartesian product with SKUs and price adjustments ---
+    def test_generate_matrix(self):
+        xl = self.sizes[2]
+        response = self.generate(
+            self.shirt,
+            attribute_values=[v.id for v in self.colors + self.sizes],
+            price_adjustment="1.00",
+            value_adjustments={str(xl.id): "4.00"},
+            inventory_count=2,
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['created'], response.data['skipped']), (6, 0))
+        variants = {v['sku_variant']: v for v in response.data['variants']}
+        self.assertEqual(sorted(variants), sorted(
+            f"SHIRT-{c}-{s}" for c in ("RED", "NAVY-BLUE") for s in ("S", "M", "XL")
+        ))
+        self.assertEqual(variants["SHIRT-RED-XL"]['final_price'], 25)
+        self.assertEqual(variants["SHIRT-RED-S"]['final_price'], 21)
+
+        summary = ProductSummary.objects.get(product=self.shirt)
+        self.assertEqual((summary.min_price, summary.max_price, summary.is_available), (21, 25, True))
+        names = [p['name'] for p in self.client.get('/api/v1/catalogue/products/?attr=color:navy blue&attr=size:xl').data['results']]
+        self.assertEqual(names, ["Shirt"])
+
+    # --- TEST 2: Re-applying the matrix only adds the missing combinations ---
+    def test_existing_combinations_are_skipped(self):
+        self.generate(self.shirt, attribute_values=[self.colors[0].id, self.sizes[0].id])
+        response = self.generate(self.shirt, attribute_values=[v.id for v in self.colors + self.sizes[:1]], sku_pattern="{sku_base}/{Color}/{Size}")
+        self.assertEqual((response.data['created'], response.data['skipped']), (1, 1))
+        self.assertEqual(response.data['variants'][0]['sku_variant'], "SHIRT/NAVY-BLUE/S")
+
+    # --- TEST 3: Bad input and non-staff users are rejected ---
+    def test_rejections(self):
+        ProductVariant.objects.create(product=self.shirt, sku_variant="SHIRT-RED")
+        self.assertEqual(self.generate(self.shirt, attribute_values=[self.colors[0].id]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.generate(self.shirt, attribute_values=[999]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.generate(self.shirt, attribute_values=[self.sizes[0].id], sku_pattern="{Colour}").status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+        self.client.force_authenticate(User.objects.create_user(email="u@example.com", username="u", password="pass12345"))
+        self.assertEqual(self.generate(self.shirt, attribute_values=[self.sizes[0].id]).status_code, status.HTTP_403_FORBIDDEN)
+
+    # --- TEST 4: Queries don't grow with the size of the matrix ---
+    def test_query_count_is_constant(self):
+        hoodie = Product.objects.create(name="Hoodie", base_price=40, sku_base="HOODIE")
+        counts = []
+        for product, values in ((self.shirt, self.colors[:1] + self.sizes[:1]), (hoodie, self.colors + self.sizes)):
+            with CaptureQueriesContext(connection) as context:
+                response = self.generate(product, attribute_values=[v.id for v in values])
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    # --- TEST 5: The admin action does the same from the product changelist ---
+    def test_admin_action(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:catalogue_product_changelist')
+        data = {'action': 'generate_variant_matrix', '_selected_action': [self.shirt.pk]}
+        self.assertContains(self.client.post(url, data), "Generate variants")
+
+        response = self.client.post(url, {
+            **data, 'apply': '1', 'attribute_values': [v.pk for v in self.colors],
+            'sku_pattern': '{sku_base}-{values}', 'price_adjustment': '0', 'inventory_count': '1',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(self.shirt.variants.values_list('sku_variant', flat=True)), ["SHIRT-NAVY-BLUE", "SHIRT-RED"])
+
+
+class VariantMatrixRaceTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.shirt = Product.objects.create(name="Shirt", base_price=20, sku_base="SHIRT")
+        self.red = AttributeValue.objects.create(attribute=Attribute.objects.create(name="Color"), value="Red")
+
+    # --- TEST 1: A SKU taken by a concurrent insert after the check is a MatrixError, not a 500 ---
+    def test_sku_taken_after_the_check(self):
+        inserted, done = threading.Event(), threading.Event()
+
+        def insert():
+            try:
+                with transaction.atomic():
+                    ProductVariant.objects.create(product=self.shirt, sku_variant="SHIRT-RED")
+                    inserted.set()
+                    done.wait(0.5) # the matrix checks now, and can't see this row yet
+            finally:
+                connection.close()  # each worker thread has its own connection
+
+        def generate():
+            try:
+                inserted.wait(5)
+                generate_variants(self.shirt, [self.red])
+            finally:
+                done.set()
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(insert), pool.submit(generate)]
+            futures[0].result()
+            with self.assertRaises(MatrixError):
+                futures[1].result()
+        self.assertEqual(ProductVariant.objects.get().sku_variant, "SHIRT-RED")
+
+
+class ShardedInventoryTests(APITestCase):
+    """
+    Flash-sale variants: stock split across slots, rolled up into inventory_count / reserved_count.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-S", inventory_count=10)
+        self.plain = ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-L", inventory_count=5)
+        shard_inventory(self.variant.pk, 4)
+
+    def slots(self):
+        # What each slot can still sell
+        return [slot.count - slot.reserved for slot in InventorySlot.objects.filter(variant=self.variant).order_by('slot')]
+
+    def reserve(self, quantities):
+        with transaction.atomic():
+            return reserve_stock(quantities)
+
+    # --- TEST 1: The stock is split evenly, and folded back on unsharding ---
+    def test_shard_and_unshard(self):
+        self.assertEqual(self.slots(), [3, 3, 2, 2])
+        shard_inventory(self.variant.pk, 2, stock=7)
+        self.assertEqual(self.slots(), [4, 3])
+
+        shard_inventory(self.variant.pk, 0)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.inventory_shards, self.variant.inventory_count, self.slots()), (0, 7, []))
+
+    # --- TEST 2: Checkouts hold on one slot and leave the variant row alone ---
+    def test_reserve_on_a_slot(self):
+        self.reserve({self.variant.pk: 2, self.plain.pk: 1})
+        self.assertIn(sorted(self.slots()), [[1, 2, 2, 3], [0, 2, 3, 3]]) # one slot, whichever was picked
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).available_count, 10)
+        self.assertEqual(ProductVariant.objects.get(pk=self.plain.pk).available_count, 4)
+
+    # --- TEST 3: A line no single slot covers is taken from several; more than the total is a 409 ---
+    def test_spread_and_short(self):
+        holds = self.reserve({self.variant.pk: 9})
+        self.assertEqual(sum(self.slots()), 1)
+        self.assertEqual(sum(quantity for _, _, quantity in holds), 9)
+
+        with self.assertRaises(InsufficientStock) as raised:
+            self.reserve({self.variant.pk: 2, self.plain.pk: 1})
+        self.assertEqual(raised.exception.lines, [{'product_variant_id': self.variant.pk, 'requested': 2, 'available': 1}])
+        self.assertEqual(ProductVariant.objects.get(pk=self.plain.pk).available_count, 5)
+
+        # Resharding waits until the holds are gone
+        with self.assertRaises(StockHeld):
+            shard_inventory(self.variant.pk, 2)
+        release_holds(holds)
+        self.assertEqual(sum(self.slots()), 10)
+
+    # --- TEST 4: The roll-up brings inventory_count, the API and the summary in line ---
+    def test_rollup(self):
+        url = f'/api/v1/catalogue/products/{self.product.id}/'
+        self.client.get(url)
+        commit_holds(self.reserve({self.variant.pk: 10}))
+
+        self.assertEqual(rollup_inventory_slots(), "1 variants updated")
+        stock = {v['sku_variant']: v['inventory_count'] for v in self.client.get(url).data['variants']}
+        self.assertEqual(stock, {"AIRMAX-S": 0, "AIRMAX-L": 5})
+
+        self.reserve({self.plain.pk: 5})
+        rollup_inventory_slots()
+        self.assertFalse(ProductSummary.objects.get(product=self.product).is_available)
+
+    # --- TEST 5: Restocking a variant with holds on it keeps them; resharding or going below them is refused ---
+    def test_restock_with_holds(self):
+        holds = self.reserve({self.variant.pk: 3})
+        shard_inventory(self.variant.pk, 4, stock=23)
+        self.assertEqual(self.slots(), [5, 5, 5, 5])
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.inventory_count, self.variant.reserved_count), (23, 3))
+
+        with self.assertRaises(StockHeld):
+            shard_inventory(self.variant.pk, 4, stock=2)
+        with self.assertRaises(StockHeld):
+            shard_inventory(self.variant.pk, 8)
+
+        # The holds still point at live slots: paying takes them off the new stock
+        commit_holds(holds)
+        self.assertEqual(rollup_inventory_slots(), "1 variants updated")
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.inventory_count, self.variant.available_count, sum(self.slots())), (20, 20, 20))
+
+        # Plain variants restock the same way
+        plain_holds = self.reserve({self.plain.pk: 4})
+        shard_inventory(self.plain.pk, 0, stock=9)
+        self.plain.refresh_from_db()
+        self.assertEqual((self.plain.inventory_count, self.plain.available_count), (9, 5))
+        release_holds(plain_holds)
+
+    # --- TEST 6: Saving a variant loaded before a checkout keeps the checkout's holds ---
+    def test_stale_save_keeps_holds(self):
+        stale = ProductVariant.objects.get(pk=self.plain.pk)
+        holds = self.reserve({self.plain.pk: 2})
+        stale.price_adjustment = 5
+        stale.save()
+        self.plain.refresh_from_db()
+        self.assertEqual((self.plain.price_adjustment, self.plain.reserved_count, stale.reserved_count), (5, 2, 2))
+        commit_holds(holds) # used to hit the reserved_count check constraint
+
+        # The stock can't go below what is held, from the admin or from code
+        holds = self.reserve({self.plain.pk: 2})
+        stale.inventory_count = 1
+        with self.assertRaises(ValidationError):
+            stale.full_clean()
+        with self.assertRaises(ValueError):
+            stale.save()
+        release_holds(holds)
+
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client.force_login(admin)
+        page = self.client.get(reverse('admin:catalogue_productvariant_change', args=[self.plain.pk]))
+        self.assertNotContains(page, 'name="reserved_count"')
+
+    # --- TEST 7: The Product page's variant rows lock the stock of sharded variants only ---
+    def test_inline_stock_read_only_when_sharded(self):
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client.force_login(admin)
+        page = self.client.get(reverse('admin:catalogue_product_change', args=[self.product.pk]))
+        variants = next(formset for formset in page.context['inline_admin_formsets'] if formset.opts.model is ProductVariant)
+        locked = {
+            form.instance.sku_variant: form.fields['inventory_count'].disabled
+            for form in variants.formset.forms if form.instance.pk
+        }
+        self.assertEqual(locked, {"AIRMAX-S": True, "AIRMAX-L": False})
+        self.assertNotContains(page, 'name="variants-0-reserved_count"')
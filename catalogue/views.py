@@ -1,18 +1,33 @@
-from rest_framework import viewsets, filters
-from rest_framework.permissions import IsAuthenticatedOrReadOnly 
+from functools import partial
+from hashlib import md5
+
+from rest_framework import viewsets, filters, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
-from django.utils.decorators import method_decorator      # <--- NEW
-from django.views.decorators.cache import cache_page      # <--- NEW
+from django.db.models import F
+from django.http import StreamingHttpResponse
 
-from .models import Product, Brand, Category
+from core.conditional import conditional_response
+from .cache import VersionedCacheMixin, bumped_at, get_versions
+from .export import FORMATS, export_lines
+from .facets import get_facets
+from .filters import ProductFilter, ProductSearchFilter
+from .matrix import MatrixError, generate_variants
+from .models import Product, Brand, Category, ProductVariant, ProductSummary
+from .pagination import ProductCursorPagination
 from .serializers import (
     ProductListSerializer, 
     ProductDetailSerializer, 
+    ProductVariantSerializer,
     BrandSerializer, 
-    CategorySerializer
+    CategorySerializer,
+    VariantMatrixSerializer
 )
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
     queryset = Product.objects.filter(is_active=True)
     lookup_field = 'id'
     
@@ -22,36 +37,127 @@ class ProductViewSet(viewsets.ModelViewSet):
     # Tools: Search, Filter, Order
     filter_backends = [
         DjangoFilterBackend, 
-        filters.SearchFilter, 
+        ProductSearchFilter, # Full-text + trigram search over Product.search_document / name
         filters.OrderingFilter
     ]
     
-    filterset_fields = ['brand', 'categories']
-    search_fields = ['name', 'description', 'brand__name', 'categories__name']
-    ordering_fields = ['base_price', 'created_at']
+    filterset_class = ProductFilter # brand, categories, min_price, max_price, in_stock
+    ordering_fields = ['base_price', 'created_at', 'min_price']
+
+    # Keyset pages: ?cursor=... seeks on (ordering field, id), never OFFSET
+    pagination_class = ProductCursorPagination
+
+    def get_queryset(self):
+        # The list only needs the ProductSummary row; min_price is exposed for ?ordering=min_price
+        queryset = super().get_queryset().select_related('summary').annotate(min_price=F('summary__min_price'))
+        if self.action in ('list', 'export'):
+            # export batch-loads its own relations per chunk (see export.py)
+            return queryset
+        # Detail loads every relation it renders up front, so the number of
+        # queries stays fixed no matter how many variants the product has.
+        return queryset.select_related('brand').prefetch_related(
+            'categories', 'images', 'variants__attribute_values__attribute'
+        )
 
     def get_serializer_class(self):
         if self.action == 'list':
             return ProductListSerializer
         return ProductDetailSerializer
 
-    # --- NEW: Cache the List View for 15 minutes ---
-    # This tells Django: "Don't run the database query every time. 
-    # Just serve the saved result from Redis for the next 900 seconds."
-    @method_decorator(cache_page(60 * 15)) 
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+    def retrieve(self, request, *args, **kwargs):
+        # The ETag is the product's cache versions, so a 304 is a Redis read and no SQL at all
+        product_id = kwargs['id']
+        if not str(product_id).isdigit():
+            return super().retrieve(request, *args, **kwargs) # 404
+        versions = get_versions(self.get_cache_versions())
+        etag = md5('|'.join(versions).encode()).hexdigest()
+        return conditional_response(
+            request, partial(super().retrieve, request, *args, **kwargs), etag=etag,
+            last_modified=partial(self.last_modified, product_id, versions),
+        )
+
+    def last_modified(self, product_id, versions):
+        # The summary follows every product, variant, image and category change; the
+        # versions add what it doesn't (brand and attribute renames), as the ETag does
+        updated_at = ProductSummary.objects.filter(product_id=product_id).values_list('updated_at', flat=True).first()
+        bumped = bumped_at(versions)
+        if updated_at is None or bumped is None:
+            return None
+        return max(updated_at, bumped)
+
+    # --- Facet counts for the current ?search= / filters (storefront sidebar) ---
+    @action(detail=False)
+    def facets(self, request):
+        return self.cached_response(self.build_facets, request)
+
+    def build_facets(self, request):
+        return Response(get_facets(self.filter_queryset(self.get_queryset())))
+
+    # --- Full catalogue dump for feeds/indexers: ?output=ndjson|csv, honours the list filters ---
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def export(self, request):
+        fmt = request.query_params.get('output', 'ndjson')
+        if fmt not in FORMATS:
+            raise ValidationError({'output': f"Choose one of: {', '.join(FORMATS)}."})
+        products = self.filter_queryset(self.get_queryset())
+        # Streamed straight from a server-side cursor, never built in memory
+        response = StreamingHttpResponse(export_lines(products, fmt), content_type=FORMATS[fmt])
+        response['Content-Disposition'] = f'attachment; filename="catalogue.{fmt}"'
+        return response
 
-class BrandViewSet(viewsets.ModelViewSet):
+    # --- 6 colours x 8 sizes in one request: POST {"attribute_values": [ids], "sku_pattern": ...} ---
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminUser], url_path='generate-variants')
+    def generate_variants(self, request, id=None):
+        product = self.get_object()
+        matrix = VariantMatrixSerializer(data=request.data)
+        matrix.is_valid(raise_exception=True)
+        try:
+            variants, skipped = generate_variants(product, **matrix.validated_data)
+        except MatrixError as error:
+            raise ValidationError({'detail': str(error)})
+
+        created = ProductVariant.objects.filter(pk__in=[v.pk for v in variants]).order_by('pk').select_related(
+            'product'
+        ).prefetch_related('attribute_values__attribute')
+        return Response({
+            'created': len(variants),
+            'skipped': skipped,
+            'variants': ProductVariantSerializer(created, many=True).data,
+        }, status=status.HTTP_201_CREATED)
+
+    # Cached in Redis until a price, stock, brand or category change bumps the version
+    # (facets share the list's versions)
+    def get_cache_versions(self):
+        if self.action == 'retrieve':
+            return [f"product:{self.kwargs['id']}", 'taxonomy']
+        return ['products', 'taxonomy']
+
+class BrandViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     filter_backends = [filters.SearchFilter]
     search_fields = ['name']
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     filter_backends = [filters.SearchFilter]
-    search_fields = ['name']
\ No newline at end of file
+    search_fields = ['name']
+
+    # --- Whole category tree, nested, from a single query ---
+    @action(detail=False)
+    def tree(self, request):
+        return self.cached_response(self.build_tree, request)
+
+    def build_tree(self, request):
+        # Ordering by the materialized path puts every parent before its children
+        categories = list(Category.objects.order_by('path'))
+        nodes = {}
+        roots = []
+        for category, data in zip(categories, CategorySerializer(categories, many=True).data):
+            node = nodes[category.pk] = {**data, 'children': []}
+            parent = nodes.get(category.parent_id)
+            (parent['children'] if parent else roots).append(node)
+        return Response(roots)
\ No newline at end of file
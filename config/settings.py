@@ -26,6 +26,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Third-Party Apps
     'rest_framework',
@@ -105,6 +106,15 @@ CACHES = {
     }
 }
 
+# Catalogue responses are cached under versioned keys (catalogue/cache.py),
+# so they can live long: any price/stock/taxonomy change makes them unreachable.
+CATALOGUE_CACHE_TTL = 60 * 60 * 24
+# After the TTL, one worker rebuilds an entry while the others serve it stale for up to this long
+CATALOGUE_CACHE_STALE_TTL = 60 * 5
+
+# Lower bounds of the price facet buckets (/catalogue/products/facets/), last one is open-ended
+CATALOGUE_PRICE_BUCKETS = [0, 50, 100, 250, 500, 1000]
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -160,6 +170,55 @@ CELERY_BROKER_URL = f'redis://{REDIS_HOST}:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 
+# Periodic tasks (run with `celery -A config beat`)
+CELERY_BEAT_SCHEDULE = {
+    'flush-cart-store': {
+        'task': 'cart.tasks.flush_cart_store',
+        'schedule': 60.0,
+    },
+    'reap-abandoned-carts': {
+        'task': 'cart.tasks.reap_abandoned_carts',
+        'schedule': 60.0 * 60,
+    },
+    # Sharded (flash-sale) variants: slot totals -> inventory_count
+    'rollup-inventory-slots': {
+        'task': 'catalogue.tasks.rollup_inventory_slots',
+        'schedule': 5.0,
+    },
+    'release-expired-reservations': {
+        'task': 'orders.tasks.release_expired_reservations',
+        'schedule': 60.0,
+    },
+    'purge-idempotency-keys': {
+        'task': 'core.tasks.purge_idempotency_keys',
+        'schedule': 60.0 * 60,
+    },
+}
+
+# --- CART STORAGE ---
+# 'cart.stores.DatabaseCartStore' keeps carts as Postgres rows.
+# 'cart.stores.RedisCartStore' keeps them in Redis (database 2) and writes them
+# behind to Postgres every minute (see CELERY_BEAT_SCHEDULE).
+CART_STORE = os.environ.get('CART_STORE', 'cart.stores.DatabaseCartStore')
+CART_REDIS_URL = f'redis://{REDIS_HOST}:6379/2'
+CART_REDIS_TTL = 60 * 60 * 24 * 30 # Idle carts expire from Redis after 30 days
+
+# Abandoned-cart reaper: carts idle this long are deleted, a batch at a time
+CART_ABANDONED_AFTER_DAYS = int(os.environ.get('CART_ABANDONED_AFTER_DAYS', 14))
+CART_REAPER_BATCH_SIZE = 500
+CART_REAPER_PAUSE = 0.1 # Seconds between batches
+
+# --- CHECKOUT ---
+# An order's stock is held this long (seconds) while it is being paid for,
+# then released by orders.tasks.release_expired_reservations
+ORDER_RESERVATION_TTL = int(os.environ.get('ORDER_RESERVATION_TTL', 15 * 60))
+
+# Idempotency-Key on checkout and payment initiation (core/idempotency.py):
+# responses are replayed for this long (seconds), then purged
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+# A first request still running after this long is presumed dead, and a retry takes over
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
 
 # --- JWT CONFIGURATION ---
 SIMPLE_JWT = {
@@ -170,6 +229,13 @@ SIMPLE_JWT = {
 # --- CHAPA CONFIGURATION ---
 # We are NOT using os.environ.get here because we want the value directly.
 CHAPA_SECRET_KEY = os.environ.get('CHAPA_SECRET_KEY', 'TEST-KEY-PLACEHOLDER')
+# Gateway client (orders/chapa.py). `manage.py fake_chapa` + CHAPA_BASE_URL=http://127.0.0.1:8765 works offline.
+CHAPA_BASE_URL = os.environ.get('CHAPA_BASE_URL', 'https://api.chapa.co')
+CHAPA_CONNECT_TIMEOUT = 3.05 # seconds
+CHAPA_READ_TIMEOUT = 10
+CHAPA_RETRIES = 2 # verify only, and calls that never connected
+CHAPA_BREAKER_THRESHOLD = 5 # failures in a row before calls stop for CHAPA_BREAKER_RESET seconds
+CHAPA_BREAKER_RESET = 30
 
 # --- EMAIL CONFIGURATION ---
 # Prints emails to the console (Terminal) instead of sending them.
@@ -0,0 +1,99 @@
+"""
+Single-flight caching with stale-while-revalidate.
+
+    from core.cache import get_or_compute
+
+    data = get_or_compute('reports:daily', build_report, timeout=300)
+
+Entries are stored as (value, fresh_until, compute_seconds) and kept in
+Redis for `timeout + stale_timeout`. When an entry goes stale, exactly one
+worker (the one holding a short Redis lock) recomputes it while the others
+keep returning the stale value. On a cold miss the other workers wait for
+that one computation instead of all hitting the database at once; if it
+raises, the next waiter takes the lock and computes in its place.
+
+With `beta > 0` an entry may also be refreshed a little *before* it expires
+("probabilistic early expiration"): the closer to expiry and the slower the
+computation, the more likely a request volunteers to refresh it.
+"""
+import math
+import random
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from redis.exceptions import LockError
+
+# status: 'hit', 'stale' (served old value while someone else refreshes) or 'miss'
+CacheResult = namedtuple('CacheResult', ['value', 'status'])
+
+
+def get_or_compute(key, compute, timeout, **options):
+    return fetch(key, compute, timeout, **options).value
+
+
+def fetch(key, compute, timeout, stale_timeout=60, lock_timeout=10, beta=1.0, wait_interval=0.05):
+    entry = cache.get(key)
+    if entry is not None:
+        value, fresh_until, delta = entry
+        if not _should_refresh(fresh_until, delta, beta):
+            return CacheResult(value, 'hit')
+
+        # Stale (or volunteering early): only the lock holder recomputes
+        lock = cache.lock(f'{key}:lock', timeout=lock_timeout)
+        if not lock.acquire(blocking=False):
+            return CacheResult(value, 'stale')
+        try:
+            return CacheResult(_compute_and_store(key, compute, timeout, stale_timeout), 'miss')
+        finally:
+            _release(lock)
+
+    # Cold miss: nothing stale to serve, so let one worker compute and the rest wait for it
+    lock = cache.lock(f'{key}:lock', timeout=lock_timeout)
+    if lock.acquire(blocking=False):
+        try:
+            return CacheResult(_compute_and_store(key, compute, timeout, stale_timeout), 'miss')
+        finally:
+            _release(lock)
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(wait_interval)
+        entry = cache.get(key)
+        if entry is not None:
+            return CacheResult(entry[0], 'hit')
+        # The lock is free but nothing was stored: the holder raised (a 404, say). Take over
+        # rather than wait out the timeout; the others keep waiting on us
+        if lock.acquire(blocking=False):
+            try:
+                entry = cache.get(key) # stored just before it let go?
+                if entry is not None:
+                    return CacheResult(entry[0], 'hit')
+                return CacheResult(_compute_and_store(key, compute, timeout, stale_timeout), 'miss')
+            finally:
+                _release(lock)
+
+    # The lock holder died or is too slow; compute it ourselves rather than fail
+    return CacheResult(_compute_and_store(key, compute, timeout, stale_timeout), 'miss')
+
+
+def _should_refresh(fresh_until, delta, beta):
+    # XFetch: now - delta * beta * ln(rand) >= expiry  (ln(rand) is negative)
+    early = delta * beta * -math.log(1.0 - random.random()) if beta else 0
+    return time.time() + early >= fresh_until
+
+
+def _compute_and_store(key, compute, timeout, stale_timeout):
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    cache.set(key, (value, time.time() + timeout, delta), timeout + stale_timeout)
+    return value
+
+
+def _release(lock):
+    try:
+        lock.release()
+    except LockError:
+        # Our lock already expired and may belong to someone else now; leave it alone
+        pass
@@ -0,0 +1,38 @@
+"""
+Conditional GET: ETag / Last-Modified validators and 304 Not Modified.
+
+    def retrieve(self, request, pk=None):
+        version = load_version(pk)                # cheap: one row, or a Redis read
+        return conditional_response(
+            request, lambda: Response(Serializer(load(pk)).data),
+            etag=f'{pk}-{version}', last_modified=updated_at,
+        )
+
+The validators are compared before `build` is called, so a client whose copy
+is still current gets its 304 without the object ever being loaded or
+serialized. `last_modified` may be a callable; it is only looked up when the
+ETag alone didn't answer the request.
+"""
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def conditional_response(request, build, etag, last_modified=None):
+    etag = quote_etag(etag)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    if callable(last_modified):
+        last_modified = last_modified()
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if not_modified is not None:
+        return not_modified
+
+    response = build()
+    if 200 <= response.status_code < 300:
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
@@ -0,0 +1,200 @@
+"""
+Idempotency-Key for the unsafe requests clients retry on timeouts.
+
+    class OrderViewSet(viewsets.ModelViewSet):
+        @idempotent
+        def create(self, request, *args, **kwargs):
+            ...
+
+The first request carrying a given key runs and its response is stored.
+Every retry with that key gets the stored response back (marked with an
+Idempotent-Replayed header) and the view does not run again. A retry that
+arrives while the first request is still running gets a 409 with a
+Retry-After, so it never starts a second checkout transaction or gateway
+call. Sending the same key with a different request is a 422.
+
+Completed responses are kept in Redis for IDEMPOTENCY_KEY_TTL, so a replay
+costs no SQL. They are also kept in the IdempotencyKey table, and that table
+is what guarantees one run per key: the view only runs once its unique row
+is claimed. A short Redis lock turns most concurrent duplicates away before
+they reach the database. If Redis is down, or has evicted the entry, the
+table answers on its own.
+
+The view runs in one transaction with the storing of its response, so the
+two commit together. A server error (a 5xx, or an exception such as a 409 for
+stock) drops the claim, so the retry runs for real; but an exception raised
+after that transaction committed (an on_commit hook failing) keeps it, and
+the retry replays the stored response instead of running the view again.
+Requests without the header are untouched.
+"""
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+logger = logging.getLogger(__name__)
+
+
+class RequestInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is still being processed, retry shortly."
+    default_code = 'idempotency_in_progress'
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used for a different request."
+    default_code = 'idempotency_key_reused'
+
+
+def idempotent(handler):
+    """Decorator for a view handler (`create`, `post`...) taking (self, request, ...)."""
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > 255:
+            raise ValidationError({HEADER: "Ensure this header has no more than 255 characters."})
+
+        scope = f'{request.method} {request.path}'
+        fingerprint = hashlib.sha256(_dumps(request.data).encode()).hexdigest()
+        cache_key = f'idempotency:{request.user.pk}:{hashlib.sha256(key.encode()).hexdigest()}'
+
+        # 1. Already answered: replay it straight from Redis
+        stored = _redis(cache.get, cache_key)
+        if stored is not None:
+            return _replay(stored, scope, fingerprint)
+
+        # 2. Concurrent duplicates stop at the Redis lock (None: Redis is down, the table decides)
+        locked = _redis(cache.add, f'{cache_key}:lock', 1, timeout=_lock_timeout())
+        if locked is False:
+            stored = _redis(cache.get, cache_key)
+            if stored is not None:
+                return _replay(stored, scope, fingerprint)
+            raise _in_progress()
+
+        try:
+            # 3. Claim the key in the table; the loser replays the winner's response
+            record, stored = _claim(request.user, key, scope, fingerprint)
+            if stored is not None:
+                _redis(cache.set, cache_key, stored, timeout=_ttl())
+                return _replay(stored, scope, fingerprint)
+
+            # 4. Run the view once, and keep what it answered in the same transaction as its work
+            try:
+                with transaction.atomic():
+                    response = handler(view, request, *args, **kwargs)
+                    if response.status_code < 500:
+                        # Stored the way the JSON renderer encodes it, so a replay (from Redis or the table) matches
+                        data = json.loads(_dumps(response.data))
+                        IdempotencyKey.objects.filter(pk=record.pk).update(status_code=response.status_code, response=data)
+            except Exception:
+                # Only a claim whose response never committed: otherwise the work is done, and stays replayable
+                IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).delete()
+                raise
+            if response.status_code >= 500:
+                record.delete()
+                return response
+
+            stored = {'scope': scope, 'fingerprint': fingerprint, 'status': response.status_code, 'data': data}
+            _redis(cache.set, cache_key, stored, timeout=_ttl())
+            return response
+        finally:
+            if locked:
+                _redis(cache.delete, f'{cache_key}:lock')
+
+    return wrapper
+
+
+def _claim(user, key, scope, fingerprint):
+    """Returns (record, None) if this request is the one to run, or (record, stored response)."""
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, key=key, scope=scope, fingerprint=fingerprint), None
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.get(user=user, key=key)
+    stored = {
+        'scope': record.scope, 'fingerprint': record.fingerprint,
+        'status': record.status_code, 'data': record.response,
+    }
+    _check(stored, scope, fingerprint)
+    if record.status_code is not None:
+        return record, stored
+
+    # Still running, unless whoever claimed it died long ago: then it is ours
+    now = timezone.now()
+    stale = IdempotencyKey.objects.filter(
+        pk=record.pk, status_code__isnull=True, locked_at__lt=now - timedelta(seconds=_lock_timeout())
+    )
+    if stale.update(locked_at=now):
+        return record, None
+    raise _in_progress()
+
+
+def _replay(stored, scope, fingerprint):
+    _check(stored, scope, fingerprint)
+    response = Response(stored['data'], status=stored['status'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _check(stored, scope, fingerprint):
+    if (stored['scope'], stored['fingerprint']) != (scope, fingerprint):
+        raise KeyReused()
+
+
+def _in_progress():
+    error = RequestInProgress()
+    error.wait = 1 # DRF sends it as Retry-After
+    return error
+
+
+def _dumps(data):
+    return json.dumps(data, sort_keys=True, cls=JSONEncoder)
+
+
+def _redis(call, *args, **kwargs):
+    try:
+        return call(*args, **kwargs)
+    except (ConnectionInterrupted, RedisError):
+        logger.warning("Redis unavailable for idempotency keys, using the database alone", exc_info=True)
+        return None
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+
+
+def _lock_timeout():
+    return getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)
+
+
+def purge(batch_size=500):
+    """Delete keys older than IDEMPOTENCY_KEY_TTL, a batch at a time. Returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=_ttl())
+    purged = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 
 class User(AbstractUser):
     email = models.EmailField(unique=True, blank=False)
@@ -12,3 +13,28 @@ class User(AbstractUser):
         return self.email
 
 
+
+
+class IdempotencyKey(models.Model):
+    # One per Idempotency-Key a user has sent (see core/idempotency.py).
+    # status_code is null while the first request is still running.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=255) # "POST /api/v1/orders/"
+    fingerprint = models.CharField(max_length=64) # sha256 of the request body
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            # The purge task range-scans the old ones
+            models.Index(fields=['created_at'], name='idempotency_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.scope}): {self.status_code or 'in progress'}"
@@ -0,0 +1,138 @@
+import datetime
+import json
+from base64 import b64decode, b64encode
+from operator import attrgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds; a cursor must seek from the exact value
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on the full sort key instead of an offset.
+
+    DRF's CursorPagination only stores the first ordering field and falls back
+    to OFFSET for ties. Here the cursor holds the value of every ordering
+    field plus the `tiebreak` column, so the next page is a single
+    `WHERE (price, id) > (last_price, last_id)` seek and page 500 costs the
+    same as page 1.
+
+    The ordering is taken from the queryset (OrderingFilter, or a filter
+    backend such as search ranking) and falls back to `ordering`.
+    """
+    ordering = '-created_at'
+    tiebreak = 'id'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor['reverse'])
+
+        if self.cursor:
+            queryset = queryset.filter(self._seek(self.cursor['values'], reverse))
+
+        ordering = [self._flip(field) for field in self.ordering] if reverse else self.ordering
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+        if not ordering:
+            ordering = [self.ordering] if isinstance(self.ordering, str) else list(self.ordering)
+
+        # Always finish on a unique column so rows with equal prices never get skipped
+        names = [field.lstrip('-') for field in ordering]
+        if self.tiebreak not in names and 'pk' not in names:
+            descending = ordering[-1].startswith('-')
+            ordering.append(f'-{self.tiebreak}' if descending else self.tiebreak)
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')))
+            values, reverse, ordering = cursor['v'], bool(cursor.get('r')), cursor['o']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # A cursor only makes sense for the ordering it was issued for
+        if ordering != self.ordering or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+
+    def encode_cursor(self, instance, reverse):
+        values = [
+            attrgetter(field.lstrip('-').replace('__', '.'))(instance)
+            for field in self.ordering
+        ]
+        cursor = {'v': values, 'o': self.ordering}
+        if reverse:
+            cursor['r'] = 1
+        payload = json.dumps(cursor, cls=CursorEncoder, separators=(',', ':'))
+        encoded = b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _seek(self, values, reverse):
+        """
+        Build `(a, b, id) > (x, y, z)` as OR-ed equality prefixes, honouring
+        the direction of each field. The leading `a >= x` bound is redundant
+        but lets Postgres start an index range scan at the cursor.
+        """
+        seek = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            seek |= Q(**equal, **{f'{name}__{"lt" if descending else "gt"}': value})
+            equal[name] = value
+
+        first = self.ordering[0]
+        descending = first.startswith('-') != reverse
+        bound = Q(**{f'{first.lstrip("-")}__{"lte" if descending else "gte"}': values[0]})
+        return bound & seek
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from .idempotency import purge
+
+
+@shared_task
+def purge_idempotency_keys():
+    """Idempotency keys are only replayed for IDEMPOTENCY_KEY_TTL; drop the older ones."""
+    return f"Purged {purge()} idempotency key(s)"
@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    Test mixin that catches N+1 queries on API endpoints.
+
+    Usage:
+        self.assertConstantQueries(
+            lambda: self.client.get(url),   # the request to measure
+            lambda: make_more_rows(),       # grows the data behind it
+        )
+
+    The request is measured once, the data is grown, and the request is
+    measured again. Both runs must issue exactly the same number of queries.
+    """
+
+    def count_queries(self, request):
+        # Start from a cold cache, otherwise a cached response hides the queries
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        return response, context.captured_queries
+
+    def assertConstantQueries(self, request, grow, msg=None):
+        response, before = self.count_queries(request)
+        self.assertLess(response.status_code, 400, 'Request failed before growing the data')
+
+        grow()
+
+        response, after = self.count_queries(request)
+        self.assertLess(response.status_code, 400, 'Request failed after growing the data')
+
+        if len(before) != len(after):
+            extra = '\n'.join(query['sql'] for query in after[len(before):])
+            self.fail(self._formatMessage(
+                msg,
+                f'Query count grew from {len(before)} to {len(after)} with more rows. '
+                f'Trailing queries:\n{extra}'
+            ))
+        return len(after)
@@ -1,3 +1,110 @@
-from django.test import TestCase
+import threading
+import time
+from uuid import uuid4
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from .cache import fetch, get_or_compute
+
+
+class SingleFlightCacheTests(SimpleTestCase):
+    """
+    core.cache: one worker recomputes, everyone else gets a value.
+    """
+
+    def setUp(self):
+        # Fresh key per test, the Redis cache is shared with the dev server
+        self.key = f'tests:single-flight:{uuid4().hex}'
+        self.calls = 0
+
+    def compute(self, value='fresh', delay=0):
+        def run():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return run
+
+    # --- TEST 1: Plain hit after the first computation ---
+    def test_hit_after_miss(self):
+        self.assertEqual(fetch(self.key, self.compute(), 60).status, 'miss')
+        result = fetch(self.key, self.compute(), 60)
+
+        self.assertEqual(result, ('fresh', 'hit'))
+        self.assertEqual(self.calls, 1)
+
+    # --- TEST 2: Concurrent cold misses compute once ---
+    def test_concurrent_misses_compute_once(self):
+        results = []
+        compute = self.compute(delay=0.3)
+
+        def worker():
+            results.append(get_or_compute(self.key, compute, 60))
+
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['fresh'] * 10)
+        self.assertEqual(self.calls, 1)
+
+    # --- TEST 3: Stale value is served while another worker holds the lock ---
+    def test_stale_while_revalidate(self):
+        cache.set(self.key, ('old', time.time() - 1, 0.1), 60)
+        lock = cache.lock(f'{self.key}:lock', timeout=5)
+        lock.acquire(blocking=False)
+        try:
+            result = fetch(self.key, self.compute(), 60)
+        finally:
+            lock.release()
+
+        self.assertEqual(result, ('old', 'stale'))
+        self.assertEqual(self.calls, 0)
+
+        # Once the lock is free the next request refreshes it
+        self.assertEqual(fetch(self.key, self.compute(), 60), ('fresh', 'miss'))
+
+    # --- TEST 4: Early probabilistic refresh and opting out of it ---
+    def test_early_refresh(self):
+        # Fresh for one more second, but the last computation took hours
+        cache.set(self.key, ('old', time.time() + 1, 100000), 60)
+        self.assertEqual(fetch(self.key, self.compute(), 60, beta=0), ('old', 'hit'))
+        self.assertEqual(fetch(self.key, self.compute(), 60, beta=1), ('fresh', 'miss'))
+
+    # --- TEST 5: A failed computation releases the lock ---
+    def test_error_releases_lock(self):
+        def boom():
+            raise ValueError("database down")
+
+        with self.assertRaises(ValueError):
+            fetch(self.key, boom, 60)
+        self.assertEqual(fetch(self.key, self.compute(), 60, lock_timeout=1), ('fresh', 'miss'))
+
+    # --- TEST 6: Waiters don't sit out the lock timeout when the computation fails ---
+    def test_waiters_take_over_after_failure(self):
+        started = threading.Event()
+        outcomes = []
+
+        def fail():
+            started.set()
+            time.sleep(0.2)
+            raise ValueError("not found")
+
+        def first():
+            try:
+                fetch(self.key, fail, 60)
+            except ValueError:
+                outcomes.append('failed')
+
+        holder = threading.Thread(target=first)
+        holder.start()
+        started.wait()
+        began = time.monotonic()
+        with self.assertRaises(ValueError):
+            fetch(self.key, fail, 60, lock_timeout=10)
+        holder.join()
+
+        self.assertLess(time.monotonic() - began, 2)
+        self.assertEqual(outcomes, ['failed'])
@@ -3,12 +3,12 @@ from .models import Order, OrderItem, Payment
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
-    readonly_fields = ['product_variant', 'quantity', 'unit_price']
+    readonly_fields = ['product_variant', 'product_name', 'variant_label', 'quantity', 'unit_price']
     extra = 0
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'placed_at', 'payment_status']
+    list_display = ['id', 'user', 'placed_at', 'payment_status', 'total_amount', 'item_count']
     list_filter = ['payment_status', 'placed_at']
     inlines = [OrderItemInline]
 
@@ -0,0 +1,162 @@
+"""
+Chapa payment gateway client.
+
+    from orders.chapa import ChapaUnavailable, get_client
+
+    try:
+        data = get_client().initialize(payload)   # {'status': 'success', 'data': {'checkout_url': ...}}
+        data = get_client().verify(tx_ref)
+    except ChapaUnavailable:
+        ...  # timed out, unreachable, 5xx, or the circuit is open: the outcome is unknown
+
+One client per process (per settings), holding a keep-alive connection pool,
+so calls reuse an open TLS connection instead of paying a handshake each
+time. Every call has a connect and a read timeout (CHAPA_CONNECT_TIMEOUT /
+CHAPA_READ_TIMEOUT), so a slow gateway can't hold a worker for longer.
+
+Retries, with exponential backoff, only where repeating is harmless:
+verify (a GET) on timeouts and 502/503/504, and any call whose connection
+was never made. A POST that reached Chapa is never sent twice.
+
+After CHAPA_BREAKER_THRESHOLD failures in a row the circuit opens: calls fail
+at once for CHAPA_BREAKER_RESET seconds instead of queueing on a dead
+gateway, then one trial call decides whether it closes again. The breaker is
+per process.
+
+4xx answers are not failures, they are returned for the caller to read
+(Chapa explains a rejected request in the body).
+
+For ASGI views, get_async_client() has the same calls as coroutines.
+fake_chapa.py is a local stand-in for tests and load tests
+(`manage.py fake_chapa`, then CHAPA_BASE_URL=http://127.0.0.1:<port>).
+"""
+import threading
+import time
+from functools import lru_cache
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ChapaUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Closed -> open after `threshold` failures in a row -> one trial call after `reset_timeout` seconds."""
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Half-open: let this call through, and hold the others back until it is done
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class ChapaClient:
+
+    def __init__(self, base_url, secret_key, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.3,
+                 pool_size=10, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+
+        retry = Retry(
+            total=retries, backoff_factor=backoff,
+            status_forcelist=(502, 503, 504), allowed_methods=frozenset({'GET'}),
+            raise_on_status=False, # the last 5xx comes back as a response, and counts as a failure below
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+        self.session.headers['Authorization'] = f'Bearer {secret_key}'
+
+    def initialize(self, payload):
+        return self._call('POST', '/v1/transaction/initialize', json=payload)
+
+    def verify(self, tx_ref):
+        return self._call('GET', f'/v1/transaction/verify/{tx_ref}')
+
+    def _call(self, method, path, **kwargs):
+        if not self.breaker.allow():
+            raise ChapaUnavailable("Chapa is failing, not calling it for now (circuit open)")
+        try:
+            response = self.session.request(method, f'{self.base_url}{path}', timeout=self.timeout, **kwargs)
+            if response.status_code >= 500:
+                raise ChapaUnavailable(f"Chapa answered {response.status_code}")
+            data = response.json()
+        except (requests.RequestException, ValueError, ChapaUnavailable) as error:
+            self.breaker.record_failure()
+            if isinstance(error, ChapaUnavailable):
+                raise
+            raise ChapaUnavailable(str(error)) from error
+        self.breaker.record_success()
+        return data
+
+
+class AsyncChapaClient:
+    """
+    The same calls as coroutines, for ASGI. They run the pooled client in a
+    worker thread, so the event loop never waits on the gateway.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def initialize(self, payload):
+        return await sync_to_async(self.client.initialize, thread_sensitive=False)(payload)
+
+    async def verify(self, tx_ref):
+        return await sync_to_async(self.client.verify, thread_sensitive=False)(tx_ref)
+
+
+def get_client():
+    return _build_client(
+        getattr(settings, 'CHAPA_BASE_URL', 'https://api.chapa.co'),
+        settings.CHAPA_SECRET_KEY,
+        getattr(settings, 'CHAPA_CONNECT_TIMEOUT', 3.05),
+        getattr(settings, 'CHAPA_READ_TIMEOUT', 10),
+        getattr(settings, 'CHAPA_RETRIES', 2),
+        getattr(settings, 'CHAPA_BREAKER_THRESHOLD', 5),
+        getattr(settings, 'CHAPA_BREAKER_RESET', 30),
+    )
+
+
+def get_async_client():
+    return AsyncChapaClient(get_client())
+
+
+@lru_cache(maxsize=None)
+def _build_client(base_url, secret_key, connect_timeout, read_timeout, retries, threshold, reset_timeout):
+    return ChapaClient(
+        base_url, secret_key, connect_timeout=connect_timeout, read_timeout=read_timeout, retries=retries,
+        breaker=CircuitBreaker(threshold, reset_timeout),
+    )
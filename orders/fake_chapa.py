@@ -0,0 +1,130 @@
+"""
+A local, in-process stand-in for api.chapa.co, for tests and load tests.
+
+    with FakeChapa() as chapa, override_settings(CHAPA_BASE_URL=chapa.url):
+        ...                    # the payment views now talk to it
+        chapa.fail(2)          # the next 2 requests get a 503
+        chapa.delay = 0.5      # seconds before every answer
+        chapa.outcome = 'failed' # what verify reports
+        chapa.requests         # [(method, path), ...] seen so far
+        chapa.connections      # TCP connections opened (keep-alive reuses them)
+
+It speaks HTTP/1.1 with keep-alive, like the real gateway, and answers the
+two calls orders/chapa.py makes: initialize (returns a checkout_url) and
+verify (only for tx_refs it initialized). Requests without a Bearer token
+get a 401. `manage.py fake_chapa` runs one on a fixed port.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VERIFY_PATH = re.compile(r'^/v1/transaction/verify/(?P<tx_ref>[^/]+)$')
+
+
+class FakeChapa:
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.delay = 0
+        self.outcome = 'success'
+        self.requests = []
+        self.connections = 0
+        self.transactions = {}
+        self._failures = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+
+    def fail(self, times=1):
+        with self._lock:
+            self._failures = times
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def answer(self, method, path, headers, body):
+        """Returns (status, payload) for one request."""
+        with self._lock:
+            self.requests.append((method, path))
+            failing = self._failures > 0
+            self._failures -= failing
+        if self.delay:
+            time.sleep(self.delay)
+        if failing:
+            return 503, {'message': 'Service Unavailable', 'status': 'failed'}
+        if not headers.get('Authorization', '').startswith('Bearer '):
+            return 401, {'message': 'Invalid API Key', 'status': 'failed'}
+
+        if method == 'POST' and path == '/v1/transaction/initialize':
+            try:
+                payload = json.loads(body or b'{}')
+                tx_ref, amount = payload['tx_ref'], payload['amount']
+            except (ValueError, KeyError):
+                return 400, {'message': 'tx_ref and amount are required', 'status': 'failed'}
+            self.transactions[tx_ref] = payload
+            return 200, {
+                'message': 'Hosted Link', 'status': 'success',
+                'data': {'checkout_url': f'{self.url}/checkout/{tx_ref}'},
+            }
+
+        match = VERIFY_PATH.match(path)
+        if method == 'GET' and match:
+            payload = self.transactions.get(match['tx_ref'])
+            if payload is None:
+                return 404, {'message': 'Invalid transaction or Transaction not found', 'status': 'failed'}
+            return 200, {
+                'message': 'Payment details', 'status': self.outcome,
+                'data': {
+                    'tx_ref': match['tx_ref'], 'amount': payload['amount'],
+                    'currency': payload.get('currency', 'ETB'), 'status': self.outcome,
+                },
+            }
+        return 404, {'message': 'Not found', 'status': 'failed'}
+
+
+def _handler(fake):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive
+
+        def setup(self):
+            super().setup()
+            with fake._lock:
+                fake.connections += 1
+
+        def do_GET(self):
+            self.respond()
+
+        def do_POST(self):
+            self.respond()
+
+        def respond(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            status, payload = fake.answer(self.command, self.path, self.headers, body)
+            content = json.dumps(payload).encode()
+            try:
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True # the client timed out and hung up
+
+        def log_message(self, format, *args):
+            pass # quiet in tests
+
+    return Handler
@@ -0,0 +1,130 @@
+import random
+import statistics
+import threading
+import time
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from catalogue.inventory import InsufficientStock, reserve_stock, roll_up_slots, shard_inventory
+from catalogue.models import Product, ProductVariant
+
+
+class Command(BaseCommand):
+    help = (
+        "Run parallel checkouts (stock reservation, in overlapping multi-line baskets) against a few "
+        "throwaway variants, once on single inventory rows and once with the stock sharded across "
+        "--shards slots. Reports orders/s and latency, and fails if any unit was oversold."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=16, help="Parallel transactions (one connection each).")
+        parser.add_argument('--variants', type=int, default=5)
+        parser.add_argument('--stock', type=int, default=500, help="Starting stock of each variant.")
+        parser.add_argument('--lines', type=int, default=3, help="Most lines in one basket.")
+        parser.add_argument('--shards', type=int, default=8, help="Slots per variant for the sharded run (0: skip it).")
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Baskets share variants and list them in random order: the worst case for lock ordering
+        baskets = []
+        for _ in range(options['checkouts']):
+            lines = rng.sample(range(options['variants']), rng.randint(1, min(options['lines'], options['variants'])))
+            baskets.append({line: rng.randint(1, 3) for line in lines})
+
+        rates = {}
+        for shards in [0, options['shards']] if options['shards'] else [0]:
+            label = f"sharded x{shards}" if shards else "single row"
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            rates[label] = self.run(baskets, shards, options)
+
+        if len(rates) == 2:
+            single, sharded = rates.values()
+            self.stdout.write(f"Sharded: {sharded / max(single, 1e-6):.2f}x the orders/s of the single-row path")
+
+    def run(self, baskets, shards, options):
+        stock = options['stock']
+        # Inactive, so it never shows up in the storefront while the benchmark runs
+        product = Product.objects.create(
+            name="Checkout benchmark", sku_base=f'BENCH-{uuid4().hex[:12]}', base_price=1, is_active=False
+        )
+        try:
+            variants = ProductVariant.objects.bulk_create([
+                ProductVariant(product=product, sku_variant=f'{product.sku_base}-{i}', inventory_count=stock)
+                for i in range(options['variants'])
+            ])
+            ids = [variant.pk for variant in variants]
+            if shards:
+                for pk in ids:
+                    shard_inventory(pk, shards)
+
+            results = []
+            jobs = [{ids[line]: quantity for line, quantity in basket.items()} for basket in baskets]
+            workers = [
+                threading.Thread(target=self.work, args=(jobs[i::options['workers']], results))
+                for i in range(options['workers'])
+            ]
+            started = time.monotonic()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.monotonic() - started
+
+            roll_up_slots()
+            return self.report(results, ids, stock, elapsed)
+        finally:
+            product.delete()
+
+    def work(self, jobs, results):
+        try:
+            for basket in jobs:
+                started = time.monotonic()
+                try:
+                    with transaction.atomic():
+                        reserve_stock(basket)
+                    outcome = 'sold'
+                except InsufficientStock:
+                    outcome = 'refused'
+                except DatabaseError as error:
+                    # Deadlocks, serialization failures... none are expected
+                    outcome = type(error).__name__
+                results.append((basket, outcome, time.monotonic() - started))
+        finally:
+            connection.close()  # each worker thread has its own connection
+
+    def report(self, results, ids, stock, elapsed):
+        outcomes = [outcome for _, outcome, _ in results]
+        latencies = sorted(seconds * 1000 for _, _, seconds in results)
+        sold = {pk: 0 for pk in ids}
+        for basket, outcome, _ in results:
+            if outcome == 'sold':
+                for pk, quantity in basket.items():
+                    sold[pk] += quantity
+
+        rate = outcomes.count('sold') / max(elapsed, 1e-6)
+        self.stdout.write(
+            f"{len(results)} checkouts in {elapsed:.2f}s: {outcomes.count('sold')} sold ({rate:.0f} orders/s), "
+            f"{outcomes.count('refused')} refused for stock"
+        )
+        self.stdout.write(
+            f"latency p50={statistics.median(latencies):.1f}ms "
+            f"p95={latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.1f}ms "
+            f"max={latencies[-1]:.1f}ms"
+        )
+
+        errors = sorted(set(outcomes) - {'sold', 'refused'})
+        remaining = {variant.pk: variant.available_count for variant in ProductVariant.objects.filter(pk__in=ids)}
+        oversold = [pk for pk in ids if sold[pk] != stock - remaining[pk] or sold[pk] > stock]
+        for pk in ids:
+            self.stdout.write(f"  variant {pk}: sold {sold[pk]} of {stock}, {remaining[pk]} left")
+
+        if errors:
+            raise CommandError(f"Checkouts failed with: {', '.join(errors)}")
+        if oversold:
+            raise CommandError(f"Stock accounting is off for variants {oversold}")
+        self.stdout.write(self.style.SUCCESS("No oversell: every unit sold was in stock."))
+        return rate
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.fake_chapa import FakeChapa
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local fake Chapa gateway for offline development and load tests. "
+        "Point the app at it with CHAPA_BASE_URL=http://127.0.0.1:<port>."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=0, help="Seconds before every answer (a slow gateway).")
+        parser.add_argument('--outcome', default='success', help="What verify reports: success or failed.")
+
+    def handle(self, *args, **options):
+        chapa = FakeChapa(port=options['port'])
+        chapa.delay, chapa.outcome = options['delay'], options['outcome']
+        with chapa:
+            self.stdout.write(self.style.SUCCESS(f"Fake Chapa on {chapa.url} (Ctrl-C to stop)"))
+            try:
+                while True:
+                    time.sleep(60)
+            except KeyboardInterrupt:
+                self.stdout.write(f"{len(chapa.requests)} requests over {chapa.connections} connections")
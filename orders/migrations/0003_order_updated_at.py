@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+# Changes were never tracked before, so existing orders start from when they were placed
+BACKFILL_UPDATED_AT = "UPDATE orders_order SET updated_at = placed_at"
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_payment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunSQL(BACKFILL_UPDATED_AT, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+# Existing lines get the names the catalogue has today (the best there is),
+# labelled like ProductVariant.__str__, and orders the totals of their lines
+BACKFILL_SNAPSHOTS = """
+UPDATE orders_orderitem i
+SET product_name = p.name, variant_label = p.name || ' (Variant: ' || v.sku_variant || ')'
+FROM catalogue_productvariant v JOIN catalogue_product p ON p.id = v.product_id
+WHERE v.id = i.product_variant_id
+"""
+
+BACKFILL_TOTALS = """
+UPDATE orders_order o
+SET total_amount = t.total_amount, item_count = t.item_count
+FROM (
+    SELECT order_id, SUM(unit_price * quantity) AS total_amount, SUM(quantity) AS item_count
+    FROM orders_orderitem GROUP BY order_id
+) t
+WHERE t.order_id = o.id
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='variant_label',
+            field=models.CharField(blank=True, max_length=312),
+        ),
+        migrations.RunSQL(BACKFILL_SNAPSHOTS, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(BACKFILL_TOTALS, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -1,23 +1,43 @@
 from django.db import models
 from django.conf import settings
 from uuid import uuid4
-from catalogue.models import ProductVariant
+from catalogue.models import InventorySlot, ProductVariant
 
 class Order(models.Model):
     PAYMENT_STATUS_CHOICES = [
         ('P', 'Pending'),
         ('C', 'Complete'),
         ('F', 'Failed'),
+        ('E', 'Expired'), # Not paid before its stock reservation ran out
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='orders')
     placed_at = models.DateTimeField(auto_now_add=True)
     payment_status = models.CharField(max_length=1, choices=PAYMENT_STATUS_CHOICES, default='P')
+    # Moves with every save (payment status changes); the ETag / Last-Modified of GET /orders/<id>/
+    updated_at = models.DateTimeField(auto_now=True)
     
+    # While set, the order's stock is only held for it (see reservations.py),
+    # until this time; cleared once the payment takes it for good
+    reserved_until = models.DateTimeField(null=True, blank=True)
+
+    # Written once at checkout, so history and payment never sum the lines again
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0) # Units, not lines
+
     # Simple shipping info for now
     shipping_address = models.TextField(blank=True)
     
+    class Meta:
+        indexes = [
+            # Order history pages seek on (placed_at, id), newest first (see pagination.py):
+            # a customer's own orders, staff filtering by status, and everything
+            models.Index(fields=['user', 'placed_at', 'id'], name='order_user_placed_idx'),
+            models.Index(fields=['payment_status', 'placed_at', 'id'], name='order_status_placed_idx'),
+            models.Index(fields=['placed_at', 'id'], name='order_placed_keyset_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} ({self.payment_status})"
 
@@ -28,6 +48,10 @@ class OrderItem(models.Model):
     
     # We freeze the price here so it doesn't change if the product price changes later
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Frozen too: what the customer bought, even if the catalogue renames it later
+    product_name = models.CharField(max_length=200, blank=True)
+    # str(variant): "{product name, 200} (Variant: {sku_variant, 100})"
+    variant_label = models.CharField(max_length=312, blank=True)
 
     def get_total_price(self):
         return self.unit_price * self.quantity
@@ -35,6 +59,27 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.quantity} x {self.product_variant} in Order {self.order.id}"
 
+class StockReservation(models.Model):
+    # Stock held for an unpaid order; deleted when the payment commits it or the hold is released
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
+    slot = models.ForeignKey(InventorySlot, on_delete=models.CASCADE, null=True, blank=True) # Sharded variants
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # The release task range-scans the expired ones
+            models.Index(fields=['expires_at'], name='reservation_expires_at_idx'),
+        ]
+
+    @property
+    def hold(self):
+        return (self.product_variant_id, self.slot_id, self.quantity)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_variant_id} for Order {self.order_id} until {self.expires_at}"
+
 class Payment(models.Model):
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='payment')
     transaction_id = models.CharField(max_length=100, unique=True)
@@ -0,0 +1,11 @@
+from core.pagination import KeysetPagination
+
+
+class OrderCursorPagination(KeysetPagination):
+    """
+    Newest orders first, seeking on (placed_at, id).
+    Backed by the (user, placed_at, id), (payment_status, placed_at, id) and
+    (placed_at, id) indexes on Order, one per way the history is filtered.
+    """
+    ordering = '-placed_at'
+    page_size = 20
@@ -0,0 +1,105 @@
+"""
+Stock reservations: an order holds its stock while it is being paid for.
+
+Checkout reserves the stock (catalogue.inventory.reserve_stock) and records
+one StockReservation row per hold, expiring ORDER_RESERVATION_TTL seconds
+later. From there, one of:
+
+    commit(order)              payment verified: the held units are taken for good
+    release([order.id], 'F')   payment failed: they can be sold again
+    release_expired()          periodic task: every hold past its time, in batches
+
+Available stock is on hand minus active holds (ProductVariant.available_count),
+so nothing here is ever summed at read time.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from catalogue.inventory import commit_holds, release_holds, reserve_stock
+from .models import Order, StockReservation
+
+BATCH_SIZE = 500
+
+
+def hold_until():
+    return timezone.now() + timedelta(seconds=getattr(settings, 'ORDER_RESERVATION_TTL', 15 * 60))
+
+
+def record(order, holds):
+    StockReservation.objects.bulk_create([
+        StockReservation(
+            order=order, product_variant_id=variant_id, slot_id=slot_id, quantity=quantity,
+            expires_at=order.reserved_until,
+        )
+        for variant_id, slot_id, quantity in holds
+    ])
+
+
+def commit(order):
+    """
+    Take the order's held stock for good. If its holds were already released
+    (it was paid after they expired), the stock is taken again now, which
+    raises InsufficientStock if it has sold out in the meantime.
+    """
+    with transaction.atomic():
+        # The order row serializes concurrent verifications of the same payment
+        reserved_until = Order.objects.select_for_update().filter(pk=order.pk).values_list(
+            'reserved_until', flat=True
+        ).get()
+        if reserved_until is None:
+            return # already committed, or placed before reservations existed
+
+        # Its reservations are only touched under the order row's lock (see release)
+        reservations = list(order.reservations.all())
+        if reservations:
+            commit_holds([reservation.hold for reservation in reservations])
+            StockReservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).delete()
+        else:
+            commit_holds(reserve_stock({item.product_variant_id: item.quantity for item in order.items.all()}))
+        Order.objects.filter(pk=order.pk).update(reserved_until=None, updated_at=timezone.now())
+        order.reserved_until = None
+
+
+def release(order_ids, payment_status='F'):
+    """Give back the stock held by these orders and mark the unpaid ones `payment_status`."""
+    with transaction.atomic():
+        # Same lock order as commit(): the order rows, then their reservations
+        order_ids = list(Order.objects.select_for_update().filter(pk__in=order_ids).order_by('pk').values_list('pk', flat=True))
+        _release(order_ids, payment_status)
+
+
+def release_expired(batch_size=BATCH_SIZE):
+    """
+    Release the holds of every order past its expiry, `batch_size` orders at
+    a time, each batch in its own short transaction. Orders a payment is
+    committing right now are skipped, not waited on. Returns how many holds
+    were released.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            # Order rows first, like commit(); the ones it holds are skipped
+            expired = StockReservation.objects.filter(expires_at__lte=timezone.now()).values('order_id')
+            order_ids = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(pk__in=expired).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                return released
+            released += _release(order_ids, 'E')
+
+
+def _release(order_ids, payment_status):
+    # The callers hold these orders' rows, so nobody else touches their reservations
+    reservations = list(StockReservation.objects.filter(order_id__in=order_ids))
+    if not reservations:
+        return 0
+    release_holds([reservation.hold for reservation in reservations])
+    StockReservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).delete()
+    Order.objects.filter(pk__in={reservation.order_id for reservation in reservations}, payment_status='P').update(
+        payment_status=payment_status, updated_at=timezone.now()
+    )
+    return len(reservations)
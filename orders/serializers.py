@@ -2,8 +2,7 @@ from rest_framework import serializers
 from .models import Order, OrderItem
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    product_name = serializers.CharField(source='product_variant.product.name', read_only=True)
-    variant_label = serializers.CharField(source='product_variant.__str__', read_only=True)
+    # product_name / variant_label are snapshots taken at checkout, no catalogue joins
 
     class Meta:
         model = OrderItem
@@ -14,7 +13,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'placed_at', 'payment_status', 'user', 'items']
+        fields = ['id', 'placed_at', 'payment_status', 'user', 'total_amount', 'item_count', 'items']
 
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
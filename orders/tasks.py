@@ -2,6 +2,7 @@ from celery import shared_task
 from time import sleep
 from django.core.mail import send_mail
 from .models import Order
+from .reservations import release_expired
 
 @shared_task
 def send_order_confirmation(order_id):
@@ -49,4 +50,12 @@ def send_payment_success_email(order_id):
     except Order.DoesNotExist:
         return f"Order {order_id} not found"
     except Exception as e:
-        return f"Failed to send email: {str(e)}"
\ No newline at end of file
+        return f"Failed to send email: {str(e)}"
+
+@shared_task
+def release_expired_reservations():
+    """
+    Gives back the stock held by orders that weren't paid in time
+    (ORDER_RESERVATION_TTL) and marks them Expired.
+    """
+    return f"Released {release_expired()} expired holds"
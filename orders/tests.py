@@ -1,3 +1,762 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from urllib.parse import quote
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from cart.models import Cart, CartItem
+from catalogue.inventory import InsufficientStock, reserve_stock, roll_up_slots, shard_inventory
+from catalogue.models import Product, ProductVariant
+from core.models import IdempotencyKey, User
+from core.tasks import purge_idempotency_keys
+from core.testing import QueryBudgetMixin
+from . import reservations
+from .chapa import AsyncChapaClient, ChapaClient, ChapaUnavailable, CircuitBreaker
+from .fake_chapa import FakeChapa
+from .models import Order, OrderItem, Payment, StockReservation
+
+
+class OrderConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        variant = ProductVariant.objects.create(product=self.product, sku_variant="AIRMAX-S", inventory_count=3)
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product_variant=variant, quantity=1, unit_price=100)
+        self.url = f'/api/v1/orders/{self.order.id}/'
+        self.client.force_authenticate(self.user)
+
+    # --- TEST 1: An unchanged order is a 304 from one indexed lookup ---
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+    # --- TEST 2: A payment status change gives a new ETag ---
+    def test_status_change_gives_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.order.payment_status = 'C'
+        self.order.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['payment_status'], 'C')
+
+    # --- TEST 3: Other users' orders stay hidden, whatever the validators ---
+    def test_other_users_order(self):
+        other = User.objects.create_user(email="other@example.com", username="other", password="pass12345")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='*').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/v1/orders/not-a-uuid/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class OrderSnapshotTests(APITestCase):
+    """
+    Checkout writes the totals and freezes the line labels; reads never touch the catalogue.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.cart = Cart.objects.create()
+        for size, adjustment, quantity in (("S", 0, 2), ("L", 10, 1), ("XL", 20, 3)):
+            variant = ProductVariant.objects.create(
+                product=self.product, sku_variant=f"AIRMAX-{size}", inventory_count=5, price_adjustment=adjustment
+            )
+            CartItem.objects.create(cart=self.cart, product_variant=variant, quantity=quantity)
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/v1/orders/', {'cart_id': str(self.cart.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.order = Order.objects.get(pk=response.data['id'])
+
+    # --- TEST 1: Totals and labels are written at checkout ---
+    def test_checkout_writes_totals(self):
+        self.assertEqual((self.order.total_amount, self.order.item_count), (2 * 100 + 110 + 3 * 120, 6))
+        self.assertEqual(
+            sorted(self.order.items.values_list('product_name', 'variant_label')),
+            [("Air Max", f"Air Max (Variant: AIRMAX-{size})") for size in ("L", "S", "XL")],
+        )
+
+    # --- TEST 2: The detail reads two tables, and renaming the product doesn't rewrite history ---
+    def test_detail_reads_snapshots(self):
+        self.product.name = "Air Max 90"
+        self.product.save()
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/v1/orders/{self.order.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([q['sql'] for q in context.captured_queries if 'catalogue_' in q['sql']])
+        self.assertEqual({item['product_name'] for item in response.data['items']}, {"Air Max"})
+        self.assertEqual((response.data['total_amount'], response.data['item_count']), ('670.00', 6))
+
+    # --- TEST 3: The longest names and SKUs the catalogue allows still fit the snapshot ---
+    def test_longest_label(self):
+        product = Product.objects.create(name="N" * 200, base_price=100, sku_base="LONG")
+        variant = ProductVariant.objects.create(product=product, sku_variant="S" * 100, inventory_count=1)
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product_variant=variant, quantity=1)
+
+        response = self.client.post('/api/v1/orders/', {'cart_id': str(cart.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['items'][0]['variant_label'], str(variant))
+        self.assertEqual(len(str(variant)), 312)
+
+
+class OrderHistoryTests(QueryBudgetMixin, APITestCase):
+    """
+    GET /orders/: keyset pages, newest first, filterable, two queries a page.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.other = User.objects.create_user(email="other@example.com", username="other", password="pass12345")
+        self.staff = User.objects.create_user(email="staff@example.com", username="staff", password="pass12345", is_staff=True)
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=product, sku_variant="AIRMAX-S", inventory_count=5)
+        # 5 orders for the buyer, 2 of them at the same moment so the id tiebreak matters, and 2 for someone else
+        start = timezone.now() - timezone.timedelta(days=10)
+        self.orders = [
+            self.order(self.user, start + timezone.timedelta(days=min(n, 3)), 'C' if n % 2 else 'P') for n in range(5)
+        ] + [self.order(self.other, start + timezone.timedelta(days=n), 'F') for n in range(2)]
+        self.client.force_authenticate(self.user)
+
+    def order(self, user, placed_at, payment_status):
+        order = Order.objects.create(user=user, payment_status=payment_status, total_amount=100, item_count=1)
+        Order.objects.filter(pk=order.pk).update(placed_at=placed_at)
+        OrderItem.objects.create(order=order, product_variant=self.variant, quantity=1, unit_price=100, product_name="Air Max")
+        return order
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [order['id'] for order in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def newest_first(self, orders):
+        orders = Order.objects.filter(pk__in=[order.pk for order in orders])
+        return [str(order.id) for order in sorted(orders, key=lambda o: (o.placed_at, o.id), reverse=True)]
+
+    # --- TEST 1: Walking the pages returns each of my orders once, newest first ---
+    def test_walk_pages(self):
+        ids, pages = self.walk('/api/v1/orders/?page_size=2')
+        self.assertEqual(ids, self.newest_first(self.orders[:5]))
+        self.assertEqual(pages, 3)
+
+    # --- TEST 2: Staff see everyone's, and filter by user, status and date ---
+    def test_staff_filters(self):
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(len(self.walk('/api/v1/orders/?page_size=3')[0]), 7)
+        self.assertEqual(self.walk(f'/api/v1/orders/?user={self.other.id}')[0], self.newest_first(self.orders[5:]))
+        self.assertEqual(self.walk('/api/v1/orders/?payment_status=C')[0], self.newest_first(self.orders[1:5:2]))
+
+        after = quote(Order.objects.get(pk=self.orders[3].pk).placed_at.isoformat())
+        self.assertEqual(
+            self.walk(f'/api/v1/orders/?placed_after={after}&payment_status=P&page_size=1')[0],
+            self.newest_first([self.orders[4]]),
+        )
+        # A customer's ?user= can't reach anyone else's orders
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.walk(f'/api/v1/orders/?user={self.other.id}')[0], [])
+
+    # --- TEST 3: A page is two queries whatever the number of orders and lines ---
+    def test_constant_queries(self):
+        self.client.force_authenticate(self.staff)
+
+        def grow():
+            for n in range(5):
+                order = self.order(self.user, timezone.now(), 'P')
+                for _ in range(3):
+                    OrderItem.objects.create(order=order, product_variant=self.variant, quantity=1, unit_price=100)
+
+        queries = self.assertConstantQueries(lambda: self.client.get('/api/v1/orders/?page_size=10'), grow)
+        self.assertEqual(queries, 2)
+
+    # --- TEST 4: Deep pages seek instead of using OFFSET ---
+    def test_deep_page_has_no_offset(self):
+        first = self.client.get('/api/v1/orders/?page_size=2')
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(first.data['next'])
+        self.assertNotIn('OFFSET', context.captured_queries[0]['sql'])
+
+
+class CheckoutStockTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.small, self.large = [
+            ProductVariant.objects.create(product=product, sku_variant=f"AIRMAX-{size}", inventory_count=stock)
+            for size, stock in (("S", 5), ("L", 1))
+        ]
+        self.cart = Cart.objects.create()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, **lines):
+        for variant, quantity in lines.items():
+            CartItem.objects.create(cart=self.cart, product_variant=getattr(self, variant), quantity=quantity)
+        return self.client.post('/api/v1/orders/', {'cart_id': str(self.cart.id)}, format='json')
+
+    def stock(self):
+        return [variant.available_count for variant in ProductVariant.objects.order_by('id')]
+
+    # --- TEST 1: The whole basket is reserved by one conditional UPDATE ---
+    def test_reserves_in_one_statement(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.checkout(small=2, large=1)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(), [3, 0])
+
+        reservations = [q['sql'] for q in context.captured_queries if 'inventory_count - ' in q['sql']]
+        self.assertEqual(len(reservations), 1)
+        self.assertIn('FOR UPDATE', reservations[0])
+
+    # --- TEST 2: Short lines are a 409 listing them, and nothing is kept ---
+    def test_insufficient_stock(self):
+        response = self.checkout(small=2, large=3)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            response.data['lines'], [{'product_variant_id': self.large.id, 'requested': 3, 'available': 1}]
+        )
+        self.assertEqual(self.stock(), [5, 1])
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Cart.objects.filter(id=self.cart.id).exists())
+
+
+class StockReservationTests(APITestCase):
+    """
+    Checkout holds the stock; payment takes it, failure or expiry gives it back.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=product, sku_variant="AIRMAX-S", inventory_count=5)
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, quantity=2):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product_variant=self.variant, quantity=quantity)
+        response = self.client.post('/api/v1/orders/', {'cart_id': str(cart.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Order.objects.get(pk=response.data['id'])
+
+    def counts(self):
+        self.variant.refresh_from_db()
+        return self.variant.inventory_count, self.variant.reserved_count
+
+    def expire(self, order):
+        past = timezone.now() - timezone.timedelta(seconds=1)
+        Order.objects.filter(pk=order.pk).update(reserved_until=past)
+        order.reservations.update(expires_at=past)
+
+    # --- TEST 1: Checkout holds the stock until the reservation runs out ---
+    @override_settings(ORDER_RESERVATION_TTL=600)
+    def test_checkout_holds_stock(self):
+        order = self.checkout()
+        self.assertEqual(self.counts(), (5, 2))
+        reservation = order.reservations.get()
+        self.assertEqual((reservation.product_variant_id, reservation.quantity), (self.variant.pk, 2))
+        self.assertAlmostEqual((order.reserved_until - timezone.now()).total_seconds(), 600, delta=30)
+
+        # Nobody else can buy the held units
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product_variant=self.variant, quantity=4)
+        response = self.client.post('/api/v1/orders/', {'cart_id': str(cart.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['lines'][0]['available'], 3)
+
+    # --- TEST 2: A verified payment takes the held units for good, once ---
+    def test_commit(self):
+        order = self.checkout()
+        reservations.commit(order)
+        reservations.commit(order)
+        self.assertEqual(self.counts(), (3, 0))
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertIsNone(Order.objects.get(pk=order.pk).reserved_until)
+
+    # --- TEST 3: Expired holds go back on sale, and their orders are marked expired ---
+    def test_release_expired(self):
+        stale, fresh = self.checkout(), self.checkout(quantity=1)
+        self.expire(stale)
+
+        self.assertEqual(reservations.release_expired(batch_size=1), 1)
+        self.assertEqual(self.counts(), (5, 1))
+        self.assertEqual(Order.objects.get(pk=stale.pk).payment_status, 'E')
+        self.assertEqual(Order.objects.get(pk=fresh.pk).payment_status, 'P')
+
+        # Paying for it now is refused
+        response = self.client.post(f'/api/v1/payment/initiate/{stale.id}/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    # --- TEST 4: Paid after expiry: the stock is taken again, if there still is some ---
+    def test_commit_after_expiry(self):
+        order = self.checkout()
+        self.expire(order)
+        reservations.release_expired()
+        reservations.commit(order)
+        self.assertEqual(self.counts(), (3, 0))
+
+        late = self.checkout(quantity=3)
+        self.expire(late)
+        reservations.release_expired()
+        self.checkout(quantity=3)
+        with self.assertRaises(InsufficientStock):
+            reservations.commit(late)
+        self.assertEqual(self.counts(), (3, 3))
+
+    # --- TEST 5: Cancelling an order gives its stock back ---
+    def test_delete_releases(self):
+        order = self.checkout()
+        response = self.client.delete(f'/api/v1/orders/{order.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.counts(), (5, 0))
+
+
+class IdempotencyKeyTests(APITestCase):
+    """
+    Retried checkouts and payment initiations with an Idempotency-Key run once.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=product, sku_variant="AIRMAX-S", inventory_count=5)
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product_variant=self.variant, quantity=2)
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, key, cart=None):
+        return self.client.post(
+            '/api/v1/orders/', {'cart_id': str((cart or self.cart).id)}, format='json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    # --- TEST 1: A retry gets the first order back, from Redis, without a second checkout ---
+    def test_retry_replays_the_order(self):
+        first = self.checkout('key-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as context:
+            retry = self.checkout('key-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(context.captured_queries), 0)
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.available_count, 3)
+
+    # --- TEST 2: With Redis emptied, the table still replays it ---
+    def test_replay_from_the_database(self):
+        first = self.checkout('key-1')
+        cache.clear()
+        retry = self.checkout('key-1')
+        self.assertEqual((retry.status_code, retry.json()), (status.HTTP_201_CREATED, first.json()))
+        self.assertEqual(Order.objects.count(), 1)
+
+    # --- TEST 3: A duplicate while the first is still running is a 409, not a second run ---
+    def test_in_progress(self):
+        IdempotencyKey.objects.create(
+            user=self.user, key='key-1', scope='POST /api/v1/orders/',
+            fingerprint=hashlib.sha256(json.dumps({'cart_id': str(self.cart.id)}).encode()).hexdigest(),
+        )
+        response = self.checkout('key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Order.objects.exists())
+
+        # Unless the first one died: a claim older than the lock timeout is taken over
+        IdempotencyKey.objects.update(locked_at=timezone.now() - timezone.timedelta(minutes=5))
+        self.assertEqual(self.checkout('key-1').status_code, status.HTTP_201_CREATED)
+
+    # --- TEST 4: Same key, different request: 422 ---
+    def test_key_reused(self):
+        self.checkout('key-1')
+        other = Cart.objects.create()
+        CartItem.objects.create(cart=other, product_variant=self.variant, quantity=1)
+        self.assertEqual(self.checkout('key-1', other).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # Keys belong to their user
+        self.client.force_authenticate(User.objects.create_user(email="o@example.com", username="o", password="pass12345"))
+        self.assertEqual(self.checkout('key-1', other).status_code, status.HTTP_201_CREATED)
+
+    # --- TEST 5: Errors are not kept, the retry runs for real ---
+    def test_errors_are_not_replayed(self):
+        ProductVariant.objects.filter(pk=self.variant.pk).update(inventory_count=1)
+        self.assertEqual(self.checkout('key-1').status_code, status.HTTP_409_CONFLICT)
+        ProductVariant.objects.filter(pk=self.variant.pk).update(inventory_count=5)
+        self.assertEqual(self.checkout('key-1').status_code, status.HTTP_201_CREATED)
+
+    # --- TEST 6: Payment initiation answers are replayed too ---
+    def test_payment_initiation(self):
+        order = Order.objects.get(pk=self.checkout('key-1').data['id'])
+        Payment.objects.create(order=order, transaction_id='tx-1', amount=200, status="Completed")
+        url = f'/api/v1/payment/initiate/{order.id}/'
+        first = self.client.post(url, HTTP_IDEMPOTENCY_KEY='pay-1')
+        self.assertEqual(first.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='pay-1')['Idempotent-Replayed'], 'true')
+
+    # --- TEST 7: Old keys are purged ---
+    def test_purge(self):
+        self.checkout('key-1')
+        self.assertEqual(purge_idempotency_keys(), "Purged 0 idempotency key(s)")
+        IdempotencyKey.objects.update(created_at=timezone.now() - timezone.timedelta(days=2))
+        self.assertEqual(purge_idempotency_keys(), "Purged 1 idempotency key(s)")
+
+
+class IdempotencyConcurrencyTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        variant = ProductVariant.objects.create(product=product, sku_variant="AIRMAX-S", inventory_count=5)
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product_variant=variant, quantity=1)
+
+    def checkout(self, _):
+        try:
+            client = APIClient()
+            client.force_authenticate(self.user)
+            return client.post(
+                '/api/v1/orders/', {'cart_id': str(self.cart.id)}, format='json', HTTP_IDEMPOTENCY_KEY='storm',
+            ).status_code
+        finally:
+            connection.close()  # each worker thread has its own connection
+
+    # --- TEST 1: A retry storm with one key places one order ---
+    def test_retry_storm(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = list(pool.map(self.checkout, range(16)))
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(set(codes) - {201, 409}, set())
+        # Now that it is done, every retry gets the order
+        self.assertEqual(self.checkout(None), 201)
+
+    # --- TEST 2: A side effect failing after the checkout committed keeps the key: the retry replays the order ---
+    def test_failure_after_commit(self):
+        def fail_after_commit(sender, instance, created, **kwargs):
+            def fail():
+                raise ConnectionError("broker down")
+            transaction.on_commit(fail)
+        post_save.connect(fail_after_commit, sender=Order)
+        self.addCleanup(post_save.disconnect, fail_after_commit, sender=Order)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertRaises(ConnectionError):
+            client.post('/api/v1/orders/', {'cart_id': str(self.cart.id)}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        post_save.disconnect(fail_after_commit, sender=Order)
+
+        retry = client.post('/api/v1/orders/', {'cart_id': str(self.cart.id)}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(retry.data['id'], str(Order.objects.get().id))
+
+
+class ChapaClientTests(SimpleTestCase):
+    """
+    orders.chapa against the local fake gateway: pooling, timeouts, retries, circuit breaker.
+    """
+
+    def setUp(self):
+        self.chapa = FakeChapa().start()
+        self.addCleanup(self.chapa.stop)
+        self.client = ChapaClient(self.chapa.url, 'TEST-KEY', read_timeout=0.5, backoff=0)
+
+    def initialize(self, tx_ref='tx-1'):
+        return self.client.initialize({'amount': '200.00', 'currency': 'ETB', 'tx_ref': tx_ref})
+
+    # --- TEST 1: Calls share one keep-alive connection ---
+    def test_pooled_connection(self):
+        self.assertEqual(self.initialize()['data']['checkout_url'], f'{self.chapa.url}/checkout/tx-1')
+        for _ in range(5):
+            self.assertEqual(self.client.verify('tx-1')['status'], 'success')
+        self.assertEqual(self.chapa.connections, 1)
+
+    # --- TEST 2: Verify is retried through a 503, initialize is not sent twice ---
+    def test_retries_only_idempotent_calls(self):
+        self.initialize()
+        self.chapa.fail(1)
+        self.assertEqual(self.client.verify('tx-1')['status'], 'success')
+        self.assertEqual(self.chapa.requests[-2:], [('GET', '/v1/transaction/verify/tx-1')] * 2)
+
+        self.chapa.fail(1)
+        with self.assertRaises(ChapaUnavailable):
+            self.initialize('tx-2')
+        self.assertEqual([path for _, path in self.chapa.requests].count('/v1/transaction/initialize'), 2)
+
+    # --- TEST 3: A slow gateway is cut off at the read timeout ---
+    def test_read_timeout(self):
+        self.chapa.delay = 2
+        client = ChapaClient(self.chapa.url, 'TEST-KEY', read_timeout=0.2, retries=0)
+        started = time.monotonic()
+        with self.assertRaises(ChapaUnavailable):
+            client.verify('tx-1')
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    # --- TEST 4: Repeated failures open the circuit, a trial call closes it again ---
+    def test_circuit_breaker(self):
+        self.client.breaker = CircuitBreaker(threshold=2, reset_timeout=0.3)
+        self.chapa.fail(10)
+        for _ in range(2):
+            with self.assertRaises(ChapaUnavailable):
+                self.initialize()
+        self.assertTrue(self.client.breaker.is_open)
+
+        # Open: the gateway is not even called
+        seen = len(self.chapa.requests)
+        with self.assertRaises(ChapaUnavailable):
+            self.initialize()
+        self.assertEqual(len(self.chapa.requests), seen)
+
+        time.sleep(0.35)
+        self.chapa.fail(0)
+        self.assertEqual(self.initialize()['status'], 'success')
+        self.assertFalse(self.client.breaker.is_open)
+
+    # --- TEST 5: 4xx answers are returned, not counted as failures ---
+    def test_rejections_are_returned(self):
+        self.assertEqual(self.client.verify('unknown')['status'], 'failed')
+        self.assertEqual(self.client.breaker.failures, 0)
+
+    # --- TEST 6: The async client makes the same calls ---
+    def test_async_client(self):
+        async def pay():
+            client = AsyncChapaClient(self.client)
+            await client.initialize({'amount': '1', 'tx_ref': 'tx-async'})
+            return await client.verify('tx-async')
+
+        self.assertEqual(asyncio.run(pay())['data']['tx_ref'], 'tx-async')
+
+
+class PaymentGatewayTests(APITestCase):
+    """
+    Initiate and verify a payment end to end against the fake gateway.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.chapa = FakeChapa().start()
+        self.addCleanup(self.chapa.stop)
+        settings = override_settings(CHAPA_BASE_URL=self.chapa.url, CHAPA_RETRIES=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=product, sku_variant="AIRMAX-S", inventory_count=5)
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product_variant=self.variant, quantity=2)
+        self.client.force_authenticate(self.user)
+        self.order = Order.objects.get(
+            pk=self.client.post('/api/v1/orders/', {'cart_id': str(cart.id)}, format='json').data['id']
+        )
+
+    def initiate(self):
+        response = self.client.post(f'/api/v1/payment/initiate/{self.order.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.chapa.transactions[response.data['tx_ref']]['amount'], '200.00')
+        return response.data['tx_ref']
+
+    # --- TEST 1: A verified payment completes the order and takes its stock ---
+    def test_pay(self):
+        tx_ref = self.initiate()
+        response = self.client.get(f'/api/v1/payment/verify/{tx_ref}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.order.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'C')
+        self.assertEqual((self.variant.inventory_count, self.variant.reserved_count), (3, 0))
+
+    # --- TEST 2: A declined payment gives the stock back ---
+    def test_declined(self):
+        tx_ref = self.initiate()
+        self.chapa.outcome = 'failed'
+        self.assertEqual(self.client.get(f'/api/v1/payment/verify/{tx_ref}/').status_code, status.HTTP_400_BAD_REQUEST)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.available_count, 5)
+
+    # --- TEST 3: Gateway down: a 502, and the order keeps its stock until we know ---
+    def test_gateway_down(self):
+        tx_ref = self.initiate()
+        self.chapa.fail(1)
+        self.assertEqual(self.client.get(f'/api/v1/payment/verify/{tx_ref}/').status_code, status.HTTP_502_BAD_GATEWAY)
+        self.order.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.variant.reserved_count), ('P', 2))
+
+        # Verifying again once it is back settles it
+        self.assertEqual(self.client.get(f'/api/v1/payment/verify/{tx_ref}/').status_code, status.HTTP_200_OK)
+
+
+class ReservationConcurrencyTests(TransactionTestCase):
+    """
+    Payments committing while the expiry task runs: one lock order, no deadlocks.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variant = ProductVariant.objects.create(product=product, sku_variant="AIRMAX-S", inventory_count=50)
+
+    def expired_order(self):
+        past = timezone.now() - timezone.timedelta(seconds=1)
+        order = Order.objects.create(user=self.user, reserved_until=past)
+        OrderItem.objects.create(order=order, product_variant=self.variant, quantity=1, unit_price=100)
+        with transaction.atomic():
+            reservations.record(order, reserve_stock({self.variant.pk: 1}))
+        return order
+
+    # --- TEST 1: An order whose payment is committing is skipped by the expiry task, not waited on ---
+    def test_expiry_skips_committing_order(self):
+        order = self.expired_order()
+        locked, expired = threading.Event(), threading.Event()
+
+        def pay():
+            try:
+                with transaction.atomic():
+                    # commit() starts by locking the order row, then waits here
+                    Order.objects.select_for_update().get(pk=order.pk)
+                    locked.set()
+                    expired.wait(5)
+                    reservations.commit(order)
+            finally:
+                connection.close()  # each worker thread has its own connection
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            payment = pool.submit(pay)
+            locked.wait(5)
+            started = time.monotonic()
+            self.assertEqual(reservations.release_expired(), 0)
+            self.assertLess(time.monotonic() - started, 1)
+            expired.set()
+            payment.result()
+
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.inventory_count, self.variant.reserved_count), (49, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    # --- TEST 2: Commits racing the expiry task all finish, and every unit is accounted for ---
+    def test_commit_races_expiry(self):
+        orders = [self.expired_order() for _ in range(12)]
+
+        def pay(order):
+            try:
+                reservations.commit(order)
+                return 'paid'
+            finally:
+                connection.close()
+
+        def expire(_):
+            try:
+                return reservations.release_expired(batch_size=2)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            paid = [pool.submit(pay, order) for order in orders]
+            reaped = [pool.submit(expire, n) for n in range(4)]
+            self.assertEqual([future.result() for future in paid], ['paid'] * 12)
+            [future.result() for future in reaped]
+
+        # Paid before or after its hold was released, each order took its unit exactly once
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.inventory_count, self.variant.reserved_count), (38, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """
+    Real concurrent checkouts (hence TransactionTestCase): never sell more than is in stock.
+    """
+    BUYERS = 30
+    STOCK = 10
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        product = Product.objects.create(name="Air Max", base_price=100, sku_base="AIRMAX")
+        self.variants = [
+            ProductVariant.objects.create(product=product, sku_variant=f"AIRMAX-{size}", inventory_count=self.STOCK)
+            for size in ("S", "L")
+        ]
+        self.carts = []
+        for i in range(self.BUYERS):
+            cart = Cart.objects.create()
+            # Every basket holds both variants, in alternating order
+            for variant in (self.variants if i % 2 else self.variants[::-1]):
+                CartItem.objects.create(cart=cart, product_variant=variant, quantity=1)
+            self.carts.append(cart)
+
+    def checkout(self, cart):
+        try:
+            client = APIClient()
+            client.force_authenticate(self.user)
+            return client.post('/api/v1/orders/', {'cart_id': str(cart.id)}, format='json').status_code
+        finally:
+            connection.close()  # each worker thread has its own connection
+
+    # --- TEST 1: Parallel checkouts sell exactly the stock, the rest get 409s ---
+    def test_no_oversell(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = list(pool.map(self.checkout, self.carts))
+
+        self.assertEqual(codes.count(201), self.STOCK)
+        self.assertEqual(codes.count(409), self.BUYERS - self.STOCK)
+        roll_up_slots()
+        self.assertEqual([v.available_count for v in ProductVariant.objects.order_by('id')], [0, 0])
+        self.assertEqual(OrderItem.objects.count(), 2 * self.STOCK)
+
+
+class ShardedCheckoutConcurrencyTests(CheckoutConcurrencyTests):
+    """
+    The same race on a flash-sale variant whose stock is split across slots.
+    """
+
+    def setUp(self):
+        super().setUp()
+        shard_inventory(self.variants[0].pk, 4)
+
+
+class CheckoutBenchmarkTests(TransactionTestCase):
+
+    # --- TEST 1: Both runs check their own accounting and clean up after themselves ---
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_checkout', checkouts=60, workers=8, stock=20, shards=4, seed=1, stdout=out)
+        self.assertEqual(out.getvalue().count('No oversell'), 2)
+        self.assertIn('orders/s of the single-row path', out.getvalue())
+        self.assertFalse(Product.objects.filter(sku_base__startswith='BENCH-').exists())
@@ -1,93 +1,137 @@
-import requests
 import uuid
 import os
+import logging
 import traceback # Added for detailed error logs
+from functools import partial
 from django.conf import settings
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.utils import timezone
 
 from rest_framework import viewsets, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django_filters.rest_framework import DjangoFilterBackend
 
+from .filters import OrderFilter
 from .models import Order, OrderItem, Payment
+from .pagination import OrderCursorPagination
 from .serializers import OrderSerializer, CreateOrderSerializer
-from cart.models import Cart
+from cart.stores import get_cart_store
+from catalogue.inventory import InsufficientStock, reserve_stock
+from core.conditional import conditional_response
+from core.idempotency import idempotent
+from . import reservations
+from .chapa import ChapaUnavailable, get_client
 from .tasks import send_order_confirmation, send_payment_success_email
 
+logger = logging.getLogger(__name__)
+
 class OrderViewSet(viewsets.ModelViewSet):
     http_method_names = ['get', 'post', 'head', 'options', 'delete']
+
+    # ?payment_status=, ?placed_after= / ?placed_before=, ?user= (staff)
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+
+    # Keyset pages: ?cursor=... seeks on (placed_at, id), never OFFSET
+    pagination_class = OrderCursorPagination
     
     def get_permissions(self):
         if self.request.method in ['POST']:
             return [IsAuthenticated()] 
         return [IsAuthenticated()]
 
+    # Retries with the same Idempotency-Key get the first order back instead of a new one
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         cart_id = serializer.validated_data['cart_id']
 
-        # 1. Retrieve the Cart
-        try:
-            cart = Cart.objects.get(id=cart_id)
-        except Cart.DoesNotExist:
+        # 1. Retrieve the Cart (from whichever store is configured, lines and variants included)
+        cart_store = get_cart_store()
+        cart = cart_store.get(cart_id)
+        if cart is None:
             return Response({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
 
         # 2. Check if Cart is empty
-        cart_items = cart.items.all()
-        if not cart_items.exists():
+        cart_items = list(cart.items.all())
+        if not cart_items:
             return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
 
         # 3. THE TRANSACTION (All or Nothing)
         with transaction.atomic():
-            # A. Create the Order
-            order = Order.objects.create(user=request.user)
-
-            # B. Move items from Cart to Order
-            order_items = []
-            for item in cart_items:
-                # Check Stock
-                variant = item.product_variant
-                if variant.inventory_count < item.quantity:
-                    # Rollback everything if out of stock
-                    raise Exception(f"Not enough stock for {variant}")
-
-                # Create Order Item (Freezing the price)
-                current_price = variant.product.base_price + variant.price_adjustment
-                
-                order_item = OrderItem(
-                    order=order,
-                    product_variant=variant,
+            # A. Hold the stock until the payment comes back (or the hold expires):
+            # one conditional UPDATE, rows locked in id order.
+            # Short lines raise InsufficientStock (409) and roll everything back.
+            holds = reserve_stock({item.product_variant_id: item.quantity for item in cart_items})
+
+            # B. Freeze the lines: price, names and labels as they are right now
+            order_items = [
+                OrderItem(
+                    product_variant=item.product_variant,
                     quantity=item.quantity,
-                    unit_price=current_price
+                    unit_price=item.product_variant.product.base_price + item.product_variant.price_adjustment,
+                    product_name=item.product_variant.product.name,
+                    variant_label=str(item.product_variant),
                 )
-                order_items.append(order_item)
-
-                # Deduct Inventory
-                variant.inventory_count -= item.quantity
-                variant.save()
-
-            # Bulk create implies faster database performance
+                for item in cart_items
+            ]
+
+            # C. Create the Order with its totals, and its holds
+            order = Order.objects.create(
+                user=request.user,
+                reserved_until=reservations.hold_until(),
+                total_amount=sum(line.get_total_price() for line in order_items),
+                item_count=sum(line.quantity for line in order_items),
+            )
+            reservations.record(order, holds)
+            for line in order_items:
+                line.order = order
+
+            # D. Bulk create implies faster database performance
             OrderItem.objects.bulk_create(order_items)
 
-            # C. Delete the Cart
-            cart.delete()
+            # E. Delete the Cart
+            cart_store.delete(cart_id)
 
-        # We trigger the task here, AFTER the transaction block closes.
-        send_order_confirmation.delay(order.id)
+            # F. Queue the confirmation once the order is committed. robust: if the broker is down it is
+            # logged, and the order (already placed) is still answered
+            transaction.on_commit(lambda: send_order_confirmation.delay(order.id), robust=True)
 
         # Return the receipt
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def retrieve(self, request, *args, **kwargs):
+        # Only the timestamp is read up front; unchanged orders get a 304 without loading their items
+        try:
+            order_id = uuid.UUID(str(kwargs['pk']))
+        except ValueError:
+            raise Http404
+        updated_at = self.get_queryset().filter(pk=order_id).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            raise Http404
+        # Lines are snapshots, so catalogue changes can't alter the response
+        etag = f'{order_id}-{updated_at.timestamp()}'
+        return conditional_response(
+            request, partial(super().retrieve, request, *args, **kwargs), etag=etag, last_modified=updated_at,
+        )
+
+    def perform_destroy(self, instance):
+        # Give its held stock back first, the holds would go with the order otherwise
+        reservations.release([instance.pk])
+        instance.delete()
+
     def get_queryset(self):
         # Users can only see their own orders
         user = self.request.user
-        if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+        queryset = Order.objects.all() if user.is_staff else Order.objects.filter(user=user)
+        # Lines are snapshots (no catalogue joins), so a page is always two queries: orders, then their items
+        return queryset.prefetch_related('items')
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -98,6 +142,8 @@ class OrderViewSet(viewsets.ModelViewSet):
 class InitiatePaymentView(APIView):
     permission_classes = [IsAuthenticated]
 
+    # Retries with the same Idempotency-Key get the same payment link, Chapa is only called once
+    @idempotent
     def post(self, request, order_id):
         try:
             # 1. Get the Order safely
@@ -107,8 +153,12 @@ class InitiatePaymentView(APIView):
             if hasattr(order, 'payment') and order.payment.status == "Completed":
                 return Response({"error": "Order already paid"}, status=status.HTTP_400_BAD_REQUEST)
 
-            # 3. Calculate Total Price
-            total_price = sum(item.get_total_price() for item in order.items.all())
+            # The stock is only held for so long (see reservations.py)
+            if order.payment_status == 'E' or (order.reserved_until and order.reserved_until <= timezone.now()):
+                return Response({"error": "This order's stock reservation has expired, please order again"}, status=status.HTTP_409_CONFLICT)
+
+            # 3. Total Price (written at checkout)
+            total_price = order.total_amount
             
             # Safety Check: Cannot pay for free/empty orders
             if total_price <= 0:
@@ -134,16 +184,10 @@ class InitiatePaymentView(APIView):
                 "return_url": f"http://127.0.0.1:8000/api/v1/payment/verify/{tx_ref}/"
             }
 
-            headers = {
-                "Authorization": f"Bearer {chapa_key}",
-                "Content-Type": "application/json"
-            }
-
-            # 7. Call Chapa API
+            # 7. Call Chapa API (pooled connection, timeouts, circuit breaker: see chapa.py)
             try:
-                response = requests.post("https://api.chapa.co/v1/transaction/initialize", json=payload, headers=headers)
-                data = response.json()
-            except Exception as api_error:
+                data = get_client().initialize(payload)
+            except ChapaUnavailable as api_error:
                 return Response({"error": "Failed to connect to Chapa", "details": str(api_error)}, status=status.HTTP_502_BAD_GATEWAY)
 
             if data.get('status') == 'success':
@@ -173,30 +217,38 @@ class VerifyPaymentView(APIView):
         try:
             payment = Payment.objects.get(transaction_id=tx_ref)
             
-            headers = {
-                "Authorization": f"Bearer {settings.CHAPA_SECRET_KEY}"
-            }
-            
             # 1. Verify with Chapa
-            response = requests.get(f"https://api.chapa.co/v1/transaction/verify/{tx_ref}", headers=headers)
-            data = response.json()
+            try:
+                data = get_client().verify(tx_ref)
+            except ChapaUnavailable as api_error:
+                # The outcome is unknown: leave the payment and its stock as they are, verifying again is safe
+                return Response({"error": "Failed to connect to Chapa", "details": str(api_error)}, status=status.HTTP_502_BAD_GATEWAY)
 
             if data.get('status') == 'success':
                 # 2. Update Payment
                 payment.status = "Completed"
                 payment.save()
 
-                # 3. Update Order Status
+                # 3. Take the stock the order was holding
+                try:
+                    reservations.commit(payment.order)
+                except InsufficientStock as error:
+                    # Paid after its hold expired, and sold out since: needs a refund by hand
+                    logger.error("Order %s was paid but is out of stock: %s", payment.order.id, error.lines)
+
+                # 4. Update Order Status
                 payment.order.payment_status = 'C' # 'C' = Complete
                 payment.order.save()
 
-                # 4. Trigger Celery Task
+                # 5. Trigger Celery Task
                 send_payment_success_email.delay(payment.order.id)
 
                 return Response({"message": "Payment Successful"}, status=status.HTTP_200_OK)
             else:
                 payment.status = "Failed"
                 payment.save()
+                # Nobody is buying this stock any more
+                reservations.release([payment.order.id])
                 payment.order.payment_status = 'F'
                 payment.order.save()
                 return Response({"message": "Payment Failed"}, status=status.HTTP_400_BAD_REQUEST)